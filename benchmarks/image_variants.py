@@ -0,0 +1,96 @@
+"""
+Benchmarks the upload of an image, and the bytes served per page of the history of a room.
+
+The "inline" upload generates the variants in the request, the "deferred" upload only validates the
+image like the upload request does, the variants being generated by `df_chat.tasks.process_image_task`.
+A page of the history is served either with the originals, or with the thumbnails (see `df_chat.images`).
+
+Usage: python benchmarks/image_variants.py
+"""
+from PIL import Image
+from timeit import timeit
+
+import io
+import random
+
+
+# The variants of the IMAGE_VARIANTS setting by default
+VARIANTS = {"preview": 1280, "thumbnail": 320}
+PAGE_SIZE = 50
+REPEAT = 5
+
+
+def build_photo(size):
+    """
+    A noisy image, which compresses like a photo rather than a flat color.
+    """
+    random.seed(0)
+    image = Image.new("RGB", (size[0] // 8, size[1] // 8))
+    image.putdata(
+        [
+            tuple(random.randrange(256) for _ in range(3))
+            for _ in range(image.width * image.height)
+        ]
+    )
+    content = io.BytesIO()
+    image.resize(size, Image.BILINEAR).save(content, "JPEG", quality=90)
+    return content.getvalue()
+
+
+def validate(content):
+    # What the ImageField of the upload does: verifying the image and reading its dimensions
+    Image.open(io.BytesIO(content)).verify()
+    return Image.open(io.BytesIO(content)).size
+
+
+def generate_variants(content):
+    variants = {}
+    source = Image.open(io.BytesIO(content))
+    source.draft("RGB", (max(VARIANTS.values()),) * 2)
+    source = source.convert("RGB")
+    for variant, max_size in sorted(
+        VARIANTS.items(), key=lambda item: item[1], reverse=True
+    ):
+        source = source.copy()
+        source.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        source.save(output, "WEBP", quality=80)
+        variants[variant] = output.getvalue()
+    return variants
+
+
+def inline_upload(content):
+    validate(content)
+    generate_variants(content)
+
+
+def deferred_upload(content):
+    validate(content)
+
+
+def main():
+    print(f"Upload of one image, best of {REPEAT}")
+    print(f"{'size':>10} {'inline':>10} {'deferred':>10}")
+    photos = {}
+    for size in ((1280, 960), (4000, 3000)):
+        photos[size] = content = build_photo(size)
+        timings = [
+            min(timeit(lambda: upload(content), number=1) for _ in range(REPEAT))
+            for upload in (inline_upload, deferred_upload)
+        ]
+        print(
+            f"{size[0]:>5}x{size[1]:<4} {timings[0] * 1000:>7.1f} ms {timings[1] * 1000:>7.1f} ms"
+        )
+
+    print(f"\nBytes served by a page of {PAGE_SIZE} messages with one image each")
+    print(f"{'size':>10} {'originals':>12} {'thumbnails':>12}")
+    for size, content in photos.items():
+        thumbnail = generate_variants(content)["thumbnail"]
+        print(
+            f"{size[0]:>5}x{size[1]:<4} {len(content) * PAGE_SIZE / 1024:>9.0f} KB"
+            f" {len(thumbnail) * PAGE_SIZE / 1024:>9.0f} KB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmarks the fan-out of a message event to the consumers of a room.
+
+The "per recipient" path is the one used before, where every consumer resolves "is_me" in the
+serialized message and encodes it to JSON. The "shared frame" path encodes the message once,
+and every consumer only substitutes the "is_me" markers.
+
+Usage: python benchmarks/message_fanout.py
+"""
+from copy import deepcopy
+from pathlib import Path
+from timeit import timeit
+
+import json
+import sys
+
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from df_chat.asgi.frames import encode_message  # noqa: E402
+from df_chat.asgi.frames import join_frame  # noqa: E402
+from df_chat.asgi.frames import resolve_is_me  # noqa: E402
+
+
+RECIPIENTS = 500
+REPEAT = 5
+
+
+def build_message(user_pk, reaction_count=0, image_count=0, is_reaction=False):
+    return {
+        "id": "ABCDEFGHIJKLM",
+        "created": "2023-05-16T22:12:00.000000Z",
+        "modified": "2023-05-16T22:12:00.000000Z",
+        "room_user_id": "NOPQRSTUVWXYZ",
+        "is_me": user_pk,
+        "room_id": "1234567890ABC",
+        "images": [
+            {
+                "id": f"IMAGE{index:08d}",
+                "message_id": "ABCDEFGHIJKLM",
+                "image": f"https://cdn.example.com/images/messages/ABCDEFGHIJKLM/{index}.jpg",
+                "height": 300,
+                "width": 500,
+                "name": f"{index}.jpg",
+                "size": 123456,
+            }
+            for index in range(image_count)
+        ],
+        "reactions": [
+            build_message(index % RECIPIENTS, is_reaction=True)
+            for index in range(reaction_count)
+        ],
+        "body": "👍" if is_reaction else "Lorem ipsum dolor sit amet " * 4,
+        "parent_id": None,
+        "is_reaction": is_reaction,
+    }
+
+
+def resolve_is_me_in_message(message, user_pk):
+    if not isinstance(message["is_me"], bool):
+        message["is_me"] = message["is_me"] == user_pk
+
+
+def per_recipient(message):
+    for user_pk in range(RECIPIENTS):
+        # the observer deep copies the event for every consumer
+        received = deepcopy({"body": message})["body"]
+        resolve_is_me_in_message(received, user_pk)
+        for reaction in received["reactions"]:
+            resolve_is_me_in_message(reaction, user_pk)
+        json.dumps({"messages": [received], "users": []})
+
+
+def shared_frame(message):
+    encoded_message, marker = encode_message(message)
+    for user_pk in range(RECIPIENTS):
+        received = deepcopy({"body": {"message": encoded_message, "marker": marker}})[
+            "body"
+        ]
+        join_frame(
+            messages=[resolve_is_me(received["message"], received["marker"], user_pk)]
+        )
+
+
+def main():
+    print(f"Fan-out of one message to {RECIPIENTS} recipients, best of {REPEAT}")
+    print(
+        f"{'reactions':>10} {'images':>7} {'per recipient':>15} {'shared frame':>14} {'speedup':>8}"
+    )
+    for reaction_count, image_count in ((0, 0), (0, 4), (20, 1), (100, 4)):
+        message = build_message(1, reaction_count, image_count)
+        timings = []
+        for path in (per_recipient, shared_frame):
+            timings.append(
+                min(timeit(lambda: path(message), number=1) for _ in range(REPEAT))
+            )
+        print(
+            f"{reaction_count:>10} {image_count:>7} {timings[0] * 1000:>12.1f} ms"
+            f" {timings[1] * 1000:>11.1f} ms {timings[0] / timings[1]:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmarks the full-text search of the messages on SQLite, against scanning their bodies.
+
+A synthetic dataset of messages spread over rooms is indexed with the FTS5 table and the triggers of the
+`0020_message_search` migration. The ranked query is the one built by `df_chat.search.search_messages`,
+it is timed for a common and a rare term, within a room and across all the rooms.
+
+Usage: python benchmarks/message_search.py [--messages 1000000]
+"""
+from pathlib import Path
+from timeit import timeit
+
+import argparse
+import importlib
+import random
+import sqlite3
+import sys
+
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+migration = importlib.import_module("df_chat.migrations.0020_message_search")
+
+
+ROOMS = 1000
+PAGE_SIZE = 20
+REPEAT = 5
+WORDS = [f"word{index}" for index in range(5000)]
+# The common term is in about 10% of the messages, the rare one in about 0.01%
+COMMON_TERM, RARE_TERM = "lunch", "zeppelin"
+
+SCAN_QUERY = """
+    SELECT id FROM df_chat_message
+    WHERE body LIKE ? AND is_reaction = 0 {room_filter}
+    ORDER BY created DESC, id DESC LIMIT ?
+"""
+SEARCH_QUERY = """
+    SELECT df_chat_message.id, -bm25(df_chat_message_fts) AS rank
+    FROM df_chat_message
+    INNER JOIN df_chat_message_fts ON df_chat_message.id = df_chat_message_fts.rowid
+    WHERE df_chat_message_fts.body MATCH ? AND is_reaction = 0 {room_filter}
+    ORDER BY rank DESC, df_chat_message.id DESC LIMIT ?
+"""
+
+
+def build_body(rng):
+    words = rng.choices(WORDS, k=rng.randint(3, 20))
+    if rng.random() < 0.1:
+        words.append(COMMON_TERM)
+    if rng.random() < 0.0001:
+        words.append(RARE_TERM)
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def build_database(message_count):
+    rng = random.Random(0)
+    connection = sqlite3.connect(":memory:")
+    connection.execute(
+        """
+        CREATE TABLE df_chat_message (
+            id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+            room_id bigint NOT NULL,
+            body text NOT NULL,
+            is_reaction bool NOT NULL,
+            created datetime NOT NULL
+        )
+        """
+    )
+    connection.executemany(
+        "INSERT INTO df_chat_message (room_id, body, is_reaction, created) VALUES (?, ?, 0, ?)",
+        (
+            (rng.randrange(ROOMS), build_body(rng), index)
+            for index in range(message_count)
+        ),
+    )
+    connection.execute(
+        "CREATE INDEX df_chat_message_list ON df_chat_message (room_id, created DESC, id DESC)"
+    )
+    for sql in migration.SQLITE_FORWARD:
+        connection.execute(sql)
+    connection.commit()
+    return connection
+
+
+def run(connection, query, term, room_id):
+    room_filter = "AND room_id = ?" if room_id is not None else ""
+    room_params = (room_id,) if room_id is not None else ()
+    if query is SCAN_QUERY:
+        params = (f"%{term}%", *room_params, PAGE_SIZE)
+    else:
+        params = (f'"{term}"', *room_params, PAGE_SIZE)
+    return connection.execute(query.format(room_filter=room_filter), params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    args = parser.parse_args()
+
+    build_time = timeit(
+        lambda: globals().update(db=build_database(args.messages)), number=1
+    )
+    connection = globals()["db"]
+    print(f"{args.messages} messages in {ROOMS} rooms, indexed in {build_time:.1f} s")
+    print(f"First page of {PAGE_SIZE} results, best of {REPEAT}")
+    print(f"{'term':>10} {'scope':>8} {'scan':>12} {'search':>12}")
+    for term in (COMMON_TERM, RARE_TERM):
+        for scope, room_id in (("room", 1), ("all", None)):
+            timings = [
+                min(
+                    timeit(lambda: run(connection, query, term, room_id), number=1)
+                    for _ in range(REPEAT)
+                )
+                for query in (SCAN_QUERY, SEARCH_QUERY)
+            ]
+            print(
+                f"{term:>10} {scope:>8} {timings[0] * 1000:>9.1f} ms {timings[1] * 1000:>9.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -37,7 +37,5 @@ class MessageImageInline(admin.TabularInline):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    def room(self, obj):
-        return obj.room_user.room
-
     list_display = ("room", "body", "room_user", "parent", "created", "modified")
+    list_select_related = ("room", "room_user__room", "room_user__user", "parent")
@@ -1,15 +1,52 @@
+from .frames import encode_message
+from .frames import FrameBuffer
+from .frames import join_frame
+from .frames import resolve_is_me
+from .receipts import receipt_writer
+from .serializers import AsyncMessageSerializer
+from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from collections import defaultdict
 from df_chat.drf.serializers import MessageSerializer
 from df_chat.drf.serializers import RoomSerializer
 from df_chat.drf.serializers import RoomUserSerializer
 from df_chat.models import Message
+from df_chat.models import MessageReactionCount
 from df_chat.models import Room
 from df_chat.models import RoomUser
-from df_chat.models import UserChat
+from df_chat.presence import get_presence_backend
+from df_chat.presence import presence_writer
+from df_chat.settings import api_settings
+from df_chat.settings import DeliveryMode
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
 from djangochannelsrestframework.generics import GenericAsyncAPIConsumer
 from djangochannelsrestframework.observer import model_observer
 from djangochannelsrestframework.observer import ModelObserver
-from .serializers import AsyncMessageSerializer
+from djangochannelsrestframework.observer.model_observer import Action
+from functools import partial
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import ValidationError
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import asyncio
+import json
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
 
 def post_init_receiver(self, instance, **kwargs):
     self.get_observer_state(instance).current_groups = set()
@@ -18,6 +55,27 @@ def post_init_receiver(self, instance, **kwargs):
 ModelObserver.post_init_receiver = post_init_receiver
 
 
+def groups_for_rooms(room_pks: Iterable, prefix: str) -> Dict[str, List[str]]:
+    """
+    Resolves the groups the events occurring in rooms should be sent to, by room pk.
+
+    In the user delivery mode, the room membership is resolved once (a single query on the
+    Room.users through table) and the events are fanned out to the group of every member.
+    """
+    if api_settings.DELIVERY_MODE == DeliveryMode.USER:
+        groups = defaultdict(list)
+        for room_pk, user_pk in Room.users.through.objects.filter(
+            room_id__in=room_pks
+        ).values_list("room_id", "user_id"):
+            groups[str(room_pk)].append(f"-user__{user_pk}")
+        return groups
+    return {str(room_pk): [f"{prefix}{room_pk}"] for room_pk in room_pks}
+
+
+def groups_for_room(room_pk, prefix: str) -> Iterator[str]:
+    yield from groups_for_rooms([room_pk], prefix).get(str(room_pk), [])
+
+
 class RoomsConsumer(GenericAsyncAPIConsumer):
     """
     A websocket consumer to allow users to listen to all activities in rooms.
@@ -30,6 +88,21 @@ class RoomsConsumer(GenericAsyncAPIConsumer):
     serializer_class = RoomSerializer
     user = None
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The rooms this consumer is currently subscribed to, so that we can unsubscribe without querying the database.
+        self.subscribed_room_pks = set()
+        self.frame_buffer = None
+        # Maps the rooms of the user to their active RoomUser, so that sending a message doesn't query them.
+        self.room_user_pks = {}
+        # The rooms whose RoomUser was created on connect, and broadcasted already.
+        self.provisioned_room_pks = set()
+        self.heartbeat_task = None
+        # The last time an ephemeral event was sent, by room and event, to rate limit them.
+        self.room_event_times = {}
+        # The rooms watched by the client in the user delivery mode, see watch_room.
+        self.watched_room_pks = set()
+
     async def connect(self):
         self.user = self.scope["user"]
 
@@ -37,7 +110,13 @@ class RoomsConsumer(GenericAsyncAPIConsumer):
             await self.close()
             return
 
-        await self.user_connect()
+        if api_settings.OUTBOUND_BUFFER_WINDOW:
+            self.frame_buffer = FrameBuffer(
+                self.send,
+                window=api_settings.OUTBOUND_BUFFER_WINDOW / 1000,
+                max_events=api_settings.OUTBOUND_BUFFER_MAX_EVENTS,
+            )
+        went_online = await self.user_connect()
         await self.subscribe_to_rooms_activities()
         # TODO(eugapx) subscribe to group for this room only instead of one global group
         # so that when you broadcast messages you broarcast them only to the consumers in one room
@@ -45,119 +124,604 @@ class RoomsConsumer(GenericAsyncAPIConsumer):
         # so that peeople in private group can't hack messages in private group that they receive
 
         await self.accept()
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+        if went_online:
+            await self.broadcast_presence(
+                {
+                    room_pk: room_user_pk
+                    for room_pk, room_user_pk in self.room_user_pks.items()
+                    if room_pk not in self.provisioned_room_pks
+                }
+            )
 
     async def disconnect(self, close_code):
         # When the user disconnects, we should unsubscribe them from listening to all activities.
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
         await self.unsubscribe_from_all_activities()
         await self.user_disconnect()
-    
+        if self.frame_buffer is not None:
+            self.frame_buffer.close()
+            logger.debug(
+                "Outbound buffer of %s: %d events sent in %d frames (%d frames saved), "
+                "added latency %.1f ms on average, %.1f ms at most",
+                self.channel_name,
+                self.frame_buffer.event_count,
+                self.frame_buffer.frame_count,
+                self.frame_buffer.frames_saved,
+                self.frame_buffer.average_latency * 1000,
+                self.frame_buffer.max_latency * 1000,
+            )
+
+    async def send_frame(
+        self,
+        messages: Iterable[str] = (),
+        users: Iterable[str] = (),
+        events: Iterable[str] = (),
+    ):
+        """
+        Sends encoded messages, users and ephemeral events to the client, through the outbound buffer if it is enabled.
+        """
+        if self.frame_buffer is not None:
+            await self.frame_buffer.add(messages=messages, users=users, events=events)
+        else:
+            await self.send(
+                text_data=join_frame(messages=messages, users=users, events=events)
+            )
+
     async def receive(self, text_data):
+        """
+        Creates a message sent by the client, and replies with an acknowledgement holding its id.
+
+        The client can send a `client_id` as an idempotency key, so that retrying to send a message
+        doesn't create it twice, and a `request_id` to match the acknowledgement with the message.
+
+        With the "send_event" action, the client sends an ephemeral event (e.g. typing) to a room instead,
+        see `send_room_event`.
+        """
         data = await self.decode_json(text_data)
-        extra_context = {"room_id": data.pop("room_id", None)}
+        request_id = data.pop("request_id", None)
+        room_id = data.pop("room_id", None)
+        action = data.pop("action", "create_message")
+        if action in ("send_event", "watch_room", "unwatch_room"):
+            try:
+                if action == "send_event":
+                    await self.send_room_event(room_id, data.get("event"))
+                elif action == "watch_room":
+                    await self.watch_room(room_id)
+                else:
+                    await self.unwatch_room(room_id)
+            except Exception as exc:
+                await self.handle_exception(exc, action=action, request_id=request_id)
+            return
+
+        extra_context = {
+            "room_id": room_id,
+            "room_user_pk": self.room_user_pks.get(str(room_id)),
+        }
 
         context = self.get_serializer_context(**extra_context)
         serializer = AsyncMessageSerializer(data=data, context=context)
 
-        await serializer.is_valid(raise_exception=True)
-        await serializer.save()
+        try:
+            message = await serializer.create_message()
+        except Exception as exc:
+            await self.handle_exception(
+                exc, action="create_message", request_id=request_id
+            )
+            return
+
+        self.room_user_pks[str(room_id)] = message.room_user_id
+        await self.reply(
+            action="create_message",
+            data={"id": str(message.pk), "client_id": message.client_id},
+            status=201,
+            request_id=request_id,
+        )
+
+    async def send_room_event(self, room_id, event: str):
+        """
+        Sends an ephemeral event of the user (e.g. typing) to the members of a room.
+
+        The event goes straight through the channel layer: it isn't stored, and doesn't query the database,
+        as the access to the room is checked with the memberships cached by the consumer.
+        The events are rate limited, the ones sent too often are dropped.
+        """
+        room_pk = str(room_id)
+        if event not in api_settings.EPHEMERAL_EVENTS:
+            raise ValidationError({"event": f"Unknown event {event!r}"})
+        if room_pk not in self.room_user_pks:
+            raise PermissionDenied(detail="user isn't a member of the room")
+
+        now = time.monotonic()
+        last_sent = self.room_event_times.get((room_pk, event))
+        if (
+            last_sent is not None
+            and now - last_sent < api_settings.EPHEMERAL_EVENT_INTERVAL
+        ):
+            return
+        self.room_event_times[(room_pk, event)] = now
+
+        observer = type(self).room_user_activity
+        for group_name in observer.group_names_for_signal(
+            instance=None, groups=[f"-room__{room_pk}"]
+        ):
+            await self.channel_layer.group_send(
+                group_name,
+                {
+                    "type": "room.event",
+                    "user_pk": self.user.pk,
+                    "event": {
+                        "room_id": room_pk,
+                        "room_user_id": str(self.room_user_pks[room_pk]),
+                        "event": event,
+                    },
+                    "expires_at": time.time() + api_settings.EPHEMERAL_EVENT_TTL,
+                },
+            )
+
+    async def room_event(self, message: dict):
+        """
+        Sends an ephemeral event to the client, with the number of seconds it is valid for.
+        The events of the user and the ones which expired on the way are dropped.
+        """
+        expires_in = message["expires_at"] - time.time()
+        if message["user_pk"] == self.user.pk or expires_in <= 0:
+            return
+        await self.send_frame(
+            events=[
+                json.dumps({**message["event"], "expires_in": round(expires_in, 3)})
+            ]
+        )
+
+    async def watch_room(self, room_id):
+        """
+        In the user delivery mode, the consumer doesn't join the groups of the rooms,
+        so the client watches the rooms it displays to receive their ephemeral events.
+        The room is unwatched when the user leaves it, see room_membership_activity.
+        """
+        room_pk = str(room_id)
+        if room_pk not in self.room_user_pks:
+            raise PermissionDenied(detail="user isn't a member of the room")
+        if (
+            api_settings.DELIVERY_MODE == DeliveryMode.USER
+            and room_pk not in self.watched_room_pks
+        ):
+            await self.room_user_activity.subscribe(room_pk=room_pk)
+            self.watched_room_pks.add(room_pk)
+
+    async def unwatch_room(self, room_id):
+        """
+        Stops receiving the ephemeral events of a room, e.g. when the client doesn't display it anymore.
+        """
+        room_pk = str(room_id)
+        if room_pk in self.watched_room_pks:
+            await self.unsubscribe_from(type(self).room_user_activity, room_pk=room_pk)
+            self.watched_room_pks.discard(room_pk)
 
     @model_observer(RoomUser, serializer_class=RoomUserSerializer)
     async def room_user_activity(self, message: dict, **kwargs):
         self._resolve_is_me(message)
-        await self.send_json(
-            {
-                "messages": [],
-                "users": [message],
-            }
-        )
+        await self.send_frame(users=[json.dumps(message)])
 
-        if message["is_me"] and not message["is_active"]:
-            # Create new room_user if old one was inactivated
-            await self.user_connect()
+        if message["is_me"]:
+            if message["is_active"]:
+                self.room_user_pks[str(message["room_id"])] = message["id"]
+            else:
+                # A new RoomUser is created on the next message sent to the room
+                self.room_user_pks.pop(str(message["room_id"]), None)
 
     @room_user_activity.groups_for_signal
-    def room_user_activity(self, instance: RoomUser, **kwargs):
-        yield f"-room__{instance.room_id}"
+    def room_user_activity(self, instance: RoomUser, groups=None, **kwargs):
+        if groups is not None:
+            # The groups were resolved in bulk, see broadcast_presence
+            yield from groups
+        else:
+            yield from groups_for_room(instance.room_id, "-room__")
 
     @room_user_activity.groups_for_consumer
-    def room_user_activity(self, consumer, room_pk: str):
-        yield f"-room__{room_pk}"
+    def room_user_activity(self, consumer, room_pk: str = None, user_pk: str = None):
+        if room_pk is not None:
+            yield f"-room__{room_pk}"
+        if user_pk is not None:
+            yield f"-user__{user_pk}"
+
+    @model_observer(RoomUser)
+    async def room_membership_activity(self, message: dict, **kwargs):
+        """
+        Keeps the room subscriptions in sync when the user joins or leaves a room while connected.
+
+        The user leaves a room when they are removed from its users, or when their room user is deactivated or deleted.
+        Then the room isn't delivered to the consumer anymore, and it can't be watched.
+        """
+        room_pk = message["room_pk"]
+        if message["is_active"]:
+            if api_settings.DELIVERY_MODE != DeliveryMode.USER:
+                await self.subscribe_to_room(room_pk)
+            return
+        self.room_user_pks.pop(room_pk, None)
+        await self.unwatch_room(room_pk)
+        await self.unsubscribe_from_room(room_pk)
+
+    @room_membership_activity.serializer
+    def room_membership_activity(self, instance: RoomUser, action, **kwargs):
+        return {
+            "room_pk": str(instance.room_id),
+            "is_active": instance.is_active and action != Action.DELETE,
+        }
+
+    @room_membership_activity.groups_for_signal
+    def room_membership_activity(self, instance: RoomUser, **kwargs):
+        if instance.user_id:
+            yield f"-user__{instance.user_id}"
+
+    @room_membership_activity.groups_for_consumer
+    def room_membership_activity(self, consumer, user_pk: str, **kwargs):
+        yield f"-user__{user_pk}"
+
+    async def unsubscribe_from(self, observer, **kwargs):
+        """
+        Discards the groups of an observer. The observers themselves only discard the groups
+        which were subscribed with a request id, which isn't the case of the subscriptions of the consumer.
+        """
+        for group_name in observer.group_names_for_consumer(consumer=self, **kwargs):
+            await self.remove_group(group_name)
 
     @database_sync_to_async
-    def get_rooms(self):
-        rooms = self.user.room_set.all()
+    def get_room_pks(self):
+        room_pks = list(self.user.room_set.values_list("pk", flat=True))
         # ensure that RoomUser objects are created for the user, for all the Rooms he is part of.
-        for room in rooms:
-            # TODO: IMPROVEMENT: A user could be part of multiple rooms. There should be a way to execute this iteration as a batch.
-            RoomUser.objects.get_or_create(
-                room=room,
-                user=self.user,
+        self.provisioned_room_pks = {
+            str(room_user.room_id)
+            for room_user in RoomUser.objects.provision_room_users(
+                self.user.pk, room_pks
             )
-        return rooms
+        }
+        room_pk_set = {str(room_pk) for room_pk in room_pks}
+        self.room_user_pks = {
+            str(room_pk): room_user_pk
+            for room_pk, room_user_pk in RoomUser.objects.filter(
+                user_id=self.user.pk, is_active=True
+            ).values_list("room_id", "pk")
+            if str(room_pk) in room_pk_set
+        }
+        return room_pks
 
     async def subscribe_to_rooms_activities(self, **kwargs):
         """
         Subscribe to all rooms.
+
+        In the user delivery mode, the consumer joins only the group of its user,
+        so the cost of connecting doesn't depend on the number of rooms.
         """
-        rooms = await self.get_rooms()
-        for room in rooms:
-            # subscribe to activities occuring on the RoomUser object
-            await self.room_user_activity.subscribe(room_pk=room.pk)
-            # subscribe to messages being created/updated in a room.
-            await self.message_activity.subscribe(room_pk=room.pk)
+        room_pks = await self.get_room_pks()
+        # listen to the user joining or leaving rooms while connected
+        await self.room_membership_activity.subscribe(user_pk=self.user.pk)
+        if api_settings.DELIVERY_MODE == DeliveryMode.USER:
+            await self.room_user_activity.subscribe(user_pk=self.user.pk)
+            await self.message_activity.subscribe(user_pk=self.user.pk)
+            return
+
+        # receive the events sent to the user only, e.g. delivery receipts
+        await self.room_user_activity.subscribe(user_pk=self.user.pk)
+        for room_pk in room_pks:
+            await self.subscribe_to_room(room_pk)
 
     async def unsubscribe_from_all_activities(self, **kwargs):
         """
-        Unsubscribe from all rooms
+        Unsubscribe from all rooms.
+
+        Only the subscriptions made by this consumer are used, so this doesn't query the database.
         """
-        rooms = await self.get_rooms()
-        for room in rooms:
-            await self.room_user_activity.unsubscribe(room_pk=room.pk)
-            await self.message_activity.unsubscribe(room_pk=room.pk)
+        await self.unsubscribe_from(
+            type(self).room_membership_activity, user_pk=self.user.pk
+        )
+        if api_settings.DELIVERY_MODE == DeliveryMode.USER:
+            await self.unsubscribe_from(
+                type(self).room_user_activity, user_pk=self.user.pk
+            )
+            await self.unsubscribe_from(
+                type(self).message_activity, user_pk=self.user.pk
+            )
+            for room_pk in list(self.watched_room_pks):
+                await self.unwatch_room(room_pk)
+            return
 
-    @model_observer(Message, serializer_class=MessageSerializer)
-    async def message_activity(self, message: dict, **kwargs):
-        self._resolve_is_me(message)
-        for reaction in message["reactions"]:
-            self._resolve_is_me(reaction)
+        await self.unsubscribe_from(type(self).room_user_activity, user_pk=self.user.pk)
+        for room_pk in list(self.subscribed_room_pks):
+            await self.unsubscribe_from_room(room_pk)
 
-        # Do not send empty messages and reactions
-        if (message["body"] or message["images"]) and not message["is_reaction"]:
-            await self.send_json(
-                {
-                    "messages": [message],
-                    "users": [],
-                }
+    async def subscribe_to_room(self, room_pk):
+        room_pk = str(room_pk)
+        if room_pk in self.subscribed_room_pks:
+            return
+        # subscribe to activities occuring on the RoomUser object
+        await self.room_user_activity.subscribe(room_pk=room_pk)
+        # subscribe to messages being created/updated in a room.
+        await self.message_activity.subscribe(room_pk=room_pk)
+        self.subscribed_room_pks.add(room_pk)
+
+    async def unsubscribe_from_room(self, room_pk):
+        room_pk = str(room_pk)
+        if room_pk not in self.subscribed_room_pks:
+            return
+        await self.unsubscribe_from(type(self).room_user_activity, room_pk=room_pk)
+        await self.unsubscribe_from(type(self).message_activity, room_pk=room_pk)
+        self.subscribed_room_pks.discard(room_pk)
+
+    @model_observer(Message)
+    async def message_activity(self, message: dict, **kwargs):
+        if "reaction" in message:
+            await self.send_frame(
+                events=[
+                    json.dumps(
+                        {
+                            **message["reaction"],
+                            "is_me": message["sender_pk"] == self.user.pk,
+                        }
+                    )
+                ]
             )
+        elif message:
+            await self.send_frame(
+                messages=[
+                    resolve_is_me(message["message"], message["marker"], self.user.pk)
+                ]
+            )
+            # The delivery of new messages to the other users is recorded in batches
+            sender_pk = message["sender_pk"]
+            if message["created"] and sender_pk not in (None, self.user.pk):
+                await receipt_writer.add(
+                    message["id"], self.user.pk, message["room_id"], sender_pk
+                )
+
+    async def message_receipts(self, message: dict):
+        """
+        Sends the coalesced delivery receipts of the messages of the user.
+        """
+        await self.send_frame(
+            events=[json.dumps(receipt) for receipt in message["receipts"]]
+        )
+
+    @message_activity.serializer
+    def message_activity(self, instance: Message, action, **kwargs):
+        """
+        The message is serialized and encoded once, and shared by all the consumers it is sent to.
+        """
+        if instance.is_reaction:
+            return get_reaction_event(instance, action)
+        message = MessageSerializer(instance).data
+        # Do not send empty messages
+        if not (message["body"] or message["images"]):
+            return {}
+        # The clients keep their own reactions from the reaction events
+        del message["my_reactions"]
+        encoded_message, marker = encode_message(message)
+        return {
+            "message": encoded_message,
+            "marker": marker,
+            "id": message["id"],
+            "room_id": message["room_id"],
+            # The id of the user who sent the message, before "is_me" is resolved
+            "sender_pk": message["is_me"],
+            "created": action == Action.CREATE and is_created(instance),
+        }
 
     @message_activity.groups_for_signal
     def message_activity(self, instance: Message, **kwargs):
-        yield f"-rooms__{instance.room_user.room.id}"
+        yield from groups_for_room(instance.room_id, "-rooms__")
 
     @message_activity.groups_for_consumer
-    def message_activity(self, consumer, room_pk: str, **kwargs):
-        yield f"-rooms__{room_pk}"
+    def message_activity(
+        self, consumer, room_pk: str = None, user_pk: str = None, **kwargs
+    ):
+        if room_pk is not None:
+            yield f"-rooms__{room_pk}"
+        if user_pk is not None:
+            yield f"-user__{user_pk}"
 
     def _resolve_is_me(self, message: dict):
         if not isinstance(message["is_me"], bool):
             message["is_me"] = message["is_me"] == self.user.pk
 
-    @database_sync_to_async
-    def user_connect(self):
-        user_chat = UserChat.objects.get_user_chat(self.user.pk)
-        if not user_chat.is_online:
-            user_chat.is_online = True
-            user_chat.save()
+    async def user_connect(self) -> bool:
+        """
+        Counts the connection of the user, and returns True when the user went online.
+        """
+        went_online = await sync_to_async(get_presence_backend().connect)(self.user.pk)
+        if went_online:
+            await presence_writer.add(self.user.pk, True)
+        return went_online
 
-    @database_sync_to_async
-    def user_disconnect(self):
-        if self.user.is_authenticated:
-            user_chat = UserChat.objects.get_user_chat(self.user.pk)
-            if user_chat.is_online:
-                user_chat.is_online = False
-                user_chat.save()
+    async def user_disconnect(self):
+        if not self.user.is_authenticated:
+            return
+        went_offline = await sync_to_async(get_presence_backend().disconnect)(
+            self.user.pk
+        )
+        if went_offline:
+            await presence_writer.add(self.user.pk, False)
+            await self.broadcast_presence(self.room_user_pks)
+
+    async def heartbeat(self):
+        """
+        Renews the presence lease of the user while the connection is live.
+        """
+        while True:
+            await asyncio.sleep(api_settings.PRESENCE_HEARTBEAT_INTERVAL)
+            await presence_writer.heartbeat(self.user.pk)
+
+    async def broadcast_presence(self, room_user_pks: Dict[str, Any]):
+        """
+        Sends the presence of the user to the members of the given rooms, as an update of their RoomUser objects.
+
+        The RoomUser objects are known already, so this doesn't query the database
+        (except for resolving the room members at once in the user delivery mode).
+        """
+        if not room_user_pks:
+            return
+        room_users = [
+            RoomUser(pk=room_user_pk, room_id=room_pk, user=self.user, is_active=True)
+            for room_pk, room_user_pk in room_user_pks.items()
+        ]
+        messages = await database_sync_to_async(get_presence_messages)(room_users)
+        for message in messages:
+            await self.channel_layer.group_send(message["group"], message)
 
     def get_serializer_context(self, **kwargs):
         context = super().get_serializer_context()
         context.update(kwargs)
         return context
+
+
+def get_presence_messages(room_users: Iterable[RoomUser]) -> List[dict]:
+    """
+    Builds the messages sending the presence of users to the members of their rooms,
+    as updates of their RoomUser objects.
+    """
+    room_users = list(room_users)
+    observer = RoomsConsumer.room_user_activity
+    groups = groups_for_rooms(
+        {room_user.room_id for room_user in room_users}, "-room__"
+    )
+    messages = []
+    for room_user in room_users:
+        message = observer.serialize(room_user, Action.UPDATE)
+        for group_name in observer.group_names_for_signal(
+            instance=room_user, groups=groups.get(str(room_user.room_id), [])
+        ):
+            messages.append({**message, "group": group_name})
+    return messages
+
+
+def get_reaction_event(reaction: Message, action: Action) -> dict:
+    """
+    A reaction is sent as a small event holding the new counter of its reaction, instead of the message it reacts to.
+    The reactions can't be changed, so their saves are only sent when they are created.
+    """
+    is_added = action == Action.CREATE and is_created(reaction)
+    if not reaction.parent_id or not (is_added or action == Action.DELETE):
+        return {}
+    try:
+        sender_pk = reaction.room_user.user_id
+    except RoomUser.DoesNotExist:
+        # The reaction is deleted along with its room user
+        sender_pk = None
+    count = (
+        MessageReactionCount.objects.filter(
+            message_id=reaction.parent_id, reaction=reaction.body
+        )
+        .values_list("count", flat=True)
+        .first()
+    )
+    return {
+        "reaction": {
+            "room_id": str(reaction.room_id),
+            "message_id": str(reaction.parent_id),
+            "room_user_id": str(reaction.room_user_id),
+            "event": "reaction_added" if is_added else "reaction_removed",
+            "reaction": reaction.body,
+            "count": count or 0,
+        },
+        "sender_pk": sender_pk,
+    }
+
+
+def send_removed_reaction(reaction: Message):
+    """
+    The model observers don't send deletions, as the groups of the instances aren't tracked (see post_init_receiver),
+    so the removal of a reaction is sent explicitly.
+    """
+    channel_layer = get_channel_layer()
+    observer = RoomsConsumer.message_activity
+    message = observer.serialize(reaction, Action.DELETE)
+    for group_name in observer.group_names_for_signal(instance=reaction):
+        async_to_sync(channel_layer.group_send)(group_name, message)
+
+
+def send_updated_message(message: Message):
+    """
+    Sends a message whose images were processed, without saving it again, which would notify its recipients again.
+    """
+    channel_layer = get_channel_layer()
+    observer = RoomsConsumer.message_activity
+    event = observer.serialize(message, Action.UPDATE)
+    for group_name in observer.group_names_for_signal(instance=message):
+        async_to_sync(channel_layer.group_send)(group_name, event)
+
+
+def send_memberships(memberships: Iterable[Tuple[Any, Any]], is_active: bool):
+    """
+    Sends the memberships of users, as (room pk, user pk) pairs, to their consumers when they are added to or removed
+    from rooms, or when their room user is deleted, which the model observers don't send.
+    """
+    channel_layer = get_channel_layer()
+    observer = RoomsConsumer.room_membership_activity
+    for room_pk, user_pk in memberships:
+        room_user = RoomUser(room_id=room_pk, user_id=user_pk, is_active=is_active)
+        message = observer.serialize(room_user, Action.UPDATE)
+        for group_name in observer.group_names_for_signal(instance=room_user):
+            async_to_sync(channel_layer.group_send)(group_name, message)
+
+
+@receiver(post_delete, sender=RoomUser)
+def notify_delete_room_user(sender, instance: RoomUser, **kwargs):
+    if instance.user_id and instance.is_active:
+        transaction.on_commit(
+            partial(send_memberships, [(instance.room_id, instance.user_id)], False)
+        )
+
+
+@receiver(m2m_changed, sender=Room.users.through)
+def notify_room_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Sends the memberships of the users added to or removed from a room, from either side of the relation.
+    """
+    if action == "pre_clear":
+        # The removed objects are only known before the relation is cleared
+        field, related_field = (
+            ("user_id", "room_id") if reverse else ("room_id", "user_id")
+        )
+        pk_set = set(
+            sender.objects.filter(**{field: instance.pk}).values_list(
+                related_field, flat=True
+            )
+        )
+    elif action not in ("post_add", "post_remove"):
+        return
+    memberships = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+    if memberships:
+        transaction.on_commit(
+            partial(send_memberships, memberships, action == "post_add")
+        )
+
+
+@receiver(pre_save, sender=Message)
+def mark_created_message(sender, instance: Message, **kwargs):
+    """
+    The model observers send every save as a creation, as the groups of the instances aren't tracked
+    (see post_init_receiver), so the messages being created are marked to tell them apart from the edited ones.
+    """
+    instance._is_created = instance._state.adding
+
+
+def is_created(message: Message) -> bool:
+    return getattr(message, "_is_created", False)
+
+
+@receiver(post_delete, sender=Message)
+def notify_delete_reaction(sender, instance: Message, **kwargs):
+    if instance.is_reaction:
+        transaction.on_commit(partial(send_removed_reaction, instance))
+
+
+def send_presence(user_pks: Iterable):
+    """
+    Sends the presence of users to the members of their rooms, e.g. when they were swept offline.
+    """
+    channel_layer = get_channel_layer()
+    room_users = RoomUser.objects.filter(
+        user_id__in=user_pks, is_active=True
+    ).select_related("user")
+    for message in get_presence_messages(room_users):
+        async_to_sync(channel_layer.group_send)(message["group"], message)
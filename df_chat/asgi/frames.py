@@ -0,0 +1,143 @@
+"""
+Helpers to encode the frames sent to the websocket clients.
+
+Events are encoded once, and shared between all their recipients.
+The only per-recipient part of a message is its "is_me" flag.
+Instead of encoding the message for every recipient, the flags are replaced by markers holding the user id
+before encoding, and every consumer substitutes the markers with `true` / `false` in the encoded message.
+"""
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+from uuid import uuid4
+
+import asyncio
+import json
+import re
+import time
+
+
+def _mark_is_me(message: Dict[str, Any], marker: str) -> Dict[str, Any]:
+    user_pk = message["is_me"]
+    # System messages don't have a user, so they are never sent by "me"
+    return {**message, "is_me": f"{marker}{user_pk}" if user_pk is not None else False}
+
+
+def encode_message(message: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Encodes a serialized message, whose "is_me" is still the id of the user who sent it.
+
+    Returns the encoded message and the marker to pass to `resolve_is_me`.
+    The marker is random for every message, so that a message body can't fake it.
+    """
+    marker = f"__is_me_{uuid4().hex}__"
+    return json.dumps(_mark_is_me(message, marker)), marker
+
+
+def resolve_is_me(encoded_message: str, marker: str, user_pk: Any) -> str:
+    """
+    Substitutes the "is_me" markers of an encoded message for a recipient.
+    """
+    encoded_message = encoded_message.replace(f'"{marker}{user_pk}"', "true")
+    return re.sub(f'"{marker}[^"]*"', "false", encoded_message)
+
+
+def join_frame(
+    messages: Iterable[str] = (), users: Iterable[str] = (), events: Iterable[str] = ()
+) -> str:
+    """
+    Builds a frame out of encoded messages, users and ephemeral events, without decoding them.
+    The "events" key is only present when the frame holds ephemeral events.
+    """
+    frame = f'{{"messages": [{", ".join(messages)}], "users": [{", ".join(users)}]'
+    if events:
+        frame += f', "events": [{", ".join(events)}]'
+    return frame + "}"
+
+
+class FrameBuffer:
+    """
+    Collects the encoded events of a consumer for a time window, or until the buffer is full,
+    and flushes them as a single frame.
+
+    Keeps track of the frames saved and of the latency added by buffering.
+    """
+
+    def __init__(
+        self, send: Callable[[str], Awaitable[None]], window: float, max_events: int
+    ):
+        self.send = send
+        self.window = window
+        self.max_events = max_events
+        self.messages: List[str] = []
+        self.users: List[str] = []
+        self.events: List[str] = []
+        self.timestamps: List[float] = []
+        self.flush_task = None
+
+        self.event_count = 0
+        self.frame_count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def frames_saved(self) -> int:
+        return self.event_count - self.frame_count
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.event_count if self.event_count else 0.0
+
+    async def add(
+        self,
+        messages: Iterable[str] = (),
+        users: Iterable[str] = (),
+        events: Iterable[str] = (),
+    ):
+        messages, users, events = list(messages), list(users), list(events)
+        now = time.monotonic()
+        self.messages.extend(messages)
+        self.users.extend(users)
+        self.events.extend(events)
+        self.timestamps.extend([now] * (len(messages) + len(users) + len(events)))
+
+        if len(self.timestamps) >= self.max_events:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if not self.timestamps:
+            return
+
+        messages, users, events = self.messages, self.users, self.events
+        timestamps = self.timestamps
+        self.messages, self.users, self.events, self.timestamps = [], [], [], []
+
+        now = time.monotonic()
+        self.event_count += len(timestamps)
+        self.frame_count += 1
+        self.total_latency += sum(now - timestamp for timestamp in timestamps)
+        self.max_latency = max(self.max_latency, now - timestamps[0])
+        await self.send(join_frame(messages, users, events))
+
+    def close(self):
+        """
+        Drops the pending events, when the connection is closed.
+        """
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.messages, self.users, self.events, self.timestamps = [], [], [], []
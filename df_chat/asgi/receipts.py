@@ -0,0 +1,111 @@
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from collections import defaultdict
+from df_chat.models import Message
+from df_chat.settings import api_settings
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import asyncio
+
+
+class ReceiptWriter:
+    """
+    Records the delivery of messages to `Message.received_by`, and sends the receipts to their senders.
+
+    The deliveries are collected for `RECEIPT_WRITE_INTERVAL` milliseconds and written with a single bulk insert.
+    The receipts of a sender are coalesced in a single event: the users who received each message.
+    """
+
+    def __init__(self):
+        # (message pk, recipient pk) -> (room pk, sender pk)
+        self.pending: Dict[Tuple[Any, Any], Tuple[Any, Any]] = {}
+        self.flush_task = None
+
+    async def add(self, message_pk: Any, user_pk: Any, room_pk: Any, sender_pk: Any):
+        self.pending[(message_pk, user_pk)] = (room_pk, sender_pk)
+        await self.schedule_flush()
+
+    async def schedule_flush(self):
+        interval = api_settings.RECEIPT_WRITE_INTERVAL
+        if not interval:
+            await self.flush()
+            return
+
+        loop = asyncio.get_running_loop()
+        if (
+            self.flush_task is None
+            or self.flush_task.done()
+            or self.flush_task.get_loop() is not loop
+        ):
+            self.flush_task = loop.create_task(self._flush_later(interval / 1000))
+
+    async def _flush_later(self, interval: float):
+        await asyncio.sleep(interval)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        await database_sync_to_async(self.write)(pending)
+
+        receipts = defaultdict(lambda: defaultdict(list))
+        for (message_pk, user_pk), (room_pk, sender_pk) in pending.items():
+            receipts[sender_pk][(str(room_pk), str(message_pk))].append(str(user_pk))
+        channel_layer = get_channel_layer()
+        for sender_pk, sender_receipts in receipts.items():
+            for group_name in get_receipt_groups(sender_pk):
+                await channel_layer.group_send(
+                    group_name,
+                    {
+                        "type": "message.receipts",
+                        "receipts": get_receipt_events(sender_receipts),
+                    },
+                )
+
+    @staticmethod
+    def write(pending: Dict[Tuple[Any, Any], Tuple[Any, Any]]):
+        ReceivedBy = Message.received_by.through
+        # The messages deleted in the meantime are skipped
+        message_pks = {
+            str(pk)
+            for pk in Message.objects.filter(
+                pk__in={message_pk for message_pk, _ in pending}
+            ).values_list("pk", flat=True)
+        }
+        ReceivedBy.objects.bulk_create(
+            [
+                ReceivedBy(message_id=message_pk, user_id=user_pk)
+                for message_pk, user_pk in pending
+                if str(message_pk) in message_pks
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def get_receipt_groups(user_pk: Any) -> List[str]:
+    from df_chat.asgi.consumers import RoomsConsumer
+
+    return list(
+        RoomsConsumer.room_user_activity.group_names_for_signal(
+            instance=None, groups=[f"-user__{user_pk}"]
+        )
+    )
+
+
+def get_receipt_events(receipts: Dict[Tuple[str, str], List[str]]) -> List[dict]:
+    return [
+        {
+            "room_id": room_pk,
+            "message_id": message_pk,
+            "event": "received",
+            "user_ids": user_pks,
+        }
+        for (room_pk, message_pk), user_pks in receipts.items()
+    ]
+
+
+receipt_writer = ReceiptWriter()
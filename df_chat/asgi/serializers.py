@@ -1,27 +1,55 @@
-from df_chat.drf.serializers import MessageSerializer
-from df_chat.models import RoomUser, Room
-from rest_framework.exceptions import  PermissionDenied
 from channels.db import database_sync_to_async
+from df_chat.drf.serializers import MessageSerializer
+from df_chat.models import Message
+from df_chat.models import Room
+from df_chat.models import RoomUser
+from django.db import IntegrityError
+from django.db import transaction
+from rest_framework.exceptions import PermissionDenied
 
 
 class AsyncMessageSerializer(MessageSerializer):
     def _get_room_user(self):
         user = self.context["scope"]["user"]
         room_id = self.context["room_id"]
+        room_user_pk = self.context.get("room_user_pk")
+        if room_user_pk:
+            # The consumer already knows that the user is an active member of the room
+            return RoomUser(pk=room_user_pk, room_id=room_id, user=user, is_active=True)
 
         rooms_accessible_to_user = Room.objects.filter_for_user(user)
         if not (room_id and rooms_accessible_to_user.filter(id=room_id).exists()):
             raise PermissionDenied("user doesn't have access to room")
-        
+
         return RoomUser.objects.get_room_user(
             room_pk=room_id,
             user_pk=user.id,
         )
-    
+
     @database_sync_to_async
     def is_valid(self, *, raise_exception=False):
         return super().is_valid(raise_exception=raise_exception)
-    
+
     @database_sync_to_async
     def save(self, **kwargs):
         return super().save(**kwargs)
+
+    @database_sync_to_async
+    def create_message(self) -> Message:
+        """
+        Validates the data and creates the message in a single thread hop and a single transaction.
+
+        If the client retries sending a message with the same `client_id`, the existing message is returned.
+        """
+        try:
+            with transaction.atomic():
+                super().is_valid(raise_exception=True)
+                return super().save()
+        except IntegrityError:
+            # A concurrent retry created the message with the same client_id first
+            client_id = self.validated_data.get("client_id")
+            if not client_id:
+                raise
+            return Message.objects.get(
+                room_user=self.validated_data["room_user"], client_id=client_id
+            )
@@ -0,0 +1,234 @@
+from base64 import b64decode
+from base64 import b64encode
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param
+from rest_framework.utils.urls import replace_query_param
+
+import math
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination of the messages on (created, id), newest first.
+
+    A page is anchored on a message of the room:
+    - `before=<message_id>`: the messages older than the anchor,
+    - `after=<message_id>`: the messages newer than the anchor,
+    - `around=<message_id>`: the anchor and the messages around it, e.g. to jump to a reply or a search hit.
+
+    Every page is a range scan on (created, id), so its cost doesn't depend on how deep it is,
+    and messages created in the meantime don't shift the pages.
+    The `next` link leads to older messages, and the `previous` link to newer ones.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    anchor_query_params = ("before", "after", "around")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        for param in self.anchor_query_params:
+            self.base_url = remove_query_param(self.base_url, param)
+
+        anchor_param, anchor = self.get_anchor(queryset, request)
+        if anchor_param == "after":
+            messages, self.has_newer = self.get_newer(queryset, anchor, self.page_size)
+            self.has_older = True
+        elif anchor_param == "around":
+            newer_count = self.page_size // 2
+            newer, self.has_newer = self.get_newer(queryset, anchor, newer_count)
+            older, self.has_older = self.get_older(
+                queryset, anchor, self.page_size - newer_count, include_anchor=True
+            )
+            messages = newer + older
+        else:
+            messages, self.has_older = self.get_older(queryset, anchor, self.page_size)
+            self.has_newer = anchor is not None
+
+        self.messages = messages
+        return messages
+
+    def get_anchor(self, queryset, request):
+        for param in self.anchor_query_params:
+            message_id = request.query_params.get(param)
+            if message_id is None:
+                continue
+            anchor = (
+                queryset.order_by()
+                .filter(pk=message_id)
+                .values_list("created", "pk")
+                .first()
+            )
+            if anchor is None:
+                raise ValidationError({param: "Message not found"})
+            return param, anchor
+        return None, None
+
+    def get_older(self, queryset, anchor, count, include_anchor=False):
+        queryset = queryset.order_by("-created", "-pk")
+        if anchor is not None:
+            created, pk = anchor
+            pk_lookup = Q(pk__lte=pk) if include_anchor else Q(pk__lt=pk)
+            queryset = queryset.filter(
+                Q(created__lt=created) | (Q(created=created) & pk_lookup)
+            )
+        messages = list(queryset[: count + 1])
+        return messages[:count], len(messages) > count
+
+    def get_newer(self, queryset, anchor, count):
+        created, pk = anchor
+        queryset = queryset.order_by("created", "pk").filter(
+            Q(created__gt=created) | Q(created=created, pk__gt=pk)
+        )
+        messages = list(queryset[: count + 1])
+        return messages[:count][::-1], len(messages) > count
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_older or not self.messages:
+            return None
+        return replace_query_param(self.base_url, "before", str(self.messages[-1].pk))
+
+    def get_previous_link(self):
+        if not self.has_newer or not self.messages:
+            return None
+        return replace_query_param(self.base_url, "after", str(self.messages[0].pk))
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        descriptions = {
+            "before": "The messages older than this message",
+            "after": "The messages newer than this message",
+            "around": "This message and the messages around it",
+        }
+        return [
+            {
+                "name": param,
+                "required": False,
+                "in": "query",
+                "description": description,
+                "schema": {"type": "string"},
+            }
+            for param, description in descriptions.items()
+        ] + [
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of messages to return per page",
+                "schema": {"type": "integer"},
+            }
+        ]
+
+
+class MessageSearchPagination(MessageCursorPagination):
+    """
+    Keyset pagination of the search results on (rank, id), the best matches first.
+
+    The `next` link holds the rank and the id of the last result of the page in its `cursor`, so every page
+    only reads the results after it. A result is opened in its room with the `around=<message_id>` anchor.
+    """
+
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        queryset = queryset.order_by("-rank", "-pk")
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is not None:
+            rank, pk = self.decode_cursor(cursor, queryset.model)
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, pk__lt=pk))
+        messages = list(queryset[: self.page_size + 1])
+        self.messages = messages[: self.page_size]
+        self.has_older = len(messages) > self.page_size
+        self.has_newer = False
+        return self.messages
+
+    def decode_cursor(self, cursor, model):
+        try:
+            rank, pk = b64decode(cursor.encode(), altchars=b"-_").decode().split(":")
+            rank, pk = float(rank), model._meta.pk.to_python(pk)
+        except (ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if not math.isfinite(rank):
+            raise NotFound(self.invalid_cursor_message)
+        return rank, pk
+
+    def encode_cursor(self, message):
+        return b64encode(
+            f"{message.rank!r}:{message.pk}".encode(), altchars=b"-_"
+        ).decode()
+
+    def get_next_link(self):
+        if not self.has_older or not self.messages:
+            return None
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            self.encode_cursor(self.messages[-1]),
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": "q",
+                "required": True,
+                "in": "query",
+                "description": "The terms the messages contain",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The results after the page of this cursor",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of messages to return per page",
+                "schema": {"type": "integer"},
+            },
+        ]
@@ -1,7 +1,9 @@
 from ..models import Message
 from ..models import MessageImage
+from ..models import MessageImageUpload
 from ..models import Room
 from ..models import RoomUser
+from df_chat.settings import api_settings
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from drf_spectacular.utils import extend_schema_field
@@ -10,7 +12,8 @@ from rest_framework import exceptions
 from rest_framework import serializers
 from rest_framework.relations import ManyRelatedField
 from rest_framework.relations import PrimaryKeyRelatedField
-from rest_framework_recursive.fields import RecursiveField
+from typing import Dict
+from typing import List
 from typing import Optional
 from typing import Union
 
@@ -28,24 +31,107 @@ class ErrorResponseSerializer(serializers.Serializer):
     errors = ErrorSerializer(many=True, required=True)
 
 
+def get_member(room, user) -> RoomUser:
+    """
+    The active RoomUser of a user in a room. Reading a room doesn't join it, e.g. a public room.
+    """
+    room_user = RoomUser.objects.filter(room=room, user=user, is_active=True).first()
+    if room_user is None:
+        raise exceptions.NotFound("The user is not a member of the room")
+    return room_user
+
+
 class MessageSeenSerializer(serializers.Serializer):
-    message_ids = serializers.ListSerializer(child=serializers.CharField())
+    message_ids = serializers.ListSerializer(
+        child=serializers.CharField(), required=False
+    )
+    up_to_message_id = HashidSerializerCharField(
+        source_field="df_chat.Message.id",
+        required=False,
+        help_text="Marks the messages of the room up to this one as seen, without listing them",
+    )
+
+    def validate_up_to_message_id(self, message_id):
+        # The range is read like with the read endpoint, by advancing the read watermark
+        self.read_serializer = MessageReadSerializer(
+            data={"message_id": str(message_id)}, context=self.context
+        )
+        if not self.read_serializer.is_valid():
+            raise exceptions.ValidationError(self.read_serializer.errors["message_id"])
+        return message_id
+
+    def validate(self, attrs):
+        if not attrs.get("message_ids") and not attrs.get("up_to_message_id"):
+            raise exceptions.ValidationError(
+                "Either message_ids or up_to_message_id is required"
+            )
+        return attrs
 
     def save(self, **kwargs):
         user = self.context["request"].user
-        messages = Message.objects.filter(
-            Q(pk__in=self.validated_data["message_ids"])
-            & (
-                Q(room_user__room__is_public=True)
-                | Q(room_user__room__users=user)
-                | Q(room_user__room__admins=user)
+        data = {"message_ids": []}
+        if self.validated_data.get("message_ids"):
+            data["message_ids"] = self.save_message_ids(user)
+        if self.validated_data.get("up_to_message_id"):
+            self.read_serializer.save()
+            data["up_to_message_id"] = self.read_serializer.data["message_id"]
+            data["unread_count"] = self.read_serializer.data["unread_count"]
+        setattr(self, "_data", data)
+
+    def save_message_ids(self, user) -> List[str]:
+        messages = (
+            Message.objects.filter(
+                Q(pk__in=self.validated_data["message_ids"])
+                & (Q(room__is_public=True) | Q(room__users=user) | Q(room__admins=user))
             )
+            .order_by()
+            .distinct()
+            .values_list("pk", "room_id", "is_reaction")
         )
+        SeenBy = Message.seen_by.through
         message_ids = []
-        for message in messages:
-            message.seen_by.add(user)
-            message_ids.append(str(message.pk))
-        setattr(self, "_data", {"message_ids": message_ids})
+        seen_by = []
+        last_seen_message_pks = {}
+        for message_pk, room_pk, is_reaction in messages:
+            message_ids.append(str(message_pk))
+            seen_by.append(SeenBy(message_id=message_pk, user_id=user.pk))
+            if not is_reaction:
+                last_seen_message_pks[room_pk] = max(
+                    message_pk, last_seen_message_pks.get(room_pk, message_pk)
+                )
+        SeenBy.objects.bulk_create(seen_by, ignore_conflicts=True)
+        # The messages of the public rooms the user didn't join are seen, but not read
+        for room_user in RoomUser.objects.filter(
+            room_id__in=last_seen_message_pks, user=user, is_active=True
+        ):
+            RoomUser.objects.mark_read(
+                room_user, message_pk=last_seen_message_pks[room_user.room_id]
+            )
+        return message_ids
+
+
+class MessageReadSerializer(serializers.Serializer):
+    message_id = HashidSerializerCharField(source_field="df_chat.Message.id")
+    unread_count = serializers.IntegerField(read_only=True)
+
+    def validate_message_id(self, message_id):
+        if not Message.objects.filter(
+            pk=message_id, room=self.context["room"], is_reaction=False
+        ).exists():
+            raise exceptions.ValidationError("Message not found")
+        return message_id
+
+    def validate(self, attrs):
+        attrs["room_user"] = get_member(
+            self.context["room"], self.context["request"].user
+        )
+        return attrs
+
+    def create(self, validated_data):
+        room_user = validated_data.pop("room_user")
+        RoomUser.objects.mark_read(room_user, message_pk=validated_data["message_id"])
+        validated_data["unread_count"] = RoomUser.objects.get_unread_count(room_user)
+        return validated_data
 
 
 class CreatorMixin:
@@ -62,28 +148,38 @@ class MessageImageSerializer(serializers.ModelSerializer):
     )
     room_id = HashidSerializerCharField(source_field="df_chat.Room.id", required=False)
     name = serializers.SerializerMethodField()
-    size = serializers.SerializerMethodField()
-
-    def get_size(self, obj: MessageImage) -> Optional[int]:
-        if obj.image:
-            try:
-                return obj.image.size
-            except OSError:
-                return 0
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = MessageImage
+        # The metadata is saved at upload, the images are serialized without requests to the storage
         read_only_fields = (
             "height",
             "width",
             "name",
             "size",
+            "content_type",
+            "variants",
+            "placeholder",
         )
         fields = ("id", "message_id", "room_id", "image", *read_only_fields)
 
     def get_name(self, obj) -> str:
         return obj.image.name.split("/")[-1]
 
+    def get_variants(self, obj: MessageImage) -> Dict[str, str]:
+        """
+        The URLs of the downscaled variants of the image, see df_chat.images.
+        The image is served as it is when it is smaller than a variant, or until it is processed.
+        """
+        request = self.context.get("request")
+        urls = {}
+        for variant in api_settings.IMAGE_VARIANTS:
+            name = obj.variants.get(variant)
+            url = obj.image.storage.url(name) if name else obj.image.url
+            urls[variant] = request.build_absolute_uri(url) if request else url
+        return urls
+
     def validate_message_id(self, message_id):
         try:
             Message.objects.get(
@@ -109,6 +205,40 @@ class MessageImageSerializer(serializers.ModelSerializer):
         return super().validate(attrs)
 
 
+class MessageImageUploadSerializer(serializers.ModelSerializer):
+    id = HashidSerializerCharField(read_only=True)
+    message_id = HashidSerializerCharField(
+        source_field="df_chat.Message.id", required=False
+    )
+    room_id = HashidSerializerCharField(source_field="df_chat.Room.id", required=False)
+    size = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = MessageImageUpload
+        read_only_fields = ("offset",)
+        fields = ("id", "message_id", "room_id", "name", "size", *read_only_fields)
+
+    def validate_message_id(self, message_id):
+        # The image is attached as if it was uploaded at once, see MessageImageUploadViewSet.finalize
+        return MessageImageSerializer(context=self.context).validate_message_id(
+            message_id
+        )
+
+    def validate_size(self, size):
+        if size > api_settings.IMAGE_UPLOAD_MAX_SIZE:
+            raise exceptions.ValidationError(
+                f"The image must not be larger than {api_settings.IMAGE_UPLOAD_MAX_SIZE} bytes"
+            )
+        return size
+
+    def validate(self, attrs):
+        if not attrs.get("message_id") and not attrs.get("room_id"):
+            raise exceptions.ValidationError(
+                "The image must be attached to a message or a room"
+            )
+        return super().validate(attrs)
+
+
 class MessageSerializer(serializers.ModelSerializer):
     def get_is_me(self, obj) -> Optional[Union[bool, int]]:
         if self.context.get("request"):
@@ -125,12 +255,31 @@ class MessageSerializer(serializers.ModelSerializer):
         source_field="df_chat.Message.id", required=False
     )
     room_user_id = HashidSerializerCharField(read_only=True)
-    room_id = HashidSerializerCharField(source="room_user.room_id", read_only=True)
+    room_id = HashidSerializerCharField(read_only=True)
     is_me = serializers.SerializerMethodField()
     is_seen_by_me = serializers.BooleanField(read_only=True)
     is_reaction = serializers.BooleanField(default=False)
     images = MessageImageSerializer(many=True, read_only=True)
-    reactions = serializers.ListSerializer(child=RecursiveField(), read_only=True)
+    reply_count = serializers.IntegerField(read_only=True)
+    reaction_counts = serializers.SerializerMethodField()
+    my_reactions = serializers.SerializerMethodField()
+
+    def get_reaction_counts(self, obj) -> Dict[str, int]:
+        return {count.reaction: count.count for count in obj.reaction_counts.all()}
+
+    def get_my_reactions(self, obj) -> List[str]:
+        if hasattr(obj, "user_reactions"):
+            # See MessageQuerySet.prefetch_reactions
+            return [reaction.body for reaction in obj.user_reactions]
+        request = self.context.get("request")
+        if request is None:
+            # The messages sent through the websocket are shared by their recipients
+            return []
+        return list(
+            obj.children.filter(
+                is_reaction=True, room_user__user=request.user
+            ).values_list("body", flat=True)
+        )
 
     def _get_room_user(self, **kwargs):
         return RoomUser.objects.get_room_user(
@@ -140,16 +289,36 @@ class MessageSerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
         attrs = super().validate(attrs)
+        if attrs.get("is_reaction") and len(attrs.get("body", "")) > 64:
+            raise exceptions.ValidationError(
+                {"body": "A reaction can't be longer than 64 characters"}
+            )
 
         attrs["room_user"] = self._get_room_user()
         return attrs
 
     def create(self, validated_data):
-        instance = super().create(validated_data)
-        if instance.is_reaction and instance.parent:
-            # Trigger message post_save signal
-            instance.parent.save()
-        return instance
+        client_id = validated_data.get("client_id")
+        if client_id:
+            # The client retried sending a message, do not create it twice
+            instance = Message.objects.filter(
+                room_user=validated_data["room_user"], client_id=client_id
+            ).first()
+            if instance:
+                instance.room_user = validated_data["room_user"]
+                return instance
+
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        # The counters of the rooms and of the reactions are maintained when the messages are created and deleted
+        # (see count_created_message), so a message can't become a reaction, nor move to another parent,
+        # and a reaction can't be changed
+        validated_data.pop("is_reaction", None)
+        validated_data.pop("parent_id", None)
+        if instance.is_reaction:
+            validated_data.pop("body", None)
+        return super().update(instance, validated_data)
 
     class Meta:
         model = Message
@@ -162,9 +331,11 @@ class MessageSerializer(serializers.ModelSerializer):
             "is_seen_by_me",
             "room_id",
             "images",
-            "reactions",
+            "reply_count",
+            "reaction_counts",
+            "my_reactions",
         )
-        fields = read_only_fields + ("body", "parent_id", "is_reaction")
+        fields = read_only_fields + ("body", "parent_id", "is_reaction", "client_id")
 
 
 class HashidCharPrimaryKeyRelatedField(PrimaryKeyRelatedField):
@@ -208,10 +379,7 @@ class RoomSerializer(CreatorMixin, serializers.ModelSerializer):
 
     @extend_schema_field(MessageSerializer(allow_null=True))
     def get_last_message(self, obj):
-        return MessageSerializer(
-            Message.objects.filter(room_user__room=obj).order_by("-created").first(),
-            context=self.context,
-        ).data
+        return MessageSerializer(obj.last_message, context=self.context).data
 
     def get_is_muted(self, obj: Room) -> bool:
         return obj.muted_by.all()
@@ -220,12 +388,12 @@ class RoomSerializer(CreatorMixin, serializers.ModelSerializer):
 class RoomUserSerializer(serializers.ModelSerializer):
     id = HashidSerializerCharField(read_only=True)
 
-    def get_is_me(self, obj) -> Optional[bool]:
+    def get_is_me(self, obj) -> Optional[Union[bool, int]]:
         if self.context.get("request"):
             return self.context["request"].user.id == obj.user_id
 
         # In case of ws we will resolve user_id -> is_me later
-        return str(obj.id)
+        return obj.user_id
 
     name = serializers.CharField(read_only=True, source="avatar.slug")
     image = serializers.ImageField(read_only=True, source="avatar.image")
@@ -1,4 +1,6 @@
+from .viewsets import MessageImageUploadViewSet
 from .viewsets import MessageImageViewSet
+from .viewsets import MessageSearchViewSet
 from .viewsets import MessageViewSet
 from .viewsets import RoomUserViewSet
 from .viewsets import RoomViewSet
@@ -16,6 +18,8 @@ else:
 
 router.register("rooms", RoomViewSet, basename="rooms")
 router.register("images", MessageImageViewSet, basename="images")
+router.register("uploads", MessageImageUploadViewSet, basename="uploads")
+router.register("search", MessageSearchViewSet, basename="search")
 
 urlpatterns = router.urls
 
@@ -1,17 +1,31 @@
 from ..models import Message
 from ..models import MessageImage
+from ..models import MessageImageUpload
 from ..models import Room
 from ..models import RoomUser
 from ..permissions import IsOwnerOrReadOnly
+from ..uploads import delete_upload
+from ..uploads import open_upload
+from ..uploads import parse_content_range
+from ..uploads import save_chunk
+from .pagination import MessageCursorPagination
+from .pagination import MessageSearchPagination
 from .serializers import ErrorResponseSerializer
 from .serializers import MessageImageSerializer
+from .serializers import MessageImageUploadSerializer
+from .serializers import MessageReadSerializer
 from .serializers import MessageSeenSerializer
 from .serializers import MessageSerializer
 from .serializers import RoomSerializer
 from .serializers import RoomUserSerializer
 from .serializers import UserNameSerializer
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema
+from rest_framework import exceptions
+from rest_framework import mixins
 from rest_framework import parsers
 from rest_framework import permissions
 from rest_framework import response
@@ -19,13 +33,19 @@ from rest_framework import serializers
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
 from rest_framework.viewsets import ModelViewSet
 
 
 class RoomViewSet(ModelViewSet):
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
     serializer_class = RoomSerializer
-    queryset = Room.objects.all().select_related("creator").order_by("-created")
+    queryset = (
+        Room.objects.all()
+        .select_related("creator")
+        .prefetch_related("users")
+        .order_by("-last_activity_at", "-created")
+    )
 
     @action(
         methods=["post"],
@@ -65,6 +85,7 @@ class RoomViewSet(ModelViewSet):
             .filter_for_user(self.request.user)
             .annotate_message_count(self.request.user)
             .annotate_is_muted(self.request.user)
+            .prefetch_last_message(self.request.user)
             .distinct()
         )
 
@@ -97,7 +118,8 @@ class RoomUserViewSet(RoomRelatedMixin, ModelViewSet):
 class MessageViewSet(RoomRelatedMixin, ModelViewSet):
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
     serializer_class = MessageSerializer
-    queryset = Message.objects.prefetch_children().distinct()
+    pagination_class = MessageCursorPagination
+    queryset = Message.objects.prefetch_related("images").distinct()
 
     @action(
         methods=["post"],
@@ -109,17 +131,75 @@ class MessageViewSet(RoomRelatedMixin, ModelViewSet):
     def seen(self, request, *args, **kwargs):
         return self.create(request, *args, **kwargs)
 
+    @extend_schema(responses={200: MessageReadSerializer})
+    @action(
+        methods=["post"],
+        detail=False,
+        permission_classes=(permissions.IsAuthenticated,),
+        serializer_class=MessageReadSerializer,
+    )
+    def read(self, request, *args, **kwargs):
+        """
+        Advances the read watermark of the user up to a message of the room.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ("read", "seen"):
+            context["room"] = self.get_room()
+        return context
+
+    @action(methods=["get"], detail=True)
+    def replies(self, request, *args, **kwargs):
+        """
+        The replies of a message, paginated like the messages of the room.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        # The replies are read-only, so the message isn't loaded to check the object permissions
+        if not queryset.filter(pk=kwargs["pk"]).exists():
+            raise Http404
+        queryset = queryset.filter(parent=kwargs["pk"], is_reaction=False)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=["get"], detail=False, pagination_class=MessageSearchPagination)
+    def search(self, request, *args, **kwargs):
+        """
+        The messages of the room matching a full-text query, the best matches first.
+        """
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .filter(is_reaction=False)
+            .search(get_search_query(request))
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @extend_schema(responses={204: None, 400: ErrorResponseSerializer})
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
     def get_queryset(self):
+        room = self.get_room()
+        last_read_message_id = (
+            RoomUser.objects.filter(room=room, user=self.request.user, is_active=True)
+            .values_list("last_read_message", flat=True)
+            .first()
+        )
         queryset = (
             super()
             .get_queryset()
-            .filter(room_user__room=self.get_room())
-            .select_related("room_user", "room_user__user")
-            .annotate_is_seen_by_me(self.request.user)
+            .filter(room=room)
+            .with_room_user()
+            .annotate_is_seen_by_me(last_read_message_id)
+            .prefetch_reactions(self.request.user)
+            .annotate_reply_count()
         )
 
         if self.action == "list":
@@ -128,6 +208,40 @@ class MessageViewSet(RoomRelatedMixin, ModelViewSet):
         return queryset
 
 
+class MessageSearchViewSet(mixins.ListModelMixin, GenericViewSet):
+    """
+    The messages of all the rooms the user can see matching a full-text query, the best matches first.
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = MessageSerializer
+    pagination_class = MessageSearchPagination
+    queryset = Message.objects.prefetch_related("images")
+
+    def get_queryset(self):
+        user = self.request.user
+        return (
+            super()
+            .get_queryset()
+            .filter(
+                room__in=Room.objects.filter_for_user(user).values("id"),
+                is_reaction=False,
+            )
+            .with_room_user()
+            .annotate_is_seen_by(user)
+            .prefetch_reactions(user)
+            .annotate_reply_count()
+            .search(get_search_query(self.request))
+        )
+
+
+def get_search_query(request) -> str:
+    query = request.query_params.get("q", "").strip()
+    if not query:
+        raise exceptions.ValidationError({"q": "This field is required."})
+    return query
+
+
 class MessageImageViewSet(ModelViewSet):
     serializer_class = MessageImageSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -136,3 +250,59 @@ class MessageImageViewSet(ModelViewSet):
 
     def get_queryset(self):
         return self.queryset.filter(message__room_user__user=self.request.user)
+
+
+class MessageImageUploadViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    GenericViewSet,
+):
+    """
+    Resumable uploads of images in chunks, see df_chat.uploads.
+
+    `POST` initiates an upload, `PUT` sends its next chunk with a `Content-Range` header, `GET` returns
+    the offset to resume it from, and `finalize` attaches the complete image to its message.
+    """
+
+    serializer_class = MessageImageUploadSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    queryset = MessageImageUpload.objects.all()
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        delete_upload(instance)
+
+    @extend_schema(request={"application/octet-stream": OpenApiTypes.BINARY})
+    def update(self, request, *args, **kwargs):
+        upload = self.get_object()
+        start, end = parse_content_range(
+            request.headers.get("Content-Range"), upload.size
+        )
+        # The chunk is streamed from the request, it is not parsed
+        save_chunk(upload, request.stream, start, end)
+        return Response(self.get_serializer(upload).data)
+
+    @action(
+        methods=["post"],
+        detail=True,
+        serializer_class=MessageImageSerializer,
+    )
+    def finalize(self, request, *args, **kwargs):
+        upload = self.get_object()
+        with open_upload(upload) as file, transaction.atomic():
+            data = {"image": file}
+            if upload.message_id:
+                data["message_id"] = str(upload.message_id)
+            if upload.room_id:
+                data["room_id"] = str(upload.room_id)
+            serializer = self.get_serializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            delete_upload(upload)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
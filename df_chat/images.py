@@ -0,0 +1,66 @@
+"""
+Processing of the images of the messages, outside of the upload requests.
+
+The upload only saves the original and its metadata. `df_chat.tasks.process_image_task` then generates the
+downscaled variants listed in the `IMAGE_VARIANTS` setting (e.g. a thumbnail for the chat bubbles and a preview
+for the viewer), and a placeholder color displayed while they load. The task runs on the Celery workers, whose
+concurrency bounds the number of images processed at once.
+"""
+from df_chat.models import MessageImage
+from df_chat.settings import api_settings
+from django.core.files.base import ContentFile
+from PIL import Image
+from PIL import ImageOps
+from typing import Dict
+
+import io
+import os
+
+
+VARIANT_FORMAT = "WEBP"
+VARIANT_QUALITY = 80
+
+
+def get_variant_name(name: str, variant: str) -> str:
+    return f"{os.path.splitext(name)[0]}_{variant}.{VARIANT_FORMAT.lower()}"
+
+
+def process_image(image: MessageImage) -> None:
+    """
+    Generates the variants and the placeholder of an image, reading the original once.
+    Every variant is downscaled from the next larger one.
+    """
+    variant_sizes = sorted(
+        api_settings.IMAGE_VARIANTS.items(), key=lambda item: item[1], reverse=True
+    )
+    storage = image.image.storage
+    with storage.open(image.image.name, "rb") as file:
+        original = Image.open(file)
+        if variant_sizes:
+            # Decodes JPEG images at a reduced scale when the largest variant is much smaller
+            max_size = variant_sizes[0][1]
+            original.draft("RGB", (max_size, max_size))
+        # The photos are displayed in the orientation they were taken
+        source = ImageOps.exif_transpose(original)
+        has_alpha = "A" in source.getbands() or "transparency" in source.info
+        source = source.convert("RGBA" if has_alpha else "RGB")
+
+    variants: Dict[str, str] = {}
+    for variant, max_size in variant_sizes:
+        # The images smaller than a variant are served as they are
+        if max(source.size) <= max_size:
+            continue
+        source = source.copy()
+        source.thumbnail((max_size, max_size))
+        content = io.BytesIO()
+        source.save(content, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+        variants[variant] = storage.save(
+            get_variant_name(image.image.name, variant), ContentFile(content.getvalue())
+        )
+
+    red, green, blue = source.convert("RGB").resize((1, 1), Image.BOX).getpixel((0, 0))
+    image.variants = variants
+    image.placeholder = f"#{red:02x}{green:02x}{blue:02x}"
+    MessageImage.objects.filter(pk=image.pk).update(
+        variants=image.variants, placeholder=image.placeholder
+    )
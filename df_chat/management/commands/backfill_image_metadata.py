@@ -0,0 +1,33 @@
+from df_chat.models import guess_content_type
+from df_chat.models import MessageImage
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Saves the size and the content type of the images uploaded before they were saved at upload."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, batch_size: int, **options):
+        count = 0
+        while True:
+            # Every batch is saved with a size, so the next batch starts after it
+            images = list(
+                MessageImage.objects.filter(size__isnull=True).order_by("pk")[
+                    :batch_size
+                ]
+            )
+            if not images:
+                break
+
+            for image in images:
+                try:
+                    image.size = image.image.size
+                except OSError:
+                    # The missing files are not looked up again
+                    image.size = 0
+                image.content_type = guess_content_type(image.image.name)
+            MessageImage.objects.bulk_update(images, ["size", "content_type"])
+            count += len(images)
+        self.stdout.write(f"{count} images backfilled")
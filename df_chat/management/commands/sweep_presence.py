@@ -0,0 +1,10 @@
+from df_chat.tasks import sweep_presence_task
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Marks the users whose presence lease expired as offline, e.g. after a worker was killed."
+
+    def handle(self, *args, **options):
+        user_pks = sweep_presence_task()
+        self.stdout.write(f"{len(user_pks)} users swept offline")
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0002_remove_roomuser_is_online_userchat"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="client_id",
+            field=models.CharField(
+                blank=True,
+                help_text="Idempotency key generated by the client, so that a message sent twice is created once",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="message",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("client_id__isnull", False)),
+                fields=("room_user", "client_id"),
+                name="df_chat_message_unique_client_id",
+            ),
+        ),
+    ]
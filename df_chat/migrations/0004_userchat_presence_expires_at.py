@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0003_message_client_id"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userchat",
+            name="presence_expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="The user is considered offline after this time, unless their connections send a heartbeat",
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userchat",
+            index=models.Index(
+                condition=models.Q(("is_online", True)),
+                fields=["presence_expires_at"],
+                name="df_chat_userchat_lease",
+            ),
+        ),
+    ]
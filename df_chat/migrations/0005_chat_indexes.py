@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0004_userchat_presence_expires_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_reaction", False)),
+                fields=["room_user", "-created"],
+                name="df_chat_message_list",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                fields=["-modified", "title"], name="df_chat_room_ordering"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="roomuser",
+            index=models.Index(
+                fields=["room", "user", "is_active"], name="df_chat_roomuser_member"
+            ),
+        ),
+    ]
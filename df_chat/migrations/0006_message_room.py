@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:15
+
+from django.db import migrations
+from django.db import models
+
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0005_chat_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="room",
+            field=models.ForeignKey(
+                editable=False,
+                help_text="The room of the room user, to query the messages of a room without joining the room users",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="df_chat.room",
+            ),
+        ),
+    ]
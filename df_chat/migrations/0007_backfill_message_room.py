@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import OuterRef
+from django.db.models import Subquery
+
+
+BATCH_SIZE = 10000
+
+
+def backfill_message_room(apps, schema_editor):
+    """
+    Sets the room of the existing messages, in batches so that a large table isn't locked for long.
+    """
+    Message = apps.get_model("df_chat", "Message")
+    RoomUser = apps.get_model("df_chat", "RoomUser")
+    room_id = Subquery(
+        RoomUser.objects.filter(pk=OuterRef("room_user_id")).values("room_id")[:1]
+    )
+    while True:
+        pks = list(
+            Message.objects.filter(room__isnull=True).values_list("pk", flat=True)[
+                :BATCH_SIZE
+            ]
+        )
+        if not pks:
+            break
+        Message.objects.filter(pk__in=pks).update(room_id=room_id)
+
+
+class Migration(migrations.Migration):
+    # Every batch is committed on its own
+    atomic = False
+
+    dependencies = [
+        ("df_chat", "0006_message_room"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_message_room, migrations.RunPython.noop),
+    ]
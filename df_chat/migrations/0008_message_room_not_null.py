@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:18
+
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0007_backfill_message_room"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="message",
+            name="df_chat_message_list",
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="room",
+            field=models.ForeignKey(
+                editable=False,
+                help_text="The room of the room user, to query the messages of a room without joining the room users",
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="df_chat.room",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_reaction", False)),
+                fields=["room", "-created", "-id"],
+                name="df_chat_message_list",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:21
+
+from django.db import migrations
+from django.db import models
+
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0008_message_room_not_null"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="message_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="The number of messages of the room, reactions excluded",
+            ),
+        ),
+        migrations.AddField(
+            model_name="roomuser",
+            name="last_read_message",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                help_text="The messages of the room up to this one are read by the user",
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="df_chat.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="roomuser",
+            name="unread_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="The number of messages of the room after the read watermark, reactions excluded",
+            ),
+        ),
+    ]
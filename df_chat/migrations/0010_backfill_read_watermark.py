@@ -0,0 +1,79 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 10000
+
+
+def batches(queryset):
+    pks = list(queryset.order_by("pk").values_list("pk", flat=True))
+    for i in range(0, len(pks), BATCH_SIZE):
+        yield queryset.model.objects.filter(pk__in=pks[i : i + BATCH_SIZE])
+
+
+def count_messages(Message, **filters):
+    return Coalesce(
+        Subquery(
+            Message.objects.filter(is_reaction=False, **filters)
+            .order_by()
+            .values("room")
+            .annotate(count=Count("id"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+def backfill_read_watermark(apps, schema_editor):
+    """
+    Moves the messages seen by the users to a read watermark per room user: the last message they have seen.
+    The messages seen out of order before the watermark become read too.
+    """
+    Message = apps.get_model("df_chat", "Message")
+    Room = apps.get_model("df_chat", "Room")
+    RoomUser = apps.get_model("df_chat", "RoomUser")
+    SeenBy = Message.seen_by.through
+
+    for rooms in batches(Room.objects.all()):
+        rooms.update(message_count=count_messages(Message, room=OuterRef("id")))
+
+    for room_users in batches(RoomUser.objects.filter(user__isnull=False)):
+        room_users.update(
+            last_read_message=Subquery(
+                SeenBy.objects.filter(
+                    user=OuterRef("user_id"),
+                    message__room=OuterRef("room_id"),
+                    message__is_reaction=False,
+                )
+                .order_by("-message_id")
+                .values("message_id")[:1]
+            )
+        )
+        room_users.filter(last_read_message__isnull=False).update(
+            unread_count=count_messages(
+                Message,
+                room=OuterRef("room_id"),
+                id__gt=OuterRef("last_read_message_id"),
+            )
+        )
+        room_users.filter(last_read_message__isnull=True).update(
+            unread_count=Subquery(
+                Room.objects.filter(id=OuterRef("room_id")).values("message_count")[:1]
+            )
+        )
+
+
+class Migration(migrations.Migration):
+    # Every batch is committed on its own
+    atomic = False
+
+    dependencies = [
+        ("df_chat", "0009_read_watermark"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_read_watermark, migrations.RunPython.noop),
+    ]
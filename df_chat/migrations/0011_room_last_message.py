@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:28
+
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0010_backfill_read_watermark"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="last_activity_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                help_text="The time of the newest message of the room, or the creation of the room",
+            ),
+        ),
+        migrations.AddField(
+            model_name="room",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                help_text="The newest message of the room, reactions excluded",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="df_chat.message",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                fields=["-last_activity_at", "-created"], name="df_chat_room_activity"
+            ),
+        ),
+    ]
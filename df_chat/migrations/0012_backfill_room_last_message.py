@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.models import F
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 10000
+
+
+def backfill_room_last_message(apps, schema_editor):
+    """
+    Sets the last message and the last activity of the existing rooms, in batches.
+    """
+    Message = apps.get_model("df_chat", "Message")
+    Room = apps.get_model("df_chat", "Room")
+    last_messages = Message.objects.filter(
+        room=OuterRef("id"), is_reaction=False
+    ).order_by("-created", "-id")
+
+    pks = list(Room.objects.order_by("pk").values_list("pk", flat=True))
+    for i in range(0, len(pks), BATCH_SIZE):
+        rooms = Room.objects.filter(pk__in=pks[i : i + BATCH_SIZE])
+        rooms.update(
+            last_message=Subquery(last_messages.values("id")[:1]),
+            last_activity_at=Coalesce(
+                Subquery(last_messages.values("created")[:1]), F("created")
+            ),
+        )
+
+
+class Migration(migrations.Migration):
+    # Every batch is committed on its own
+    atomic = False
+
+    dependencies = [
+        ("df_chat", "0011_room_last_message"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_room_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:41
+
+from django.db import migrations
+from django.db import models
+
+import django.db.models.deletion
+import hashid_field.field
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0012_backfill_room_last_message"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageReactionCount",
+            fields=[
+                (
+                    "id",
+                    hashid_field.field.BigHashidAutoField(
+                        alphabet="ABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890",
+                        auto_created=True,
+                        min_length=13,
+                        prefix="",
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("reaction", models.CharField(max_length=64)),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "message",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reaction_counts",
+                        to="df_chat.message",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("message", "reaction"),
+                        name="df_chat_message_reaction_count_unique",
+                    )
+                ],
+            },
+        ),
+    ]
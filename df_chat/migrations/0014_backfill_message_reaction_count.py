@@ -0,0 +1,58 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+BATCH_SIZE = 10000
+
+
+def backfill_message_reaction_count(apps, schema_editor):
+    """
+    Counts the existing reactions of the messages by reaction, in batches of messages.
+    """
+    Message = apps.get_model("df_chat", "Message")
+    MessageReactionCount = apps.get_model("df_chat", "MessageReactionCount")
+
+    message_pks = list(
+        Message.objects.filter(is_reaction=True, parent__isnull=False)
+        .order_by("parent_id")
+        .values_list("parent_id", flat=True)
+        .distinct()
+    )
+    for i in range(0, len(message_pks), BATCH_SIZE):
+        counts = {}
+        for message_pk, reaction, count in (
+            Message.objects.filter(
+                is_reaction=True, parent__in=message_pks[i : i + BATCH_SIZE]
+            )
+            .order_by()
+            .values("parent_id", "body")
+            .annotate(count=Count("id"))
+            .values_list("parent_id", "body", "count")
+        ):
+            # The reactions longer than a reaction counter are merged
+            key = (message_pk, reaction[:64])
+            counts[key] = counts.get(key, 0) + count
+        MessageReactionCount.objects.bulk_create(
+            [
+                MessageReactionCount(
+                    message_id=message_pk, reaction=reaction, count=count
+                )
+                for (message_pk, reaction), count in counts.items()
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+    # Every batch is committed on its own
+    atomic = False
+
+    dependencies = [
+        ("df_chat", "0013_message_reaction_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_message_reaction_count, migrations.RunPython.noop
+        ),
+    ]
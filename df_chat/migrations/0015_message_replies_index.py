@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:47
+
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0014_backfill_message_reaction_count"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_reaction", False)),
+                fields=["parent", "-created", "-id"],
+                name="df_chat_message_replies",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:02
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0015_message_replies_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="messageimage",
+            name="content_type",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="messageimage",
+            name="size",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
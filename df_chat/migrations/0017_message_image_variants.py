@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:06
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0016_message_image_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="messageimage",
+            name="placeholder",
+            field=models.CharField(blank=True, max_length=7),
+        ),
+        migrations.AddField(
+            model_name="messageimage",
+            name="variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:15
+
+from django.db import migrations
+from django.db import models
+
+import django.db.models.deletion
+import hashid_field.field
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0018_message_image_upload"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageNotificationBatch",
+            fields=[
+                (
+                    "id",
+                    hashid_field.field.BigHashidAutoField(
+                        alphabet="ABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890",
+                        auto_created=True,
+                        min_length=13,
+                        prefix="",
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "first_message",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="df_chat.message",
+                    ),
+                ),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="df_chat.room",
+                    ),
+                ),
+                (
+                    "rule",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="df_chat.messagenotificationrule",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("rule", "room"), name="df_chat_notification_batch_room"
+                    )
+                ],
+            },
+        ),
+    ]
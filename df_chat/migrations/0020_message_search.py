@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:23
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db import models
+
+import df_chat.search
+import django.db.models.deletion
+
+
+# See df_chat.search
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE df_chat_message_fts USING fts5(
+        body, content='df_chat_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER df_chat_message_fts_insert AFTER INSERT ON df_chat_message BEGIN
+        INSERT INTO df_chat_message_fts(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER df_chat_message_fts_delete AFTER DELETE ON df_chat_message BEGIN
+        INSERT INTO df_chat_message_fts(df_chat_message_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER df_chat_message_fts_update AFTER UPDATE OF body ON df_chat_message BEGIN
+        INSERT INTO df_chat_message_fts(df_chat_message_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO df_chat_message_fts(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    # Indexes the existing messages
+    "INSERT INTO df_chat_message_fts(df_chat_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER df_chat_message_fts_update",
+    "DROP TRIGGER df_chat_message_fts_delete",
+    "DROP TRIGGER df_chat_message_fts_insert",
+    "DROP TABLE df_chat_message_fts",
+]
+
+
+def get_postgresql_index():
+    return GinIndex(
+        SearchVector("body", config="simple"), name="df_chat_message_search"
+    )
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for sql in SQLITE_FORWARD:
+            schema_editor.execute(sql)
+    elif vendor == "postgresql":
+        schema_editor.add_index(
+            apps.get_model("df_chat", "Message"), get_postgresql_index()
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for sql in SQLITE_BACKWARD:
+            schema_editor.execute(sql)
+    elif vendor == "postgresql":
+        schema_editor.remove_index(
+            apps.get_model("df_chat", "Message"), get_postgresql_index()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0019_message_notification_batch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageSearchIndex",
+            fields=[
+                (
+                    "message",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search_index",
+                        serialize=False,
+                        to="df_chat.message",
+                    ),
+                ),
+                ("body", df_chat.search.FullTextField()),
+            ],
+            options={
+                "db_table": "df_chat_message_fts",
+                "managed": False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
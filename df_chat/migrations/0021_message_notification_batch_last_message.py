@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:03
+
+from django.db import migrations
+from django.db import models
+from django.db.models import OuterRef
+from django.db.models import Subquery
+
+import django.db.models.deletion
+
+
+def backfill_last_message(apps, schema_editor):
+    """
+    The pending batches end at the last message of their room.
+    """
+    Message = apps.get_model("df_chat", "Message")
+    MessageNotificationBatch = apps.get_model("df_chat", "MessageNotificationBatch")
+    MessageNotificationBatch.objects.filter(first_message__isnull=False).update(
+        last_message=Subquery(
+            Message.objects.filter(room=OuterRef("room"))
+            .order_by("-id")
+            .values("id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0020_message_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="messagenotificationbatch",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="df_chat.message",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="messagenotificationbatch",
+            name="first_message",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="df_chat.message",
+            ),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
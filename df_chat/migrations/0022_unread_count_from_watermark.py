@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:24
+
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("df_chat", "0021_message_notification_batch_last_message"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="roomuser",
+            name="unread_count",
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_reaction", False)),
+                fields=["room", "id"],
+                name="df_chat_message_unread",
+            ),
+        ),
+    ]
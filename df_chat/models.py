@@ -1,18 +1,43 @@
+from datetime import timedelta
+from df_chat.search import FTS_TABLE
+from df_chat.search import FullTextField
+from df_chat.search import search_messages
+from df_chat.settings import api_settings
 from df_notifications.decorators import register_rule_model
 from df_notifications.models import NotificationModelAsyncRule
+from df_notifications.models import send_notification
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db import transaction
+from django.db.models import Case
 from django.db.models import Count
 from django.db.models import Exists
+from django.db.models import ExpressionWrapper
 from django.db.models import F
 from django.db.models import OuterRef
+from django.db.models import Prefetch
 from django.db.models import Q
+from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models import When
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Greatest
+from django.db.models.functions import Least
 from django.db.models.manager import BaseManager
 from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
 from django.dispatch import receiver
-from itertools import repeat
+from django.utils import timezone
+from functools import partial
 from model_utils.models import TimeStampedModel
+from typing import Any
+from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Optional
+
+import mimetypes
 
 
 User = get_user_model()
@@ -30,6 +55,65 @@ class UserChatManager(models.Manager):
         )
         return user_chat
 
+    def set_online(
+        self, user_presences: Dict[Any, bool], refreshed_user_pks: Iterable = ()
+    ):
+        """
+        Persists the presence of many users at once, creating the missing UserChat objects.
+
+        The presence lease of the online users, and of the users whose connections sent a heartbeat, is renewed.
+        """
+        online_user_pks = {pk for pk, is_online in user_presences.items() if is_online}
+        offline_user_pks = {
+            pk for pk, is_online in user_presences.items() if not is_online
+        }
+        # A transition is more recent than a heartbeat
+        online_user_pks |= set(refreshed_user_pks) - offline_user_pks
+        if online_user_pks:
+            presence_expires_at = timezone.now() + timedelta(
+                seconds=api_settings.PRESENCE_LEASE_TTL
+            )
+            self.bulk_create(
+                [
+                    self.model(
+                        user_id=pk,
+                        is_online=True,
+                        presence_expires_at=presence_expires_at,
+                    )
+                    for pk in online_user_pks
+                ],
+                ignore_conflicts=True,
+            )
+            self.filter(user_id__in=online_user_pks).update(
+                is_online=True, presence_expires_at=presence_expires_at
+            )
+        if offline_user_pks:
+            self.filter(user_id__in=offline_user_pks, is_online=True).update(
+                is_online=False
+            )
+
+    def expire_presence(self) -> List[Any]:
+        """
+        Marks the users whose presence lease expired as offline, in a single update.
+        The lease expires when the worker holding the connections of a user was killed.
+        The users who were online before the leases were introduced don't have one, and are expired too.
+
+        The expired users are locked until they are updated, so that a user renewing their lease in the meantime
+        isn't marked as offline. Returns the pks of these users.
+        """
+        expired = self.filter(
+            Q(presence_expires_at__isnull=True)
+            | Q(presence_expires_at__lt=timezone.now()),
+            is_online=True,
+        )
+        with transaction.atomic():
+            user_pks = list(
+                expired.select_for_update().values_list("user_id", flat=True)
+            )
+            if user_pks:
+                expired.filter(user_id__in=user_pks).update(is_online=False)
+        return user_pks
+
 
 class UserChat(models.Model):
     """
@@ -42,8 +126,22 @@ class UserChat(models.Model):
         User, related_name="user_chat", on_delete=models.CASCADE
     )
     is_online = models.BooleanField(default=False)
+    presence_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="The user is considered offline after this time, unless their connections send a heartbeat",
+    )
     objects = UserChatManager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["presence_expires_at"],
+                condition=Q(is_online=True),
+                name="df_chat_userchat_lease",
+            ),
+        ]
+
     def __str__(self):
         return str(self.user)
 
@@ -54,6 +152,16 @@ class RoomQuerySet(models.QuerySet):
             Q(is_public=True) | Q(users=user) | Q(admins=user) | Q(creator=user)
         ).distinct()
 
+    def prefetch_last_message(self, user=None):
+        return self.prefetch_related(
+            Prefetch(
+                "last_message",
+                queryset=Message.objects.with_room_user()
+                .prefetch_related("images")
+                .prefetch_reactions(user),
+            )
+        )
+
     def annotate_is_muted(self, user):
         return self.annotate(
             is_muted=Exists(
@@ -65,14 +173,24 @@ class RoomQuerySet(models.QuerySet):
         )
 
     def annotate_message_count(self, user=None):
+        """
+        The total is maintained on the rooms. The new messages are counted after the read watermark of the user,
+        see MessageQuerySet.count_unread.
+        The messages of a room the user didn't join or read yet are all new.
+        """
+        last_read_message = RoomUser.objects.filter(
+            room=OuterRef("id"), user=user, is_active=True
+        ).values("last_read_message")[:1]
         return self.annotate(
-            message_total_count=Count("roomuser__message__id", distinct=True),
-            message_read_count=Count(
-                "roomuser__message__id",
-                filter=Q(roomuser__message__seen_by=user),
-                distinct=True,
+            last_read_message_id=Subquery(last_read_message),
+            message_total_count=F("message_count"),
+            message_new_count=Case(
+                When(last_read_message_id__isnull=True, then=F("message_count")),
+                default=Message.objects.count_unread(
+                    OuterRef("id"), OuterRef("last_read_message_id")
+                ),
             ),
-            message_new_count=F("message_total_count") - F("message_read_count"),
+            message_read_count=F("message_total_count") - F("message_new_count"),
         )
 
 
@@ -93,6 +211,25 @@ class Room(TimeStampedModel):
     admins = models.ManyToManyField(User, blank=True, related_name="rooms_admin_set")
 
     muted_by = models.ManyToManyField(User, blank=True, related_name="room_muted_set")
+    message_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="The number of messages of the room, reactions excluded",
+    )
+    last_message = models.ForeignKey(
+        "Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        help_text="The newest message of the room, reactions excluded",
+    )
+    last_activity_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        help_text="The time of the newest message of the room, or the creation of the room",
+    )
 
     objects = RoomQuerySet.as_manager()
 
@@ -104,16 +241,22 @@ class Room(TimeStampedModel):
             "-modified",
             "title",
         )
+        indexes = [
+            models.Index(fields=["-modified", "title"], name="df_chat_room_ordering"),
+            models.Index(
+                fields=["-last_activity_at", "-created"], name="df_chat_room_activity"
+            ),
+        ]
 
 
 class RoomUserManager(models.Manager):
     def get_room_user(self, room_pk, user_pk):
-        room_user, _ = self.get_or_create(
+        room_user, created = self.get_or_create(
             room_id=room_pk,
             user_id=user_pk,
             is_active=True,
         )
-        if user_pk:
+        if user_pk and created:
             room_user.room.users.add(user_pk)
             # Public rooms are muted by default
             if room_user.room.is_public:
@@ -121,6 +264,72 @@ class RoomUserManager(models.Manager):
 
         return room_user
 
+    def provision_room_users(self, user_pk, room_pks: Iterable) -> List["RoomUser"]:
+        """
+        Ensures that a user has a RoomUser object for each of the given rooms, in a set-based manner.
+
+        The existing RoomUser objects are found with a single query, and the missing ones are created
+        with a single bulk insert. As `bulk_create` doesn't send signals, `post_save` is sent for the created
+        objects, so that the observers are still notified about them.
+        Returns the created RoomUser objects.
+        """
+        room_pks = set(room_pks)
+        existing_room_pks = set(
+            self.filter(user_id=user_pk, room_id__in=room_pks).values_list(
+                "room_id", flat=True
+            )
+        )
+        missing_room_pks = room_pks - existing_room_pks
+        if not missing_room_pks:
+            return []
+
+        self.bulk_create(
+            [self.model(room_id=pk, user_id=user_pk) for pk in missing_room_pks],
+            ignore_conflicts=True,
+        )
+        # Primary keys are not returned by a bulk insert ignoring conflicts.
+        # The user is selected, as it is used when the RoomUser objects are broadcasted.
+        room_users = list(
+            self.filter(user_id=user_pk, room_id__in=missing_room_pks).select_related(
+                "user"
+            )
+        )
+        for room_user in room_users:
+            post_save.send(
+                sender=self.model,
+                instance=room_user,
+                created=True,
+                update_fields=None,
+                raw=False,
+                using=self.db,
+            )
+        return room_users
+
+    def mark_read(self, room_user: "RoomUser", message_pk) -> None:
+        """
+        Advances the read watermark of a room user up to a message, the watermark never moves back.
+        The messages up to the watermark are read.
+        """
+        self.filter(
+            Q(last_read_message__isnull=True) | Q(last_read_message__lt=message_pk),
+            pk=room_user.pk,
+        ).update(last_read_message=message_pk)
+
+    def get_unread_count(self, room_user: "RoomUser") -> int:
+        """
+        The number of messages of the room of a room user after their read watermark, once they read a message.
+        """
+        return (
+            self.filter(pk=room_user.pk)
+            .annotate(
+                unread_count=Message.objects.count_unread(
+                    OuterRef("room"), OuterRef("last_read_message")
+                )
+            )
+            .values_list("unread_count", flat=True)
+            .get()
+        )
+
 
 class RoomUser(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
@@ -132,40 +341,127 @@ class RoomUser(models.Model):
         help_text="Leave empty for a system message",
     )
     is_active = models.BooleanField(default=True)
+    # The messages aren't deleted with the watermark, the watermark is only compared to message ids
+    last_read_message = models.ForeignKey(
+        "Message",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+        help_text="The messages of the room up to this one are read by the user",
+    )
     objects = RoomUserManager()
 
     @property
     def is_online(self):
         """
         A RoomUser could be an actual user or a system.
-        Here, we infer that a user is online only if they have a UserChat associated with them.
+        The presence is read from the presence backend, UserChat.is_online is only persisted in batches.
         """
-        return (
-            self.user
-            and hasattr(self.user, "user_chat")
-            and self.user.user_chat.is_online
-        )
+        from df_chat.presence import get_presence_backend
+
+        return bool(self.user_id) and get_presence_backend().is_online(self.user_id)
 
     def __str__(self):
         return f"{self.room}: {self.user}"
 
+    class Meta:
+        indexes = [
+            # Membership lookups, e.g. RoomUserManager.get_room_user
+            models.Index(
+                fields=["room", "user", "is_active"], name="df_chat_roomuser_member"
+            ),
+        ]
+
 
 class MessageQuerySet(models.QuerySet):
-    def prefetch_children(self):
-        lookup = "__".join(repeat("children", 3))
-        return self.prefetch_related("images", lookup)
+    def with_room_user(self):
+        return self.select_related("room_user__user")
+
+    def annotate_reply_count(self):
+        """
+        The number of replies of every message, counted with a subquery per message using the replies index.
+        The replies themselves are loaded on demand, see MessageViewSet.replies.
+        """
+        replies = (
+            Message.objects.filter(parent=OuterRef("id"), is_reaction=False)
+            .order_by()
+            .values("parent")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return self.annotate(reply_count=Coalesce(Subquery(replies), 0))
+
+    def count_unread(self, room, last_read_message) -> Coalesce:
+        """
+        The number of messages of a room after a read watermark, as a subquery.
+        It is a range scan of the df_chat_message_unread index, which only reads the unread messages.
+        """
+        unread = (
+            self.filter(room=room, is_reaction=False, id__gt=last_read_message)
+            .order_by()
+            .values("room")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return Coalesce(Subquery(unread), 0)
+
+    def annotate_is_seen_by_me(self, last_read_message_id=None):
+        """
+        The messages up to the read watermark of the user are seen, see RoomUserManager.mark_read.
+        """
+        if last_read_message_id is None:
+            return self.annotate(is_seen_by_me=Value(False))
+        return self.annotate(
+            is_seen_by_me=ExpressionWrapper(
+                Q(id__lte=last_read_message_id), output_field=models.BooleanField()
+            )
+        )
 
-    def annotate_is_seen_by_me(self, user=None):
+    def annotate_is_seen_by(self, user):
+        """
+        Like annotate_is_seen_by_me, for the messages of many rooms: each message is compared with the read watermark
+        of the user in its room.
+        """
+        last_read_message = RoomUser.objects.filter(
+            room=OuterRef("room"), user=user, is_active=True
+        ).values("last_read_message")[:1]
         return self.annotate(
-            is_seen_by_me=Exists(
-                Message.objects.filter(seen_by=user, id=OuterRef("id"))
+            is_seen_by_me=Coalesce(
+                ExpressionWrapper(
+                    Q(id__lte=Subquery(last_read_message)),
+                    output_field=models.BooleanField(),
+                ),
+                Value(False),
             )
         )
 
+    def search(self, query: str):
+        """
+        The messages whose body matches a full-text query, annotated with their `rank`, see df_chat.search.
+        """
+        return search_messages(self, query)
+
+    def prefetch_reactions(self, user=None):
+        """
+        Prefetches the reaction counters of the messages, and the reactions of the user.
+        """
+        return self.prefetch_related(
+            "reaction_counts",
+            Prefetch(
+                "children",
+                queryset=Message.objects.filter(is_reaction=True, room_user__user=user),
+                to_attr="user_reactions",
+            ),
+        )
+
 
 class MessageManager(BaseManager.from_queryset(MessageQuerySet)):
-    def get_queryset(self):
-        return super().get_queryset().prefetch_related("room_user__user")
+    """
+    The messages are lean by default: their relations are loaded by the call sites which use them,
+    e.g. with `MessageQuerySet.with_room_user`, so that lookups like `exists()` don't pay for them.
+    """
 
 
 class Message(TimeStampedModel):
@@ -173,10 +469,23 @@ class Message(TimeStampedModel):
 
     is_reaction = models.BooleanField(default=False)
     room_user = models.ForeignKey(RoomUser, on_delete=models.CASCADE)
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name="messages",
+        editable=False,
+        help_text="The room of the room user, to query the messages of a room without joining the room users",
+    )
     parent = models.ForeignKey(
         "self", blank=True, null=True, on_delete=models.CASCADE, related_name="children"
     )
     body = models.TextField(default="")
+    client_id = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text="Idempotency key generated by the client, so that a message sent twice is created once",
+    )
     objects = MessageManager()
 
     # TODO(alexis): consider through a model to record timestamps when the message is seen / sent to implement
@@ -186,14 +495,109 @@ class Message(TimeStampedModel):
         User, blank=True, related_name="message_received_set"
     )
 
-    def reactions(self):
-        return [m for m in self.children.all() if m.is_reaction]
+    def save(self, *args, **kwargs):
+        if self.room_id is None:
+            self.room_id = self.room_user.room_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.room_user.user.email if self.room_user.user else '__system___'}: {self.body}"
 
     class Meta:
         ordering = ("-created",)
+        indexes = [
+            # The messages of a room listed newest first, reactions are listed with their parent
+            models.Index(
+                fields=["room", "-created", "-id"],
+                condition=Q(is_reaction=False),
+                name="df_chat_message_list",
+            ),
+            # The unread messages of a room, after a read watermark, see MessageQuerySet.count_unread
+            models.Index(
+                fields=["room", "id"],
+                condition=Q(is_reaction=False),
+                name="df_chat_message_unread",
+            ),
+            # The replies of a message, see MessageQuerySet.annotate_reply_count
+            models.Index(
+                fields=["parent", "-created", "-id"],
+                condition=Q(is_reaction=False),
+                name="df_chat_message_replies",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=("room_user", "client_id"),
+                condition=Q(client_id__isnull=False),
+                name="df_chat_message_unique_client_id",
+            ),
+        ]
+
+
+class MessageSearchIndex(models.Model):
+    """
+    The full-text index of the bodies of the messages on SQLite, maintained by the database, see df_chat.search.
+    The table doesn't exist on the other databases.
+    """
+
+    message = models.OneToOneField(
+        Message,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        related_name="search_index",
+    )
+    body = FullTextField()
+
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
+
+
+class MessageReactionCountManager(models.Manager):
+    def increment(self, message_pk, reaction: str):
+        self.bulk_create(
+            [self.model(message_id=message_pk, reaction=reaction)],
+            ignore_conflicts=True,
+        )
+        self.filter(message_id=message_pk, reaction=reaction).update(
+            count=F("count") + 1
+        )
+
+    def decrement(self, message_pk, reaction: str):
+        counts = self.filter(message_id=message_pk, reaction=reaction)
+        counts.filter(count__gt=0).update(count=F("count") - 1)
+        counts.filter(count=0).delete()
+
+
+class MessageReactionCount(models.Model):
+    """
+    The number of reactions of a message by reaction (e.g. an emoji), maintained when reactions are created
+    and deleted, so that the reactions of a message are listed without reading them.
+    """
+
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, related_name="reaction_counts"
+    )
+    reaction = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=0)
+    objects = MessageReactionCountManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("message", "reaction"),
+                name="df_chat_message_reaction_count_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.reaction}: {self.count}"
+
+
+def guess_content_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or ""
 
 
 class MessageImage(TimeStampedModel):
@@ -208,36 +612,280 @@ class MessageImage(TimeStampedModel):
     )
     width = models.IntegerField(default=500)
     height = models.IntegerField(default=300)
+    # Saved at upload, so that the images are serialized without requests to the storage
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    # The storage names of the downscaled variants, and the color displayed while they load, see df_chat.images
+    variants = models.JSONField(default=dict, blank=True)
+    placeholder = models.CharField(max_length=7, blank=True)
+
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            # The uploaded file is still local, before it is saved to the storage
+            self.size = self.image.file.size
+            self.content_type = getattr(
+                self.image.file, "content_type", None
+            ) or guess_content_type(self.image.name)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.image.url
 
 
+class MessageImageUpload(TimeStampedModel):
+    """
+    An image uploaded in chunks, which can be resumed from its offset, see df_chat.uploads.
+    Once complete, it is attached to its message, or to a new message of its room, like a MessageImage uploaded at once.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    room = models.ForeignKey(
+        Room, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    # The number of bytes received, the next chunk starts there
+    offset = models.PositiveBigIntegerField(default=0)
+    # The storage names of the chunks received, in order
+    parts = models.JSONField(default=list, blank=True)
+
+
 @register_rule_model
 class MessageNotificationRule(NotificationModelAsyncRule):
+    """
+    Notifies the offline members of a room of its new messages.
+
+    The messages are batched by room for `NOTIFICATION_BATCH_INTERVAL` seconds, then the recipients are resolved
+    once, and each of them gets a single digest of the batch (see `df_chat.tasks.send_notification_batch_task`).
+    """
+
     model = Message
 
     def get_users(self, instance: Message) -> List[User]:
+        return self.get_room_users(instance.room_id, [instance.room_user.user_id])
+
+    def get_room_users(self, room_pk: Any, sender_pks: Iterable) -> List[User]:
         return (
             User.objects.filter(
-                roomuser__room=instance.room_user.room,
+                roomuser__room=room_pk,
                 roomuser__is_active=True,
                 roomuser__user__user_chat__is_online=False,
             )
-            .exclude(id=instance.room_user.user.id if instance.room_user.user else None)
-            .exclude(id__in=instance.room_user.room.muted_by.values("id"))
+            .exclude(id__in=sender_pks)
+            .exclude(
+                id__in=Room.muted_by.through.objects.filter(room_id=room_pk).values(
+                    "user_id"
+                )
+            )
             .distinct()
         )
 
     @classmethod
     def get_queryset(cls, instance, prev):
-        if instance.room_user.user:
+        # Only the new messages are notified, and not the system messages
+        if prev is None and instance.room_user.user_id:
             return cls.objects.all()
-        # Do not send notifications for system messages
         return cls.objects.none()
 
+    def send(self, instance: Message) -> None:
+        def add_to_batch():
+            batch_pk = MessageNotificationBatch.objects.add(self, instance)
+            if batch_pk is not None:
+                from df_chat.tasks import send_notification_batch_task
+
+                send_notification_batch_task.apply_async(
+                    (str(batch_pk),), countdown=api_settings.NOTIFICATION_BATCH_INTERVAL
+                )
+
+        transaction.on_commit(add_to_batch)
+
+    def send_batch(
+        self, room_pk: Any, first_message_pk: Any, last_message_pk: Any
+    ) -> None:
+        """
+        Sends the digest of the messages of a room, from the first to the last message of a batch.
+        """
+        messages = list(
+            Message.objects.filter(
+                room=room_pk,
+                id__gte=first_message_pk,
+                id__lte=last_message_pk,
+                is_reaction=False,
+                room_user__user__isnull=False,
+            )
+            .order_by("created", "id")
+            .values_list("id", "room_user__user_id")
+        )
+        if not messages:
+            return
+        users = list(self.get_room_users(room_pk, {user_pk for _, user_pk in messages}))
+        if not users:
+            return
+        notification = send_notification(
+            users,
+            self.channel,
+            self.get_template_prefixes(),
+            {
+                **self.context,
+                "instance": Message.objects.with_room_user().get(pk=messages[-1][0]),
+                "room": Room.objects.get(pk=room_pk),
+                "message_count": len(messages),
+            },
+        )
+        self.history.add(notification)
+
+
+# The times a message is added to the batch of its room again, when the batch is deleted in the meantime
+BATCH_ADD_ATTEMPTS = 3
+
+
+class MessageNotificationBatchManager(models.Manager):
+    def add(self, rule: MessageNotificationRule, message: Message) -> Any:
+        """
+        Adds a message to the pending batch of its room, or starts a batch from it.
+        Returns the pk of the batch when it was started, and has to be sent.
+        """
+        message_pk = Value(int(message.pk))
+        # The batch may be popped or started concurrently, or deleted with its room or its rule
+        for _ in range(BATCH_ADD_ATTEMPTS):
+            batch, created = self.get_or_create(
+                rule=rule,
+                room_id=message.room_id,
+                defaults={"first_message": message, "last_message": message},
+            )
+            if created:
+                return batch.pk
+            if self.filter(pk=batch.pk, first_message__isnull=False).update(
+                # The messages are added once committed, not always in the order of their ids
+                first_message=Least("first_message", message_pk),
+                last_message=Greatest("last_message", message_pk),
+            ):
+                return None
+            if self.filter(pk=batch.pk, first_message__isnull=True).update(
+                first_message=message, last_message=message
+            ):
+                return batch.pk
+        return None
+
+    def pop(self, batch_pk: Any) -> Optional["MessageNotificationBatch"]:
+        """
+        Returns a pending batch, and marks it as sent: the next messages start a new batch.
+        """
+        with transaction.atomic():
+            batch = (
+                self.select_for_update()
+                .select_related("rule")
+                .filter(pk=batch_pk, first_message__isnull=False)
+                .first()
+            )
+            if batch is not None:
+                self.filter(pk=batch_pk).update(first_message=None, last_message=None)
+        return batch
+
+
+class MessageNotificationBatch(models.Model):
+    """
+    The messages of a room waiting to be notified by a rule, from the first to the last one.
+    """
+
+    rule = models.ForeignKey(
+        MessageNotificationRule, on_delete=models.CASCADE, related_name="+"
+    )
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="+")
+    # None when no batch is pending. The bounds are kept when their messages are deleted, they are only
+    # compared to message ids
+    first_message = models.ForeignKey(
+        Message,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_message = models.ForeignKey(
+        Message,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    objects = MessageNotificationBatchManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["rule", "room"], name="df_chat_notification_batch_room"
+            ),
+        ]
+
+
+@receiver(post_save, sender=Message)
+def count_created_message(sender, instance, created, raw=False, *args, **kwargs):
+    """
+    Maintains the message counter and the last message of the room,
+    or the reaction counters of the message a reaction is added to.
+    Sending a message reads the room up to it.
+
+    The other members of the room aren't written to: their unread messages are counted from their read watermark,
+    see MessageQuerySet.count_unread.
+    """
+    if not created or raw:
+        return
+    if instance.is_reaction:
+        if instance.parent_id:
+            MessageReactionCount.objects.increment(instance.parent_id, instance.body)
+        return
+    Room.objects.filter(id=instance.room_id).update(
+        message_count=F("message_count") + 1,
+        last_message=instance.id,
+        last_activity_at=instance.created,
+    )
+    RoomUser.objects.filter(id=instance.room_user_id).update(
+        last_read_message=instance.id
+    )
+
+
+@receiver(post_save, sender=MessageImage)
+def process_uploaded_image(sender, instance, created, raw=False, *args, **kwargs):
+    """
+    The variants of the uploaded images are generated by the Celery workers, outside of the upload requests.
+    """
+    if not created or raw:
+        return
+    from df_chat.tasks import process_image_task
+
+    transaction.on_commit(partial(process_image_task.delay, str(instance.pk)))
+
+
+@receiver(pre_delete, sender=Message)
+def count_deleted_message(sender, instance, *args, **kwargs):
+    if instance.is_reaction:
+        if instance.parent_id:
+            MessageReactionCount.objects.decrement(instance.parent_id, instance.body)
+        return
+    Room.objects.filter(id=instance.room_id, message_count__gt=0).update(
+        message_count=F("message_count") - 1
+    )
+
 
 @receiver(post_delete, sender=Message)
-def notify_delete_reaction(sender, instance, *args, **kwargs):
-    if instance.parent:
-        instance.parent.save()
+def update_last_message(sender, instance, *args, **kwargs):
+    """
+    The last message of a room is unset when it is deleted, and then recomputed from the remaining messages,
+    along with the last activity of the room, which falls back to its creation.
+    It is only recomputed once the messages are deleted, as a message may be deleted along with its replies.
+    """
+    last_message = Message.objects.filter(
+        room=instance.room_id, is_reaction=False
+    ).order_by("-created", "-id")[:1]
+    Room.objects.filter(id=instance.room_id, last_message__isnull=True).update(
+        last_message=Subquery(last_message.values("id")),
+        last_activity_at=Coalesce(
+            Subquery(last_message.values("created")), F("created")
+        ),
+    )
@@ -0,0 +1,201 @@
+"""
+Presence of the users, tracked by counting their live websocket connections.
+
+A user is online while they have at least one live connection, whatever the number of tabs or devices.
+The counters live in a store shared by all the workers (the Django cache by default), so connecting or
+disconnecting doesn't touch the database. Only the transitions (first connection, last disconnection)
+are reported, and they are persisted to `UserChat.is_online` in batches by the `PresenceWriter`.
+
+As a killed worker never reports the disconnection of its connections, the connections send a heartbeat
+renewing the presence lease of their user (`UserChat.presence_expires_at`), and the users whose lease expired
+are swept offline periodically (see `df_chat.tasks.sweep_presence_task` and the `sweep_presence` command).
+"""
+from channels.db import database_sync_to_async
+from df_chat.models import UserChat
+from df_chat.settings import api_settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Set
+
+import asyncio
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class BasePresenceBackend:
+    """
+    Counts the live connections of the users.
+
+    `connect` and `disconnect` return True when the user went online or offline respectively.
+    """
+
+    def connect(self, user_pk: Any) -> bool:
+        raise NotImplementedError
+
+    def disconnect(self, user_pk: Any) -> bool:
+        raise NotImplementedError
+
+    def is_online(self, user_pk: Any) -> bool:
+        raise NotImplementedError
+
+    def reset(self, user_pks: Iterable):
+        """
+        Forgets the connections of users, when they were swept offline.
+        """
+        raise NotImplementedError
+
+
+class LocalPresenceBackend(BasePresenceBackend):
+    """
+    Keeps the counters in memory. Only suitable for tests and single process deployments.
+    """
+
+    def __init__(self):
+        self.counters: Dict[Any, int] = {}
+        self.lock = threading.Lock()
+
+    def connect(self, user_pk: Any) -> bool:
+        with self.lock:
+            self.counters[user_pk] = self.counters.get(user_pk, 0) + 1
+            return self.counters[user_pk] == 1
+
+    def disconnect(self, user_pk: Any) -> bool:
+        with self.lock:
+            if not self.counters.get(user_pk):
+                return False
+            self.counters[user_pk] -= 1
+            if self.counters[user_pk]:
+                return False
+            del self.counters[user_pk]
+            return True
+
+    def is_online(self, user_pk: Any) -> bool:
+        return bool(self.counters.get(user_pk))
+
+    def reset(self, user_pks: Iterable):
+        with self.lock:
+            for user_pk in user_pks:
+                self.counters.pop(user_pk, None)
+
+
+class CachePresenceBackend(BasePresenceBackend):
+    """
+    Keeps the counters in the Django cache, using its atomic increments.
+    The cache must be shared by all the workers (e.g. Redis or Memcached), see `is_shared`.
+    """
+
+    key_prefix = "df_chat:presence:"
+
+    @property
+    def cache(self):
+        return caches[api_settings.PRESENCE_CACHE]
+
+    def is_shared(self) -> bool:
+        """
+        Whether the cache is shared by the processes. A process-local cache (e.g. Django's default LocMemCache)
+        would count the connections of every worker separately.
+        """
+        return not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def get_key(self, user_pk: Any) -> str:
+        return f"{self.key_prefix}{user_pk}"
+
+    def connect(self, user_pk: Any) -> bool:
+        key = self.get_key(user_pk)
+        self.cache.add(key, 0, timeout=None)
+        return self.cache.incr(key) == 1
+
+    def disconnect(self, user_pk: Any) -> bool:
+        key = self.get_key(user_pk)
+        try:
+            count = self.cache.decr(key)
+        except ValueError:
+            # The counter was evicted, the user is considered offline already
+            return False
+        if count < 0:
+            # A disconnection which wasn't counted, e.g. after the counter was evicted
+            self.cache.set(key, 0, timeout=None)
+        return count == 0
+
+    def is_online(self, user_pk: Any) -> bool:
+        return bool(self.cache.get(self.get_key(user_pk)))
+
+    def reset(self, user_pks: Iterable):
+        self.cache.delete_many([self.get_key(user_pk) for user_pk in user_pks])
+
+
+_backends: Dict[type, BasePresenceBackend] = {}
+
+
+def get_presence_backend() -> BasePresenceBackend:
+    backend_class = api_settings.PRESENCE_BACKEND
+    if backend_class not in _backends:
+        backend = backend_class()
+        if isinstance(backend, CachePresenceBackend) and not backend.is_shared():
+            logger.warning(
+                "The %r cache of the presence is local to each process, the connections are counted in memory: "
+                "set DF_CHAT['PRESENCE_CACHE'] to a cache shared by all the workers, e.g. Redis or Memcached.",
+                api_settings.PRESENCE_CACHE,
+            )
+            backend = LocalPresenceBackend()
+        _backends[backend_class] = backend
+    return _backends[backend_class]
+
+
+class PresenceWriter:
+    """
+    Persists the presence transitions to `UserChat.is_online`.
+
+    The transitions are collected for `PRESENCE_WRITE_INTERVAL` milliseconds and written with a few bulk queries.
+    Only the last transition of a user is written, so a user reconnecting right away isn't written at all
+    (e.g. when reloading a page). The heartbeats are written along, renewing the presence leases at once.
+    """
+
+    def __init__(self):
+        self.pending: Dict[Any, bool] = {}
+        self.heartbeats: Set[Any] = set()
+        self.flush_task = None
+
+    async def add(self, user_pk: Any, is_online: bool):
+        self.pending[user_pk] = is_online
+        await self.schedule_flush()
+
+    async def heartbeat(self, user_pk: Any):
+        self.heartbeats.add(user_pk)
+        await self.schedule_flush()
+
+    async def schedule_flush(self):
+        interval = api_settings.PRESENCE_WRITE_INTERVAL
+        if not interval:
+            await self.flush()
+            return
+
+        loop = asyncio.get_running_loop()
+        if (
+            self.flush_task is None
+            or self.flush_task.done()
+            or self.flush_task.get_loop() is not loop
+        ):
+            self.flush_task = loop.create_task(self._flush_later(interval / 1000))
+
+    async def _flush_later(self, interval: float):
+        await asyncio.sleep(interval)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        heartbeats, self.heartbeats = self.heartbeats, set()
+        if pending or heartbeats:
+            await database_sync_to_async(UserChat.objects.set_online)(
+                pending, heartbeats
+            )
+
+
+presence_writer = PresenceWriter()
@@ -0,0 +1,78 @@
+"""
+Full-text search of the bodies of the messages, see `MessageQuerySet.search`.
+
+The index depends on the database, and is kept in sync with the messages by the database itself, including
+for the bulk updates and deletions:
+- SQLite: the FTS5 table `df_chat_message_fts` (the unmanaged `MessageSearchIndex` model) indexes the bodies
+  of `df_chat_message`, and is maintained by triggers on it. The messages are ranked with bm25.
+- PostgreSQL: a GIN index on the `tsvector` of the bodies, in the `simple` text search configuration as the
+  messages may be in any language. The messages are ranked with `ts_rank`.
+- Other databases: the bodies are scanned, and the messages are not ranked.
+
+The triggers of SQLite are created by the migration `0020_message_search`. SQLite migrations which rebuild
+the `df_chat_message` table drop them, so such migrations have to create them again.
+"""
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.contrib.postgres.search import SearchVector
+from django.db import connections
+from django.db import models
+from django.db.models import FloatField
+from django.db.models import Lookup
+from django.db.models import QuerySet
+from django.db.models import Value
+from django.db.models.expressions import RawSQL
+
+
+FTS_TABLE = "df_chat_message_fts"
+# The text search configuration of the GIN index, changing it requires a new index
+SEARCH_CONFIG = "simple"
+
+
+class FullTextField(models.TextField):
+    """
+    A column of a full-text table of SQLite, see MessageSearchIndex.
+    """
+
+
+@FullTextField.register_lookup
+class Match(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+
+def get_fts_query(query: str) -> str:
+    """
+    Every term is quoted, so that the syntax of the FTS5 queries isn't exposed: the messages contain all the terms.
+    """
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+
+
+def search_messages(queryset: QuerySet, query: str) -> QuerySet:
+    """
+    Filters the messages matching a query, and annotates their `rank`, the higher the better.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == "sqlite":
+        # The messages are joined with the full-text table, which ranks them in the same pass
+        return queryset.filter(search_index__body__match=get_fts_query(query)).annotate(
+            rank=RawSQL(f"-bm25({FTS_TABLE})", (), output_field=FloatField())
+        )
+
+    if vendor == "postgresql":
+        # The expression of the GIN index, so that it is used
+        vector = SearchVector("body", config=SEARCH_CONFIG)
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+        return (
+            queryset.annotate(search_vector=vector)
+            .filter(search_vector=search_query)
+            .annotate(rank=SearchRank(vector, search_query))
+        )
+
+    for term in query.split():
+        queryset = queryset.filter(body__icontains=term)
+    return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
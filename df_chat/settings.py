@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.signals import setting_changed
+from rest_framework.settings import APISettings
+
+
+class DeliveryMode:
+    # Every connection joins one group per room the user is part of.
+    ROOM = "room"
+    # Every connection joins a single group for its user, events are fanned out to room members on send.
+    USER = "user"
+
+
+DEFAULTS = {
+    "DELIVERY_MODE": DeliveryMode.ROOM,
+    # Time window in milliseconds to coalesce the events sent to a websocket, 0 sends every event right away.
+    "OUTBOUND_BUFFER_WINDOW": 0,
+    # Maximum number of events in a coalesced frame.
+    "OUTBOUND_BUFFER_MAX_EVENTS": 50,
+    # Counts the live connections of the users, see df_chat.presence.
+    "PRESENCE_BACKEND": "df_chat.presence.CachePresenceBackend",
+    # Alias of the cache used by the CachePresenceBackend, it must be shared by all the workers.
+    "PRESENCE_CACHE": "default",
+    # Time window in milliseconds to batch the writes of UserChat.is_online, 0 writes every transition right away.
+    "PRESENCE_WRITE_INTERVAL": 1000,
+    # Time in seconds between the heartbeats of a connection, renewing the presence lease of its user.
+    "PRESENCE_HEARTBEAT_INTERVAL": 30,
+    # Time in seconds after which a user whose connections stopped sending heartbeats is swept offline.
+    "PRESENCE_LEASE_TTL": 90,
+    # The ephemeral events the clients can send to the rooms, they are never stored.
+    "EPHEMERAL_EVENTS": ["typing", "recording"],
+    # Minimum time in seconds between two identical ephemeral events sent by a connection to a room.
+    "EPHEMERAL_EVENT_INTERVAL": 1,
+    # Time in seconds an ephemeral event is valid for, the clients stop displaying it afterwards.
+    "EPHEMERAL_EVENT_TTL": 5,
+    # Time window in milliseconds to batch the writes of Message.received_by and the receipts sent to the senders,
+    # 0 writes every delivery right away.
+    "RECEIPT_WRITE_INTERVAL": 500,
+    # The downscaled variants of the images of the messages, by name, with their maximum width and height in pixels.
+    "IMAGE_VARIANTS": {"thumbnail": 320, "preview": 1280},
+    # Maximum size in bytes of an image uploaded in chunks.
+    "IMAGE_UPLOAD_MAX_SIZE": 50 * 1024 * 1024,
+    # Time in seconds after which an upload which received no chunk is deleted, with its chunks.
+    "IMAGE_UPLOAD_TTL": 24 * 60 * 60,
+    # Time window in seconds to batch the new messages of a room, whose offline members get a single notification.
+    "NOTIFICATION_BATCH_INTERVAL": 10,
+}
+
+IMPORT_STRINGS = [
+    "PRESENCE_BACKEND",
+]
+
+
+class ChatSettings(APISettings):
+    @property
+    def user_settings(self):
+        if not hasattr(self, "_user_settings"):
+            self._user_settings = getattr(settings, "DF_CHAT", None) or {}
+        return self._user_settings
+
+
+api_settings = ChatSettings(None, DEFAULTS, IMPORT_STRINGS)
+
+
+def reload_api_settings(*args, setting, **kwargs):
+    if setting == "DF_CHAT":
+        api_settings.reload()
+
+
+setting_changed.connect(reload_api_settings)
@@ -0,0 +1,62 @@
+from celery import current_app as app
+from df_chat.asgi.consumers import send_presence
+from df_chat.asgi.consumers import send_updated_message
+from df_chat.images import process_image
+from df_chat.models import MessageImage
+from df_chat.models import MessageNotificationBatch
+from df_chat.models import UserChat
+from df_chat.presence import get_presence_backend
+from df_chat.uploads import expire_uploads
+from itertools import islice
+from typing import Any
+from typing import List
+
+
+# The presence of the swept users is sent in chunks, to bound the size of the queries
+SWEEP_CHUNK_SIZE = 1000
+
+
+@app.task
+def sweep_presence_task() -> List[Any]:
+    """
+    Marks the users whose presence lease expired as offline, and sends their presence to the members of their rooms.
+    """
+    user_pks = UserChat.objects.expire_presence()
+    pks = iter(user_pks)
+    while chunk := list(islice(pks, SWEEP_CHUNK_SIZE)):
+        get_presence_backend().reset(chunk)
+        send_presence(chunk)
+    return user_pks
+
+
+@app.task
+def process_image_task(image_pk: Any) -> None:
+    """
+    Generates the variants of an uploaded image, and sends its message again with their URLs.
+    """
+    image = MessageImage.objects.select_related("message").filter(pk=image_pk).first()
+    if image is None:
+        # The image was deleted in the meantime
+        return
+    process_image(image)
+    send_updated_message(image.message)
+
+
+@app.task
+def expire_uploads_task() -> int:
+    """
+    Deletes the chunked uploads which were abandoned, with their chunks.
+    """
+    return expire_uploads()
+
+
+@app.task
+def send_notification_batch_task(batch_pk: Any) -> None:
+    """
+    Sends the digest of a batch of messages, once its window is over.
+    """
+    batch = MessageNotificationBatch.objects.pop(batch_pk)
+    if batch is None:
+        # The batch was sent already
+        return
+    batch.rule.send_batch(batch.room_id, batch.first_message_id, batch.last_message_id)
@@ -1,9 +1,13 @@
 from channels.db import database_sync_to_async
+from contextlib import asynccontextmanager
 from df_chat.models import Room
 from df_chat.models import User
 from df_chat.tests.utils import RoomFactory
 from df_chat.tests.utils import TEST_USER_PASSWORD
 from df_chat.tests.utils import UserFactory
+from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
 from rest_framework.reverse import reverse
 from typing import Tuple
 
@@ -44,3 +48,18 @@ class BaseTestUtilsMixin:
         Creates a Room object and adds the users to it.
         """
         return self.create_room_and_add_users(*users)
+
+    @asynccontextmanager
+    async def async_capture_queries(self):
+        """
+        Captures the queries executed by the consumers.
+        The sync code of the consumers runs in a different thread, so we capture the queries of its connection.
+        """
+        context = await database_sync_to_async(
+            lambda: CaptureQueriesContext(connections[DEFAULT_DB_ALIAS])
+        )()
+        await database_sync_to_async(context.__enter__)()
+        try:
+            yield context
+        finally:
+            await database_sync_to_async(context.__exit__)(None, None, None)
@@ -1,8 +1,14 @@
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 from df_chat.models import Message
 from df_chat.models import RoomUser
+from df_chat.models import UserChat
+from df_chat.settings import DeliveryMode
 from df_chat.tests.base import BaseTestUtilsMixin
+from df_chat.tests.utils import RoomFactory
+from django.conf import settings
+from django.test import override_settings
 from django.test import TransactionTestCase
 from tests.asgi import application
 
@@ -222,6 +228,619 @@ class TestChat(TransactionTestCase, BaseTestUtilsMixin):
         await communicator2.disconnect()
         await communicator3.disconnect()
 
+    @override_settings(DF_CHAT={**settings.DF_CHAT, "DELIVERY_MODE": DeliveryMode.USER})
+    async def test_chat_user_delivery_mode(self):
+        """
+        In the user delivery mode, a connection joins the same number of groups regardless of the number of rooms,
+        and room events are still delivered to the room members only.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, token2 = await self.async_create_user()
+        user3, token3 = await self.async_create_user()
+        room_of_user1_and_user2 = await self.async_create_room_and_add_users(
+            user1, user2
+        )
+        for _ in range(5):
+            await self.async_create_room_and_add_users(user1, user3)
+
+        channel_layer = get_channel_layer()
+        groups_before_connect = {
+            group for group, channels in channel_layer.groups.items() if channels
+        }
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        groups_after_connect = {
+            group for group, channels in channel_layer.groups.items() if channels
+        }
+        # One group per observer, even though user1 is part of 6 rooms
+        self.assertEqual(len(groups_after_connect - groups_before_connect), 3)
+
+        communicator2 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await communicator2.connect()
+        communicator3 = WebsocketCommunicator(application, f"ws/chat/?token={token3}")
+        await communicator3.connect()
+
+        # user1 is notified about user2 joining their common room, and user3 joining the 5 other rooms
+        for _ in range(6):
+            event = await communicator1.receive_json_from()
+            self.assertEqual(len(event["users"]), 1)
+
+        room_user2 = await database_sync_to_async(RoomUser.objects.get)(
+            room=room_of_user1_and_user2, user=user2
+        )
+        await database_sync_to_async(Message.objects.create)(
+            room_user=room_user2, body="Hi"
+        )
+        event1 = await communicator1.receive_json_from()
+        event2 = await communicator2.receive_json_from()
+        self.assertEqual(event1["messages"][0]["body"], "Hi")
+        self.assertFalse(event1["messages"][0]["is_me"])
+        self.assertTrue(event2["messages"][0]["is_me"])
+        # user3 is not part of the room
+        self.assertTrue(await communicator3.receive_nothing())
+
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+        await communicator3.disconnect()
+        groups_after_disconnect = {
+            group for group, channels in channel_layer.groups.items() if channels
+        }
+        self.assertEqual(groups_after_disconnect, groups_before_connect)
+
+    async def test_disconnect_does_not_query_rooms(self):
+        """
+        On disconnect, the consumer unsubscribes using the rooms it subscribed to, without querying them again.
+        """
+        user, token = await self.async_create_user()
+        for _ in range(3):
+            await self.async_create_room_and_add_users(user)
+        communicator = WebsocketCommunicator(application, f"ws/chat/?token={token}")
+        await communicator.connect()
+
+        async with self.async_capture_queries() as context:
+            await communicator.disconnect()
+
+        self.assertFalse(
+            [
+                query
+                for query in context.captured_queries
+                if "df_chat_room" in query["sql"]
+            ]
+        )
+
+    async def test_join_room_while_connected(self):
+        """
+        When a user joins a room while connected, the consumer subscribes to it without reconnecting.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, _ = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user2)
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+
+        await database_sync_to_async(RoomUser.objects.get_room_user)(
+            room_pk=room.pk, user_pk=user1.pk
+        )
+        # Let the consumer process the membership event and subscribe to the room
+        self.assertTrue(await communicator1.receive_nothing())
+        room_user2 = await database_sync_to_async(RoomUser.objects.get_room_user)(
+            room_pk=room.pk, user_pk=user2.pk
+        )
+        event = await communicator1.receive_json_from()
+        self.assertEqual(event["users"][0]["id"], room_user2.pk)
+
+        await database_sync_to_async(Message.objects.create)(
+            room_user=room_user2, body="Welcome"
+        )
+        event = await communicator1.receive_json_from()
+        self.assertEqual(event["messages"][0]["body"], "Welcome")
+
+        await communicator1.disconnect()
+
+    async def test_leave_room_while_connected(self):
+        """
+        When a user leaves a room while connected, the consumer unsubscribes from it.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, _ = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        room_user1 = await database_sync_to_async(RoomUser.objects.get_room_user)(
+            room_pk=room.pk, user_pk=user1.pk
+        )
+        room_user2 = await database_sync_to_async(RoomUser.objects.get_room_user)(
+            room_pk=room.pk, user_pk=user2.pk
+        )
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        # user1 connected
+        await communicator1.receive_json_from()
+
+        room_user1.is_active = False
+        await database_sync_to_async(room_user1.save)()
+        event = await communicator1.receive_json_from()
+        self.assertFalse(event["users"][0]["is_active"])
+        # Let the consumer process the membership event and unsubscribe from the room
+        self.assertTrue(await communicator1.receive_nothing())
+        await database_sync_to_async(Message.objects.create)(
+            room_user=room_user2, body="Bye"
+        )
+        self.assertTrue(await communicator1.receive_nothing())
+
+        await communicator1.disconnect()
+
+    async def test_connect_query_count_does_not_depend_on_rooms(self):
+        """
+        RoomUser objects are provisioned in bulk, so connecting costs the same number of queries
+        whether the user is part of a few rooms or many.
+        """
+        query_counts = []
+        for room_count in (1, 10):
+            user, token = await self.async_create_user()
+            for _ in range(room_count):
+                await self.async_create_room_and_add_users(user)
+
+            # The first connection creates the RoomUser objects, the second one finds them.
+            for _ in range(2):
+                communicator = WebsocketCommunicator(
+                    application, f"ws/chat/?token={token}"
+                )
+                async with self.async_capture_queries() as context:
+                    await communicator.connect()
+                query_counts.append(len(context))
+                await communicator.disconnect()
+
+            self.assertEqual(
+                await database_sync_to_async(user.roomuser_set.count)(), room_count
+            )
+
+        self.assertEqual(query_counts[0], query_counts[2])
+        self.assertEqual(query_counts[1], query_counts[3])
+
+    @override_settings(
+        DF_CHAT={
+            **settings.DF_CHAT,
+            "OUTBOUND_BUFFER_WINDOW": 10000,
+            "OUTBOUND_BUFFER_MAX_EVENTS": 3,
+        }
+    )
+    async def test_outbound_buffer(self):
+        """
+        With the outbound buffer enabled, events are coalesced into a single frame.
+        """
+        user, token = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user)
+        communicator = WebsocketCommunicator(application, f"ws/chat/?token={token}")
+        await communicator.connect()
+        room_user = await database_sync_to_async(RoomUser.objects.get)(
+            room=room, user=user
+        )
+
+        for body in ("one", "two"):
+            await database_sync_to_async(Message.objects.create)(
+                room_user=room_user, body=body
+            )
+        self.assertTrue(await communicator.receive_nothing())
+
+        await database_sync_to_async(Message.objects.create)(
+            room_user=room_user, body="three"
+        )
+        event = await communicator.receive_json_from()
+        self.assertEqual(
+            [message["body"] for message in event["messages"]], ["one", "two", "three"]
+        )
+        self.assertTrue(all(message["is_me"] for message in event["messages"]))
+
+        await communicator.disconnect()
+
+    async def test_send_message(self):
+        """
+        A message sent through the websocket is acknowledged with its id,
+        and sending it again with the same client_id doesn't create it twice.
+        """
+        user, token = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user)
+        communicator = WebsocketCommunicator(application, f"ws/chat/?token={token}")
+        await communicator.connect()
+
+        await communicator.send_json_to(
+            {"room_id": str(room.pk), "body": "Hi", "client_id": "1", "request_id": 7}
+        )
+        replies = [await communicator.receive_json_from() for _ in range(2)]
+        ack = next(reply for reply in replies if "action" in reply)
+        event = next(reply for reply in replies if "messages" in reply)
+        self.assertEqual(ack["action"], "create_message")
+        self.assertEqual(ack["response_status"], 201)
+        self.assertEqual(ack["request_id"], 7)
+        self.assertEqual(ack["data"]["client_id"], "1")
+        self.assertEqual(ack["data"]["id"], event["messages"][0]["id"])
+
+        # Retrying after a network failure
+        await communicator.send_json_to(
+            {"room_id": str(room.pk), "body": "Hi", "client_id": "1", "request_id": 8}
+        )
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack["request_id"], 8)
+        self.assertEqual(ack["data"]["id"], event["messages"][0]["id"])
+        self.assertEqual(
+            await database_sync_to_async(
+                Message.objects.filter(room_user__room=room).count
+            )(),
+            1,
+        )
+
+        await communicator.disconnect()
+
+    async def test_send_message_to_inaccessible_room(self):
+        """
+        Sending a message to a room the user has no access to replies with an error.
+        """
+        user, token = await self.async_create_user()
+        room = await database_sync_to_async(RoomFactory)(is_public=False)
+        communicator = WebsocketCommunicator(application, f"ws/chat/?token={token}")
+        await communicator.connect()
+
+        await communicator.send_json_to({"room_id": str(room.pk), "body": "Hi"})
+        reply = await communicator.receive_json_from()
+        self.assertEqual(reply["response_status"], 403)
+        self.assertEqual(reply["errors"], ["user doesn't have access to room"])
+
+        await communicator.disconnect()
+
+    async def test_send_message_uses_membership_cache(self):
+        """
+        The consumer caches the RoomUser of the user in each room,
+        so that sending a message only inserts it, and it is invalidated when the RoomUser is deactivated.
+        """
+        user, token = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user)
+        communicator = WebsocketCommunicator(application, f"ws/chat/?token={token}")
+        await communicator.connect()
+        room_user = await database_sync_to_async(RoomUser.objects.get)(
+            room=room, user=user
+        )
+
+        async with self.async_capture_queries() as context:
+            await communicator.send_json_to({"room_id": str(room.pk), "body": "Hi"})
+            ack = await communicator.receive_json_from()
+        await communicator.receive_json_from()
+        self.assertEqual(ack["response_status"], 201)
+        queries = [query["sql"] for query in context.captured_queries]
+        # The room and its users aren't read
+        self.assertFalse(
+            [
+                query
+                for query in queries
+                if query.startswith("SELECT") and "df_chat_room" in query
+            ]
+        )
+        # The message is inserted, then its room and the watermark of the sender are updated by primary key.
+        # The other members of the room aren't written to.
+        writes = [
+            query.split(" WHERE ")[-1]
+            for query in queries
+            if query.startswith(("INSERT", "UPDATE", "DELETE"))
+        ]
+        self.assertEqual(len(writes), 3)
+        self.assertTrue(writes[0].startswith('INSERT INTO "df_chat_message" '))
+        self.assertEqual(
+            writes[1:],
+            [
+                f'"df_chat_room"."id" = {int(room.pk)}',
+                f'"df_chat_roomuser"."id" = {int(room_user.pk)}',
+            ],
+        )
+
+        room_user.is_active = False
+        await database_sync_to_async(room_user.save)()
+        event = await communicator.receive_json_from()
+        self.assertTrue(event["users"][0]["is_me"])
+        self.assertFalse(event["users"][0]["is_active"])
+
+        await communicator.send_json_to({"room_id": str(room.pk), "body": "Back"})
+        replies = [await communicator.receive_json_from() for _ in range(3)]
+        ack = next(reply for reply in replies if "action" in reply)
+        message = await database_sync_to_async(Message.objects.get)(
+            pk=ack["data"]["id"]
+        )
+        self.assertNotEqual(message.room_user_id, room_user.pk)
+
+        await communicator.disconnect()
+
+    async def test_presence_counts_connections(self):
+        """
+        A user with two connections stays online until both are closed,
+        and only the transitions are sent to the other members of the rooms.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, token2 = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        tab1 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await tab1.connect()
+        room_user2 = await database_sync_to_async(RoomUser.objects.get)(
+            room=room, user=user2
+        )
+        event = await communicator1.receive_json_from()
+        self.assertEqual(event["users"][0]["id"], room_user2.pk)
+
+        tab2 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await tab2.connect()
+        await tab1.disconnect()
+        self.assertTrue(await communicator1.receive_nothing())
+        user_chat2 = await database_sync_to_async(UserChat.objects.get)(user=user2)
+        self.assertTrue(user_chat2.is_online)
+
+        await tab2.disconnect()
+        event = await communicator1.receive_json_from()
+        self.assertEqual(
+            event["users"][0],
+            {
+                "id": room_user2.pk,
+                "is_me": False,
+                "is_online": False,
+                "is_active": True,
+                "room_id": room.pk,
+            },
+        )
+        await database_sync_to_async(user_chat2.refresh_from_db)()
+        self.assertFalse(user_chat2.is_online)
+
+        tab3 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await tab3.connect()
+        event = await communicator1.receive_json_from()
+        self.assertTrue(event["users"][0]["is_online"])
+
+        await tab3.disconnect()
+        await communicator1.disconnect()
+
+    async def test_ephemeral_events(self):
+        """
+        Ephemeral events are sent to the other members of the room without querying the database, and rate limited.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, token2 = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        other_room = await database_sync_to_async(RoomFactory)(is_public=False)
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        communicator2 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await communicator2.connect()
+        # user2 connected
+        await communicator1.receive_json_from()
+        room_user1 = await database_sync_to_async(RoomUser.objects.get)(
+            room=room, user=user1
+        )
+
+        typing = {"action": "send_event", "room_id": str(room.pk), "event": "typing"}
+        async with self.async_capture_queries() as context:
+            await communicator1.send_json_to(typing)
+            event = await communicator2.receive_json_from()
+        self.assertFalse(context.captured_queries)
+        self.assertEqual(event["messages"], [])
+        self.assertEqual(event["users"], [])
+        self.assertEqual(len(event["events"]), 1)
+        self.assertAlmostEqual(event["events"][0].pop("expires_in"), 5, delta=1)
+        self.assertEqual(
+            event["events"][0],
+            {"room_id": room.pk, "room_user_id": room_user1.pk, "event": "typing"},
+        )
+        # The event isn't sent back to the user
+        self.assertTrue(await communicator1.receive_nothing())
+
+        # Sent too often
+        await communicator1.send_json_to(typing)
+        self.assertTrue(await communicator2.receive_nothing())
+
+        await communicator1.send_json_to({**typing, "event": "dancing"})
+        reply = await communicator1.receive_json_from()
+        self.assertEqual(reply["response_status"], 400)
+        await communicator1.send_json_to({**typing, "room_id": str(other_room.pk)})
+        reply = await communicator1.receive_json_from()
+        self.assertEqual(reply["response_status"], 403)
+
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+
+    @override_settings(DF_CHAT={**settings.DF_CHAT, "DELIVERY_MODE": DeliveryMode.USER})
+    async def test_ephemeral_events_user_delivery_mode(self):
+        """
+        In the user delivery mode, the ephemeral events are sent to the clients watching the room.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, token2 = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        communicator2 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await communicator2.connect()
+        await communicator1.receive_json_from()
+
+        await communicator2.send_json_to(
+            {"action": "watch_room", "room_id": str(room.pk)}
+        )
+        self.assertTrue(await communicator2.receive_nothing())
+        await communicator1.send_json_to(
+            {"action": "send_event", "room_id": str(room.pk), "event": "recording"}
+        )
+        event = await communicator2.receive_json_from()
+        self.assertEqual(event["events"][0]["event"], "recording")
+
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+
+    @override_settings(
+        DF_CHAT={
+            **settings.DF_CHAT,
+            "DELIVERY_MODE": DeliveryMode.USER,
+            "EPHEMERAL_EVENT_INTERVAL": 0,
+        }
+    )
+    async def test_unwatch_room(self):
+        """
+        A room stops being watched when the client unwatches it, or when the user leaves it.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, token2 = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        communicator2 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await communicator2.connect()
+        await communicator1.receive_json_from()
+        watch = {"action": "watch_room", "room_id": str(room.pk)}
+        typing = {"action": "send_event", "room_id": str(room.pk), "event": "typing"}
+
+        await communicator2.send_json_to(watch)
+        await communicator2.send_json_to({**watch, "action": "unwatch_room"})
+        self.assertTrue(await communicator2.receive_nothing())
+        await communicator1.send_json_to(typing)
+        self.assertTrue(await communicator2.receive_nothing())
+
+        await communicator2.send_json_to(watch)
+        self.assertTrue(await communicator2.receive_nothing())
+        await database_sync_to_async(room.users.remove)(user2)
+        self.assertTrue(await communicator2.receive_nothing())
+        await communicator1.send_json_to(typing)
+        self.assertTrue(await communicator2.receive_nothing())
+        # The user isn't a member of the room anymore
+        await communicator2.send_json_to(watch)
+        reply = await communicator2.receive_json_from()
+        self.assertEqual(reply["response_status"], 403)
+
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+
+    @override_settings(DF_CHAT={**settings.DF_CHAT, "RECEIPT_WRITE_INTERVAL": 500})
+    async def test_delivery_receipts(self):
+        """
+        The deliveries of messages are written in bulk, and their receipts are coalesced in a single event to the sender.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, token2 = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        communicator2 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await communicator2.connect()
+        await communicator1.receive_json_from()
+        room_user1 = await database_sync_to_async(RoomUser.objects.get)(
+            room=room, user=user1
+        )
+
+        messages = [
+            await database_sync_to_async(Message.objects.create)(
+                room_user=room_user1, body=body
+            )
+            for body in ("Hi", "How are you?")
+        ]
+        for _ in messages:
+            await communicator1.receive_json_from()
+            await communicator2.receive_json_from()
+
+        event = await communicator1.receive_json_from(timeout=1)
+        self.assertEqual(
+            event["events"],
+            [
+                {
+                    "room_id": str(room.pk),
+                    "message_id": str(message.pk),
+                    "event": "received",
+                    "user_ids": [str(user2.pk)],
+                }
+                for message in messages
+            ],
+        )
+        # The receipts aren't sent to the recipient
+        self.assertTrue(await communicator2.receive_nothing())
+        received_by = await database_sync_to_async(
+            lambda: set(
+                Message.received_by.through.objects.values_list("message_id", "user_id")
+            )
+        )()
+        self.assertEqual(received_by, {(message.pk, user2.pk) for message in messages})
+
+        # The edited messages were received already
+        message = await database_sync_to_async(Message.objects.get)(pk=messages[0].pk)
+        message.body = "Hello"
+        await database_sync_to_async(message.save)()
+        await communicator1.receive_json_from()
+        await communicator2.receive_json_from()
+        self.assertTrue(await communicator1.receive_nothing(timeout=1))
+
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+
+    async def test_reaction_events(self):
+        """
+        A reaction is sent as a small event holding its counter, instead of the message it reacts to.
+        """
+        user1, token1 = await self.async_create_user()
+        user2, token2 = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+        communicator2 = WebsocketCommunicator(application, f"ws/chat/?token={token2}")
+        await communicator2.connect()
+        await communicator1.receive_json_from()
+
+        await communicator1.send_json_to({"room_id": str(room.pk), "body": "Hi"})
+        message_id = (await communicator1.receive_json_from())["data"]["id"]
+        await communicator1.receive_json_from()
+        await communicator2.receive_json_from()
+        # The receipt of the message
+        await communicator1.receive_json_from()
+
+        await communicator2.send_json_to(
+            {
+                "room_id": str(room.pk),
+                "body": "+1",
+                "parent_id": message_id,
+                "is_reaction": True,
+            }
+        )
+        await communicator2.receive_json_from()
+        event1 = await communicator1.receive_json_from()
+        event2 = await communicator2.receive_json_from()
+        self.assertEqual(event1["messages"], [])
+        room_user2 = await database_sync_to_async(RoomUser.objects.get)(
+            room=room, user=user2
+        )
+        reaction_event = {
+            "room_id": str(room.pk),
+            "message_id": message_id,
+            "room_user_id": str(room_user2.pk),
+            "event": "reaction_added",
+            "reaction": "+1",
+            "count": 1,
+        }
+        self.assertEqual(event1["events"], [{**reaction_event, "is_me": False}])
+        self.assertEqual(event2["events"], [{**reaction_event, "is_me": True}])
+        # The reaction isn't added again when it is saved
+        await database_sync_to_async(
+            lambda: Message.objects.get(is_reaction=True).save()
+        )()
+        self.assertTrue(await communicator1.receive_nothing())
+
+        await database_sync_to_async(
+            lambda: Message.objects.get(is_reaction=True).delete()
+        )()
+        event1 = await communicator1.receive_json_from()
+        self.assertEqual(
+            event1["events"],
+            [
+                {
+                    **reaction_event,
+                    "event": "reaction_removed",
+                    "count": 0,
+                    "is_me": False,
+                }
+            ],
+        )
+
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+
 
 # TODO: Trying to connect without providing a token results in an error
 #  "ValueError: 'AnonymousUser' value must be a positive integer or a valid Hashids string."
@@ -0,0 +1,93 @@
+from df_chat.asgi.frames import encode_message
+from df_chat.asgi.frames import FrameBuffer
+from df_chat.asgi.frames import join_frame
+from df_chat.asgi.frames import resolve_is_me
+from unittest import IsolatedAsyncioTestCase
+from unittest import TestCase
+
+import asyncio
+import json
+
+
+class TestFrames(TestCase):
+    """
+    Testing the messages encoded once and shared by all the recipients
+    """
+
+    def test_resolve_is_me(self):
+        message = {"id": "M", "body": "Hi", "is_me": 1}
+        system_message = {"id": "S", "body": "Welcome", "is_me": None}
+        encoded_message, marker = encode_message(message)
+        encoded_system_message, system_marker = encode_message(system_message)
+
+        frame_of_user1 = json.loads(
+            join_frame(
+                messages=[
+                    resolve_is_me(encoded_message, marker, 1),
+                    resolve_is_me(encoded_system_message, system_marker, 1),
+                ]
+            )
+        )
+        self.assertTrue(frame_of_user1["messages"][0]["is_me"])
+        self.assertFalse(frame_of_user1["messages"][1]["is_me"])
+        self.assertEqual(frame_of_user1["users"], [])
+
+        frame_with_events = json.loads(join_frame(events=['{"event": "typing"}']))
+        self.assertEqual(frame_with_events["events"], [{"event": "typing"}])
+
+        message_of_user2 = json.loads(resolve_is_me(encoded_message, marker, 2))
+        self.assertFalse(message_of_user2["is_me"])
+
+        message_of_user11 = json.loads(resolve_is_me(encoded_message, marker, 11))
+        self.assertFalse(message_of_user11["is_me"])
+
+    def test_body_cannot_fake_is_me(self):
+        _, previous_marker = encode_message({"is_me": 1})
+        message = {"body": f"{previous_marker}1", "is_me": 2}
+        encoded_message, marker = encode_message(message)
+
+        self.assertNotEqual(marker, previous_marker)
+        resolved = json.loads(resolve_is_me(encoded_message, marker, 1))
+        self.assertEqual(resolved["body"], f"{previous_marker}1")
+
+
+class TestFrameBuffer(IsolatedAsyncioTestCase):
+    """
+    Testing the coalescing of outbound events
+    """
+
+    async def asyncSetUp(self):
+        self.frames = []
+
+    async def send(self, frame):
+        self.frames.append(json.loads(frame))
+
+    async def test_flush_after_window(self):
+        buffer = FrameBuffer(self.send, window=0.05, max_events=10)
+        await buffer.add(messages=['{"id": 1}'])
+        await buffer.add(users=['{"id": 2}'])
+        await buffer.add(messages=['{"id": 3}'])
+        self.assertEqual(self.frames, [])
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(
+            self.frames, [{"messages": [{"id": 1}, {"id": 3}], "users": [{"id": 2}]}]
+        )
+        self.assertEqual(buffer.event_count, 3)
+        self.assertEqual(buffer.frame_count, 1)
+        self.assertEqual(buffer.frames_saved, 2)
+        self.assertGreaterEqual(buffer.max_latency, 0.05)
+        self.assertGreater(buffer.average_latency, 0)
+
+    async def test_flush_when_full(self):
+        buffer = FrameBuffer(self.send, window=10, max_events=2)
+        await buffer.add(messages=['{"id": 1}'])
+        await buffer.add(messages=['{"id": 2}'])
+        self.assertEqual(
+            self.frames, [{"messages": [{"id": 1}, {"id": 2}], "users": []}]
+        )
+        self.assertIsNone(buffer.flush_task)
+
+        await buffer.add(messages=['{"id": 3}'])
+        buffer.close()
+        self.assertEqual(len(self.frames), 1)
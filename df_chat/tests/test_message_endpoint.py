@@ -1,4 +1,9 @@
+from df_chat.models import Message
+from df_chat.models import Room
+from df_chat.models import RoomUser
 from df_chat.tests.base import BaseTestUtilsMixin
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
@@ -27,6 +32,307 @@ class TestMessageEndpoint(APITestCase, BaseTestUtilsMixin):
         self.assertIsNone(message["parent_id"])
         self.assertFalse(message["is_reaction"])
 
+    def test_message_cursor_pagination(self):
+        """
+        Testing the pagination of the messages anchored before, after and around a message.
+        """
+        user, token = self.create_user()
+        room = self.create_room_and_add_users(user)
+        room_user = RoomUser.objects.get_room_user(room_pk=room.pk, user_pk=user.pk)
+        # Some messages are created at the same time, the pagination doesn't skip nor repeat them.
+        messages = [
+            Message.objects.create(room_user=room_user, body=str(i)) for i in range(7)
+        ]
+        Message.objects.filter(pk__in=[m.pk for m in messages[2:5]]).update(
+            created=messages[2].created
+        )
+        ids = [str(message.pk) for message in messages][::-1]
+
+        message_endpoint = reverse("rooms-messages-list", kwargs={"room_pk": room.pk})
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+
+        page = self.client.get(message_endpoint, {"page_size": 3}).json()
+        self.assertEqual([m["id"] for m in page["results"]], ids[:3])
+        self.assertIsNone(page["previous"])
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([m["id"] for m in page["results"]], ids[3:6])
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([m["id"] for m in page["results"]], ids[6:])
+        self.assertIsNone(page["next"])
+        page = self.client.get(page["previous"]).json()
+        self.assertEqual([m["id"] for m in page["results"]], ids[3:6])
+
+        page = self.client.get(
+            message_endpoint, {"page_size": 3, "around": ids[3]}
+        ).json()
+        self.assertEqual([m["id"] for m in page["results"]], ids[2:5])
+        self.assertIsNotNone(page["next"])
+        self.assertIsNotNone(page["previous"])
+
+        response = self.client.get(message_endpoint, {"before": "unknown"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_read_watermark(self):
+        """
+        Testing that reading a message reads the messages before it, and that the unread counters are maintained.
+        """
+        user, token = self.create_user()
+        sender, _ = self.create_user()
+        room = self.create_room_and_add_users(user, sender)
+        RoomUser.objects.get_room_user(room_pk=room.pk, user_pk=user.pk)
+        sender_room_user = RoomUser.objects.get_room_user(
+            room_pk=room.pk, user_pk=sender.pk
+        )
+        messages = [
+            Message.objects.create(room_user=sender_room_user, body=str(i))
+            for i in range(3)
+        ]
+        Message.objects.create(
+            room_user=sender_room_user, parent=messages[0], is_reaction=True, body="+"
+        )
+
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        rooms_endpoint = reverse("rooms-list")
+        [room_data] = self.client.get(rooms_endpoint).json()
+        self.assertEqual(room_data["message_total_count"], 3)
+        self.assertEqual(room_data["message_new_count"], 3)
+
+        read_endpoint = reverse("rooms-messages-read", kwargs={"room_pk": room.pk})
+        response = self.client.post(read_endpoint, {"message_id": str(messages[1].pk)})
+        self.assertEqual(response.json()["unread_count"], 1)
+        # The watermark never moves back
+        response = self.client.post(read_endpoint, {"message_id": str(messages[0].pk)})
+        self.assertEqual(response.json()["unread_count"], 1)
+        response = self.client.post(read_endpoint, {"message_id": "unknown"})
+        self.assertEqual(response.status_code, 400)
+
+        message_endpoint = reverse("rooms-messages-list", kwargs={"room_pk": room.pk})
+        page = self.client.get(message_endpoint).json()
+        self.assertEqual(
+            [m["is_seen_by_me"] for m in page["results"]], [False, True, True]
+        )
+
+        Message.objects.create(room_user=sender_room_user, body="3")
+        [room_data] = self.client.get(rooms_endpoint).json()
+        self.assertEqual(room_data["message_new_count"], 2)
+        messages[2].delete()
+        [room_data] = self.client.get(rooms_endpoint).json()
+        self.assertEqual(room_data["message_total_count"], 3)
+        self.assertEqual(room_data["message_new_count"], 1)
+        # Sending a message reads the room
+        self.client.post(message_endpoint, {"body": "Hi"})
+        [room_data] = self.client.get(rooms_endpoint).json()
+        self.assertEqual(room_data["message_new_count"], 0)
+        self.assertEqual(room_data["message_total_count"], 4)
+
+        # Reading a public room doesn't join it
+        public_room = self.create_room_and_add_users(sender)
+        Room.objects.filter(pk=public_room.pk).update(is_public=True)
+        message = Message.objects.create(
+            room_user=RoomUser.objects.get_room_user(
+                room_pk=public_room.pk, user_pk=sender.pk
+            ),
+            body="Hi",
+        )
+        response = self.client.post(
+            reverse("rooms-messages-read", kwargs={"room_pk": public_room.pk}),
+            {"message_id": str(message.pk)},
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(RoomUser.objects.filter(room=public_room, user=user).exists())
+        self.assertFalse(public_room.users.filter(pk=user.pk).exists())
+
+    def test_message_update(self):
+        """
+        Testing that a message can't become a reaction nor move to another parent, which would unbalance the counters.
+        """
+        user, token = self.create_user()
+        room = self.create_room_and_add_users(user)
+        room_user = RoomUser.objects.get_room_user(room_pk=room.pk, user_pk=user.pk)
+        parent, message = [
+            Message.objects.create(room_user=room_user, body=body)
+            for body in ("Hi", "Hello")
+        ]
+
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        message_endpoint = reverse(
+            "rooms-messages-detail", kwargs={"room_pk": room.pk, "pk": message.pk}
+        )
+        response = self.client.patch(
+            message_endpoint,
+            {"body": "Edited", "is_reaction": True, "parent_id": str(parent.pk)},
+        )
+        self.assertEqual(response.status_code, 200)
+        message.refresh_from_db()
+        self.assertEqual(message.body, "Edited")
+        self.assertFalse(message.is_reaction)
+        self.assertIsNone(message.parent_id)
+
+        self.client.delete(message_endpoint)
+        room.refresh_from_db()
+        self.assertEqual(room.message_count, 1)
+
+    def test_seen(self):
+        """
+        Testing that the messages are marked as seen in a number of queries which doesn't depend on their number,
+        or up to a message of the room.
+        """
+        user, token = self.create_user()
+        sender, _ = self.create_user()
+        room = self.create_room_and_add_users(user, sender)
+        RoomUser.objects.get_room_user(room_pk=room.pk, user_pk=user.pk)
+        sender_room_user = RoomUser.objects.get_room_user(
+            room_pk=room.pk, user_pk=sender.pk
+        )
+        messages = [
+            Message.objects.create(room_user=sender_room_user, body=str(i))
+            for i in range(12)
+        ]
+
+        seen_endpoint = reverse("rooms-messages-seen", kwargs={"room_pk": room.pk})
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        query_counts = []
+        for seen_messages in (messages[:2], messages[2:10]):
+            message_ids = [str(message.pk) for message in seen_messages]
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(
+                    seen_endpoint, {"message_ids": message_ids}, format="json"
+                )
+            self.assertEqual(
+                sorted(response.json()["message_ids"]), sorted(message_ids)
+            )
+            query_counts.append(len(context))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(user.message_seen_set.count(), 10)
+        # Marking messages as seen twice doesn't fail
+        response = self.client.post(
+            seen_endpoint, {"message_ids": [str(messages[0].pk)]}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(
+            seen_endpoint, {"up_to_message_id": str(messages[-1].pk)}, format="json"
+        )
+        self.assertEqual(response.json()["up_to_message_id"], str(messages[-1].pk))
+        self.assertEqual(response.json()["unread_count"], 0)
+        [room_data] = self.client.get(reverse("rooms-list")).json()
+        self.assertEqual(room_data["message_new_count"], 0)
+        response = self.client.post(seen_endpoint, {}, format="json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            seen_endpoint, {"up_to_message_id": "unknown"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Reading a public room doesn't join it
+        Room.objects.filter(pk=room.pk).update(is_public=True)
+        room.users.remove(user)
+        RoomUser.objects.filter(room=room, user=user).update(is_active=False)
+        response = self.client.post(
+            seen_endpoint, {"up_to_message_id": str(messages[-1].pk)}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(
+            RoomUser.objects.filter(room=room, user=user, is_active=True).exists()
+        )
+        self.assertFalse(room.users.filter(pk=user.pk).exists())
+
+    def test_reaction_counts(self):
+        """
+        Testing that the reactions of a message are listed as counters, with the reactions of the user.
+        """
+        user, token = self.create_user()
+        other_user, _ = self.create_user()
+        room = self.create_room_and_add_users(user, other_user)
+        message_endpoint = reverse("rooms-messages-list", kwargs={"room_pk": room.pk})
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        message = self.client.post(message_endpoint, {"body": "Hi"}).json()
+        reaction = self.client.post(
+            message_endpoint,
+            {"body": "+1", "parent_id": message["id"], "is_reaction": True},
+        ).json()
+        other_room_user = RoomUser.objects.get_room_user(
+            room_pk=room.pk, user_pk=other_user.pk
+        )
+        reactions = [
+            Message.objects.create(
+                room_user=other_room_user,
+                parent_id=message["id"],
+                is_reaction=True,
+                body=body,
+            )
+            for body in ("+1", "<3")
+        ]
+
+        [message] = self.client.get(message_endpoint).json()["results"]
+        self.assertEqual(message["reaction_counts"], {"+1": 2, "<3": 1})
+        self.assertEqual(message["my_reactions"], ["+1"])
+
+        reactions[1].delete()
+        [message] = self.client.get(message_endpoint).json()["results"]
+        self.assertEqual(message["reaction_counts"], {"+1": 2})
+
+        # The reactions can't be changed, they are removed and added again
+        reaction_endpoint = reverse(
+            "rooms-messages-detail", kwargs={"room_pk": room.pk, "pk": reaction["id"]}
+        )
+        response = self.client.patch(reaction_endpoint, {"body": "-1"})
+        self.assertEqual(response.json()["body"], "+1")
+        self.client.delete(reaction_endpoint)
+        [message] = self.client.get(message_endpoint).json()["results"]
+        self.assertEqual(message["reaction_counts"], {"+1": 1})
+        self.assertEqual(message["my_reactions"], [])
+
+        response = self.client.post(
+            message_endpoint,
+            {"body": "+" * 65, "parent_id": message["id"], "is_reaction": True},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_replies(self):
+        """
+        Testing that the messages are listed with their number of replies, which are loaded on demand.
+        """
+        user, token = self.create_user()
+        room = self.create_room_and_add_users(user)
+        room_user = RoomUser.objects.get_room_user(room_pk=room.pk, user_pk=user.pk)
+        message = Message.objects.create(room_user=room_user, body="Hi")
+        replies = [
+            Message.objects.create(room_user=room_user, parent=message, body=str(i))
+            for i in range(3)
+        ]
+        Message.objects.create(
+            room_user=room_user, parent=message, is_reaction=True, body="+1"
+        )
+
+        message_endpoint = reverse("rooms-messages-list", kwargs={"room_pk": room.pk})
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        with CaptureQueriesContext(connection) as context:
+            results = self.client.get(message_endpoint).json()["results"]
+        reply_counts = {m["id"]: m["reply_count"] for m in results}
+        self.assertEqual(reply_counts[str(message.pk)], 3)
+        self.assertEqual(reply_counts[str(replies[0].pk)], 0)
+
+        # The replies of the replies are not loaded, whatever the depth of the thread
+        parent = replies[0]
+        for i in range(3):
+            parent = Message.objects.create(
+                room_user=room_user, parent=parent, body=f"Reply {i}"
+            )
+        with self.assertNumQueries(len(context)):
+            self.client.get(message_endpoint)
+
+        replies_endpoint = reverse(
+            "rooms-messages-replies", kwargs={"room_pk": room.pk, "pk": message.pk}
+        )
+        page = self.client.get(replies_endpoint, {"page_size": 2}).json()
+        self.assertEqual(
+            [m["id"] for m in page["results"]], [str(m.pk) for m in replies[:0:-1]]
+        )
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([m["id"] for m in page["results"]], [str(replies[0].pk)])
+        self.assertEqual(page["results"][0]["reply_count"], 1)
+
     # TODOS: We should also implement the following tests:
     # - Fail to create a message when the user is not authenticated.
     # - Ensure that the endpoint returns a 404 error
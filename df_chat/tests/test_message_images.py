@@ -0,0 +1,286 @@
+from datetime import timedelta
+from df_chat.models import Message
+from df_chat.models import MessageImage
+from df_chat.models import MessageImageUpload
+from df_chat.models import RoomUser
+from df_chat.tasks import expire_uploads_task
+from df_chat.tasks import process_image_task
+from df_chat.tests.base import BaseTestUtilsMixin
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+from unittest import mock
+
+import io
+import tempfile
+
+
+def create_image_file(name="image.png", format="PNG", size=(4, 3), color="black"):
+    file = io.BytesIO()
+    Image.new("RGB", size, color).save(file, format)
+    return SimpleUploadedFile(name, file.getvalue())
+
+
+class TestMessageImages(APITestCase, BaseTestUtilsMixin):
+    """
+    Testing the upload and the serialization of the images of the messages
+    """
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user, token = self.create_user()
+        self.room = self.create_room_and_add_users(self.user)
+        self.room_user = RoomUser.objects.get_room_user(
+            room_pk=self.room.pk, user_pk=self.user.pk
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+
+    def test_upload_metadata(self):
+        """
+        Testing that the size and the content type of the images are saved at upload.
+        """
+        file = create_image_file(name="image.jpg")
+        response = self.client.post(
+            reverse("images-list"),
+            {"room_id": str(self.room.pk), "image": file},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        image = response.json()
+        self.assertEqual(image["size"], file.size)
+        # The content type is read from the image, not from its name
+        self.assertEqual(image["content_type"], "image/png")
+        self.assertEqual((image["width"], image["height"]), (4, 3))
+
+    def test_message_list_storage_calls(self):
+        """
+        Testing that the images of the listed messages are serialized without requests to the storage.
+        """
+        message = Message.objects.create(room_user=self.room_user, body="Hi")
+        for _ in range(50):
+            MessageImage.objects.create(message=message, image=create_image_file())
+
+        with mock.patch.object(FileSystemStorage, "size") as size, mock.patch.object(
+            FileSystemStorage, "exists"
+        ) as exists:
+            response = self.client.get(
+                reverse("rooms-messages-list", kwargs={"room_pk": self.room.pk})
+            )
+        images = response.json()["results"][0]["images"]
+        self.assertEqual(len(images), 50)
+        self.assertTrue(all(image["size"] > 0 for image in images))
+        size.assert_not_called()
+        exists.assert_not_called()
+
+    def test_backfill_command(self):
+        """
+        Testing the backfill of the images uploaded before their metadata was saved.
+        """
+        message = Message.objects.create(room_user=self.room_user, body="Hi")
+        image = MessageImage.objects.create(message=message, image=create_image_file())
+        missing_image = MessageImage.objects.create(
+            message=message, image=create_image_file()
+        )
+        missing_image.image.storage.delete(missing_image.image.name)
+        size = image.size
+        MessageImage.objects.update(size=None, content_type="")
+
+        call_command("backfill_image_metadata", batch_size=1, stdout=io.StringIO())
+        image.refresh_from_db()
+        self.assertEqual((image.size, image.content_type), (size, "image/png"))
+        self.assertEqual(
+            MessageImage.objects.values_list("size", flat=True).get(
+                pk=missing_image.pk
+            ),
+            0,
+        )
+
+    def test_process_image(self):
+        """
+        Testing the generation of the variants and the placeholder of an uploaded image, after the upload.
+        """
+        message = Message.objects.create(room_user=self.room_user, body="Hi")
+        with mock.patch.object(
+            process_image_task, "delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            image = MessageImage.objects.create(
+                message=message,
+                image=create_image_file(size=(2000, 1000), color="red"),
+            )
+            delay.assert_not_called()
+        delay.assert_called_once_with(str(image.pk))
+
+        process_image_task(str(image.pk))
+        image.refresh_from_db()
+        self.assertEqual(image.placeholder, "#ff0000")
+        for variant, size in (("thumbnail", (320, 160)), ("preview", (1280, 640))):
+            with image.image.storage.open(image.variants[variant]) as file:
+                self.assertEqual(Image.open(file).size, size)
+
+        images_endpoint = reverse("images-detail", kwargs={"pk": image.pk})
+        variants = self.client.get(images_endpoint).json()["variants"]
+        self.assertTrue(variants["thumbnail"].endswith("_thumbnail.webp"))
+        self.assertTrue(variants["preview"].endswith("_preview.webp"))
+
+    def test_process_small_image(self):
+        """
+        Testing that the images smaller than a variant are served as they are.
+        """
+        message = Message.objects.create(room_user=self.room_user, body="Hi")
+        image = MessageImage.objects.create(
+            message=message, image=create_image_file(size=(640, 480))
+        )
+        process_image_task(str(image.pk))
+
+        image = self.client.get(
+            reverse("images-detail", kwargs={"pk": image.pk})
+        ).json()
+        self.assertTrue(image["variants"]["thumbnail"].endswith("_thumbnail.webp"))
+        self.assertEqual(image["variants"]["preview"], image["image"])
+        self.assertEqual(image["placeholder"], "#000000")
+
+    def test_chunked_upload(self):
+        """
+        Testing a resumable upload in chunks, attached to a new message of a room once complete.
+        """
+        content = create_image_file(size=(40, 30)).read()
+        response = self.client.post(
+            reverse("uploads-list"),
+            {"room_id": str(self.room.pk), "name": "image.png", "size": len(content)},
+        )
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()["id"]
+        upload_endpoint = reverse("uploads-detail", kwargs={"pk": upload_id})
+
+        def put_chunk(start, end):
+            return self.client.put(
+                upload_endpoint,
+                content[start:end],
+                content_type="application/octet-stream",
+                HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(content)}",
+            )
+
+        middle = len(content) // 2
+        self.assertEqual(put_chunk(0, middle).json()["offset"], middle)
+        # The chunk was received, so sending it again, e.g. after losing the response, conflicts
+        self.assertEqual(put_chunk(0, middle).status_code, 409)
+        self.assertEqual(self.client.get(upload_endpoint).json()["offset"], middle)
+        response = self.client.post(upload_endpoint + "finalize/")
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(put_chunk(middle, len(content)).status_code, 200)
+        with mock.patch.object(
+            process_image_task, "delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(upload_endpoint + "finalize/")
+        self.assertEqual(response.status_code, 201)
+        image = MessageImage.objects.get(pk=response.json()["id"])
+        self.assertEqual(image.message.room_id, self.room.pk)
+        self.assertEqual(
+            (image.width, image.height, image.size), (40, 30, len(content))
+        )
+        with image.image.open("rb") as file:
+            self.assertEqual(file.read(), content)
+
+        self.assertEqual(self.client.get(upload_endpoint).status_code, 404)
+        # The chunks are deleted with the upload
+        self.assertEqual(
+            image.image.storage.listdir(f"uploads/images/{upload_id}"), ([], [])
+        )
+
+    def test_chunked_upload_validation(self):
+        """
+        Testing that the chunks must match their Content-Range header, and the image is validated once complete.
+        """
+        message = Message.objects.create(room_user=self.room_user, body="Hi")
+        with override_settings(DF_CHAT={"IMAGE_UPLOAD_MAX_SIZE": 9}):
+            response = self.client.post(
+                reverse("uploads-list"),
+                {"message_id": str(message.pk), "name": "image.png", "size": 10},
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("size", response.json())
+        response = self.client.post(
+            reverse("uploads-list"),
+            {"message_id": str(message.pk), "name": "image.png", "size": 10},
+        )
+        upload_endpoint = reverse(
+            "uploads-detail", kwargs={"pk": response.json()["id"]}
+        )
+        for content_range, content in (
+            (None, b"0123456789"),
+            ("bytes 0-9/20", b"0123456789"),
+            ("bytes 0-4/10", b"0123456789"),
+        ):
+            kwargs = {"HTTP_CONTENT_RANGE": content_range} if content_range else {}
+            response = self.client.put(
+                upload_endpoint,
+                content,
+                content_type="application/octet-stream",
+                **kwargs,
+            )
+            self.assertEqual(response.status_code, 400)
+
+        self.client.put(
+            upload_endpoint,
+            b"0123456789",
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE="bytes 0-9/10",
+        )
+        response = self.client.post(upload_endpoint + "finalize/")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("image", str(response.json()))
+        self.assertFalse(MessageImage.objects.exists())
+
+    def test_expire_uploads(self):
+        """
+        Testing that the uploads which received no chunk for IMAGE_UPLOAD_TTL seconds are deleted with their chunks.
+        """
+        uploads = []
+        for i in range(2):
+            response = self.client.post(
+                reverse("uploads-list"),
+                {"room_id": str(self.room.pk), "name": "image.png", "size": 10},
+            )
+            upload_endpoint = reverse(
+                "uploads-detail", kwargs={"pk": response.json()["id"]}
+            )
+            self.client.put(
+                upload_endpoint,
+                b"01234",
+                content_type="application/octet-stream",
+                HTTP_CONTENT_RANGE="bytes 0-4/10",
+            )
+            uploads.append(MessageImageUpload.objects.get(pk=response.json()["id"]))
+        abandoned, active = uploads
+        MessageImageUpload.objects.filter(pk=abandoned.pk).update(
+            modified=timezone.now() - timedelta(days=2)
+        )
+        # Receiving a chunk renews the upload
+        MessageImageUpload.objects.filter(pk=active.pk).update(
+            modified=timezone.now() - timedelta(days=2)
+        )
+        self.client.put(
+            reverse("uploads-detail", kwargs={"pk": active.pk}),
+            b"56789",
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE="bytes 5-9/10",
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_uploads_task(), 1)
+        self.assertEqual(list(MessageImageUpload.objects.all()), [active])
+        storage = MessageImage._meta.get_field("image").storage
+        self.assertEqual(storage.listdir(f"uploads/images/{abandoned.pk}"), ([], []))
+        _, parts = storage.listdir(f"uploads/images/{active.pk}")
+        self.assertEqual(sorted(parts), ["0", "5"])
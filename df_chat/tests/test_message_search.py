@@ -0,0 +1,131 @@
+from base64 import b64encode
+from df_chat.models import Message
+from df_chat.models import RoomUser
+from df_chat.tests.base import BaseTestUtilsMixin
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+
+class TestMessageSearch(APITestCase, BaseTestUtilsMixin):
+    """
+    Testing the full-text search of the messages
+    """
+
+    def setUp(self):
+        self.user, token = self.create_user()
+        self.room = self.create_room_and_add_users(self.user)
+        self.room_user = RoomUser.objects.get_room_user(
+            room_pk=self.room.pk, user_pk=self.user.pk
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        self.search_endpoint = reverse(
+            "rooms-messages-search", kwargs={"room_pk": self.room.pk}
+        )
+
+    def create_messages(self, room_user, *bodies):
+        return [
+            Message.objects.create(room_user=room_user, body=body) for body in bodies
+        ]
+
+    def search(self, endpoint, query, **params):
+        response = self.client.get(endpoint, {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [message["body"] for message in response.json()["results"]]
+
+    def test_room_search(self):
+        """
+        Testing that the messages of a room are ranked, and that the index follows their changes.
+        """
+        hello, _, _, goodbye = self.create_messages(
+            self.room_user, "Hello", "Hello hello, world!", "Héllo there", "Goodbye"
+        )
+        Message.objects.create(
+            room_user=self.room_user, parent=hello, is_reaction=True, body="hello"
+        )
+
+        # The reactions aren't searched, and the diacritics are ignored
+        self.assertEqual(
+            sorted(self.search(self.search_endpoint, "hello")),
+            ["Hello", "Hello hello, world!", "Héllo there"],
+        )
+        self.assertEqual(
+            self.search(self.search_endpoint, "WORLD hello"), ["Hello hello, world!"]
+        )
+        # The syntax of the full-text queries isn't exposed
+        self.assertEqual(self.search(self.search_endpoint, '"hello" OR *'), [])
+
+        goodbye.body = "Goodbye world"
+        goodbye.save()
+        hello.delete()
+        self.assertEqual(
+            sorted(self.search(self.search_endpoint, "world")),
+            ["Goodbye world", "Hello hello, world!"],
+        )
+        self.assertEqual(
+            self.search(self.search_endpoint, "goodbye"), ["Goodbye world"]
+        )
+
+        response = self.client.get(self.search_endpoint, {"q": " "})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_across_rooms(self):
+        """
+        Testing that the search across rooms only returns the messages of the rooms the user can see.
+        """
+        other_user, _ = self.create_user()
+        other_room = self.create_room_and_add_users(self.user, other_user)
+        hidden_room = self.create_room_and_add_users(other_user)
+        hidden_room.is_public = False
+        hidden_room.save()
+        other_room_user = RoomUser.objects.get_room_user(
+            room_pk=other_room.pk, user_pk=other_user.pk
+        )
+        hidden_room_user = RoomUser.objects.get_room_user(
+            room_pk=hidden_room.pk, user_pk=other_user.pk
+        )
+        self.create_messages(self.room_user, "Lunch today?")
+        self.create_messages(other_room_user, "Lunch at noon")
+        self.create_messages(hidden_room_user, "Secret lunch")
+
+        response = self.client.get(reverse("search-list"), {"q": "lunch"})
+        results = response.json()["results"]
+        self.assertEqual(
+            {(message["room_id"], message["body"]) for message in results},
+            {
+                (str(self.room.pk), "Lunch today?"),
+                (str(other_room.pk), "Lunch at noon"),
+            },
+        )
+        # The messages of the user are read when they are sent
+        self.assertEqual(
+            {message["body"]: message["is_seen_by_me"] for message in results},
+            {"Lunch today?": True, "Lunch at noon": False},
+        )
+
+    def test_search_pagination(self):
+        """
+        Testing that the pages of the results follow each other, from the best match.
+        """
+        self.create_messages(
+            self.room_user, *(" ".join(["ping"] * count) for count in range(1, 6))
+        )
+        bodies = []
+        endpoint, params = self.search_endpoint, {"q": "ping", "page_size": 2}
+        while endpoint:
+            response = self.client.get(endpoint, params).json()
+            bodies += [message["body"] for message in response["results"]]
+            endpoint, params = response["next"], {}
+        self.assertEqual([body.count("ping") for body in bodies], [5, 4, 3, 2, 1])
+
+        message = Message.objects.first()
+        for cursor in (
+            "?",
+            *(
+                b64encode(value.encode(), altchars=b"-_").decode()
+                for value in ("0.5", "0.5:invalid", f"nan:{message.pk}")
+            ),
+        ):
+            response = self.client.get(
+                self.search_endpoint, {"q": "ping", "cursor": cursor}
+            )
+            self.assertEqual(response.status_code, 404)
@@ -0,0 +1,54 @@
+from df_chat.tests.utils import UserFactory
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from unittest import mock
+
+import importlib
+
+
+class TestMigrations(TransactionTestCase):
+    """
+    Testing the data migrations, from the state of the database before them
+    """
+
+    def tearDown(self):
+        call_command("migrate", "df_chat", verbosity=0)
+
+    def migrate(self, migration: str):
+        """
+        Migrates the chat to a migration, and returns the models of that state.
+        """
+        target = ("df_chat", migration)
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state(target).apps
+
+    def test_backfill_message_room(self):
+        apps = self.migrate("0006_message_room")
+        Room = apps.get_model("df_chat", "Room")
+        RoomUser = apps.get_model("df_chat", "RoomUser")
+        Message = apps.get_model("df_chat", "Message")
+        user = UserFactory()
+        rooms = [Room.objects.create(title=title, creator_id=user.pk) for title in "AB"]
+        messages = [
+            Message.objects.create(
+                room_user=RoomUser.objects.create(room=room, user_id=user.pk),
+                body=str(i),
+            )
+            for room in rooms
+            for i in range(3)
+        ]
+        self.assertFalse(Message.objects.filter(room__isnull=False).exists())
+
+        migration = importlib.import_module(
+            "df_chat.migrations.0007_backfill_message_room"
+        )
+        with mock.patch.object(migration, "BATCH_SIZE", 2):
+            apps = self.migrate("0007_backfill_message_room")
+        Message = apps.get_model("df_chat", "Message")
+        self.assertEqual(
+            dict(Message.objects.values_list("pk", "room_id")),
+            {message.pk: message.room_user.room_id for message in messages},
+        )
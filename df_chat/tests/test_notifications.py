@@ -0,0 +1,158 @@
+from df_chat.models import BATCH_ADD_ATTEMPTS
+from df_chat.models import Message
+from df_chat.models import MessageNotificationBatch
+from df_chat.models import MessageNotificationRule
+from df_chat.models import RoomUser
+from df_chat.models import UserChat
+from df_chat.tasks import send_notification_batch_task
+from df_chat.tests.base import BaseTestUtilsMixin
+from df_notifications.models import NotificationHistory
+from django.test import TestCase
+from unittest import mock
+
+
+class TestMessageNotifications(TestCase, BaseTestUtilsMixin):
+    """
+    Testing the notifications of the new messages to the offline members of the rooms
+    """
+
+    def setUp(self):
+        self.rule = MessageNotificationRule.objects.create(
+            channel="console", template_prefix="df_chat/"
+        )
+        self.sender, _ = self.create_user()
+        self.recipients = [self.create_user()[0] for _ in range(3)]
+        self.room = self.create_room_and_add_users(self.sender, *self.recipients)
+        for user in (self.sender, *self.recipients):
+            UserChat.objects.get_user_chat(user.pk)
+            RoomUser.objects.get_room_user(room_pk=self.room.pk, user_pk=user.pk)
+        # The public rooms are muted by default
+        self.room.muted_by.clear()
+        self.room_user = RoomUser.objects.get_room_user(
+            room_pk=self.room.pk, user_pk=self.sender.pk
+        )
+
+    def send_messages(self, count):
+        with mock.patch.object(
+            send_notification_batch_task, "apply_async"
+        ) as apply_async, self.captureOnCommitCallbacks(execute=True):
+            messages = [
+                Message.objects.create(room_user=self.room_user, body=str(i))
+                for i in range(count)
+            ]
+        return messages, apply_async
+
+    def patch_send_notification(self):
+        return mock.patch(
+            "df_chat.models.send_notification",
+            side_effect=lambda *args: NotificationHistory.objects.create(
+                channel="console", template_prefix="df_chat/"
+            ),
+        )
+
+    def test_batched_notification(self):
+        """
+        Testing that a burst of messages is notified once to each recipient, when the batch is sent.
+        """
+        self.room.muted_by.add(self.recipients[0])
+        UserChat.objects.filter(user=self.recipients[1]).update(is_online=True)
+        messages, apply_async = self.send_messages(5)
+        # The messages are notified once, not when they are edited
+        messages[0].body = "Edited"
+        messages[0].save()
+
+        apply_async.assert_called_once()
+        ((batch_pk,),) = apply_async.call_args.args
+        with self.patch_send_notification() as send_notification:
+            send_notification_batch_task(batch_pk)
+            # The batch was sent already
+            send_notification_batch_task(batch_pk)
+        send_notification.assert_called_once()
+        users, channel, _, context = send_notification.call_args.args
+        self.assertEqual(users, [self.recipients[2]])
+        self.assertEqual(channel, "console")
+        self.assertEqual(context["message_count"], 5)
+        self.assertEqual(context["instance"], messages[-1])
+        self.assertEqual(context["room"], self.room)
+
+    def test_next_batch(self):
+        """
+        Testing that the messages sent after a batch start the next batch.
+        """
+        _, apply_async = self.send_messages(2)
+        ((batch_pk,),) = apply_async.call_args.args
+        with self.patch_send_notification() as send_notification:
+            send_notification_batch_task(batch_pk)
+            _, apply_async = self.send_messages(3)
+            apply_async.assert_called_once_with((batch_pk,), countdown=mock.ANY)
+            send_notification_batch_task(batch_pk)
+        self.assertEqual(
+            [
+                call.args[3]["message_count"]
+                for call in send_notification.call_args_list
+            ],
+            [2, 3],
+        )
+        self.assertEqual(MessageNotificationBatch.objects.count(), 1)
+
+    def test_batch_bounds(self):
+        """
+        Testing that a batch holds the messages added to it, even when its first message is deleted.
+        """
+        messages, apply_async = self.send_messages(3)
+        ((batch_pk,),) = apply_async.call_args.args
+        messages[0].delete()
+        # Not added to a batch yet, e.g. created while the batch is sent
+        Message.objects.create(room_user=self.room_user, body="Later")
+        with self.patch_send_notification() as send_notification:
+            send_notification_batch_task(batch_pk)
+        send_notification.assert_called_once()
+        context = send_notification.call_args.args[3]
+        self.assertEqual(context["message_count"], 2)
+        self.assertEqual(context["instance"], messages[-1])
+
+    def test_batch_deleted(self):
+        """
+        Testing that a message whose batch is deleted while it is added starts a new batch.
+        """
+        messages, apply_async = self.send_messages(2)
+        ((batch_pk,),) = apply_async.call_args.args
+        manager = MessageNotificationBatch.objects
+        get_or_create = manager.get_or_create
+        batch_pks = []
+
+        def get_or_create_deleted(**kwargs):
+            batch, created = get_or_create(**kwargs)
+            if not batch_pks:
+                # The batch is deleted, e.g. with its rule, before the message is added to it
+                manager.filter(pk=batch.pk).delete()
+            batch_pks.append(str(batch.pk))
+            return batch, created
+
+        with mock.patch.object(
+            manager, "get_or_create", side_effect=get_or_create_deleted
+        ):
+            new_batch_pk = manager.add(self.rule, messages[-1])
+        self.assertEqual(batch_pks, [batch_pk, str(new_batch_pk)])
+        self.assertNotEqual(str(new_batch_pk), batch_pk)
+        self.assertEqual(manager.get(pk=new_batch_pk).first_message, messages[-1])
+
+        # A batch deleted every time doesn't hang the request
+        stale_batch = manager.get(pk=new_batch_pk)
+        manager.filter(pk=new_batch_pk).delete()
+        with mock.patch.object(
+            manager, "get_or_create", return_value=(stale_batch, False)
+        ) as get_or_create_mock:
+            self.assertIsNone(manager.add(self.rule, messages[-1]))
+        self.assertEqual(get_or_create_mock.call_count, BATCH_ADD_ATTEMPTS)
+
+    def test_system_messages(self):
+        """
+        Testing that the system messages are not notified.
+        """
+        room_user = RoomUser.objects.get_room_user(room_pk=self.room.pk, user_pk=None)
+        with mock.patch.object(
+            send_notification_batch_task, "apply_async"
+        ) as apply_async, self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(room_user=room_user, body="Welcome")
+        apply_async.assert_not_called()
@@ -0,0 +1,198 @@
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from datetime import timedelta
+from df_chat import presence
+from df_chat.models import RoomUser
+from df_chat.models import UserChat
+from df_chat.presence import CachePresenceBackend
+from df_chat.presence import get_presence_backend
+from df_chat.presence import LocalPresenceBackend
+from df_chat.presence import PresenceWriter
+from df_chat.tests.base import BaseTestUtilsMixin
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.utils import timezone
+from tests.asgi import application
+from unittest import mock
+
+import asyncio
+import io
+import tempfile
+
+
+class TestPresenceBackends(TestCase):
+    """
+    Testing the counting of the live connections of the users
+    """
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_backends(self):
+        for backend in (LocalPresenceBackend(), CachePresenceBackend()):
+            with self.subTest(backend=backend.__class__.__name__):
+                self.assertFalse(backend.is_online(1))
+                self.assertTrue(backend.connect(1))
+                self.assertFalse(backend.connect(1))
+                self.assertTrue(backend.connect(2))
+
+                self.assertFalse(backend.disconnect(1))
+                self.assertTrue(backend.is_online(1))
+                self.assertTrue(backend.disconnect(1))
+                self.assertFalse(backend.is_online(1))
+                self.assertTrue(backend.is_online(2))
+                # A disconnection which was not counted doesn't make the user go offline twice
+                self.assertFalse(backend.disconnect(1))
+                self.assertTrue(backend.connect(1))
+
+    def test_process_local_cache(self):
+        """
+        Testing that the connections are counted in memory, with a warning, when the cache isn't shared by the workers.
+        """
+        with mock.patch.dict(presence._backends, clear=True), self.assertLogs(
+            "df_chat.presence", "WARNING"
+        ):
+            self.assertIsInstance(get_presence_backend(), LocalPresenceBackend)
+
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": location,
+                }
+            }
+        ), mock.patch.dict(presence._backends, clear=True):
+            self.assertIsInstance(get_presence_backend(), CachePresenceBackend)
+
+
+class TestPresenceWriter(TransactionTestCase, BaseTestUtilsMixin):
+    """
+    Testing the batched writes of UserChat.is_online
+    """
+
+    @override_settings(DF_CHAT={"PRESENCE_WRITE_INTERVAL": 50})
+    async def test_writes_are_batched(self):
+        user1, _ = await self.async_create_user()
+        user2, _ = await self.async_create_user()
+        writer = PresenceWriter()
+
+        async with self.async_capture_queries() as context:
+            await writer.add(user1.pk, True)
+            await writer.add(user2.pk, True)
+            # The page of user2 is reloaded
+            await writer.add(user2.pk, False)
+            await writer.add(user2.pk, True)
+            self.assertFalse(context.captured_queries)
+            await asyncio.sleep(0.1)
+
+        # The missing UserChat objects are created, then the existing ones are updated
+        queries = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"] not in ("BEGIN", "COMMIT")
+        ]
+        self.assertEqual(len(queries), 2)
+        online_user_pks = UserChat.objects.filter(is_online=True).values_list(
+            "user_id", flat=True
+        )
+        self.assertEqual(
+            set(await database_sync_to_async(list)(online_user_pks.all())),
+            {user1.pk, user2.pk},
+        )
+
+        await writer.add(user1.pk, False)
+        await writer.flush()
+        self.assertEqual(
+            set(await database_sync_to_async(list)(online_user_pks.all())), {user2.pk}
+        )
+
+
+class TestPresenceSweeper(TransactionTestCase, BaseTestUtilsMixin):
+    """
+    Testing the presence of the users whose worker was killed
+    """
+
+    def tearDown(self):
+        cache.clear()
+
+    @override_settings(
+        DF_CHAT={**settings.DF_CHAT, "PRESENCE_HEARTBEAT_INTERVAL": 0.05}
+    )
+    async def test_heartbeat_renews_lease(self):
+        user, token = await self.async_create_user()
+        communicator = WebsocketCommunicator(application, f"ws/chat/?token={token}")
+        await communicator.connect()
+        await database_sync_to_async(UserChat.objects.filter(user=user).update)(
+            presence_expires_at=timezone.now()
+        )
+
+        await asyncio.sleep(0.2)
+        user_chat = await database_sync_to_async(UserChat.objects.get)(user=user)
+        self.assertGreater(user_chat.presence_expires_at, timezone.now())
+
+        await communicator.disconnect()
+
+    async def test_sweep_expired_leases(self):
+        user1, token1 = await self.async_create_user()
+        user2, _ = await self.async_create_user()
+        user3, _ = await self.async_create_user()
+        user4, _ = await self.async_create_user()
+        room = await self.async_create_room_and_add_users(user1, user2)
+        room_user2 = await database_sync_to_async(RoomUser.objects.get_room_user)(
+            room_pk=room.pk, user_pk=user2.pk
+        )
+        communicator1 = WebsocketCommunicator(application, f"ws/chat/?token={token1}")
+        await communicator1.connect()
+
+        # user2 was connected to a worker which was killed, user3 is connected to a live worker
+        get_presence_backend().connect(user2.pk)
+        get_presence_backend().connect(user3.pk)
+        await database_sync_to_async(UserChat.objects.bulk_create)(
+            [
+                UserChat(
+                    user=user2,
+                    is_online=True,
+                    presence_expires_at=timezone.now() - timedelta(seconds=1),
+                ),
+                UserChat(
+                    user=user3,
+                    is_online=True,
+                    presence_expires_at=timezone.now() + timedelta(seconds=60),
+                ),
+                # user4 was online before the leases were introduced
+                UserChat(user=user4, is_online=True),
+            ]
+        )
+
+        async with self.async_capture_queries() as context:
+            await database_sync_to_async(call_command)(
+                "sweep_presence", stdout=io.StringIO()
+            )
+        self.assertEqual(
+            len(
+                [
+                    query
+                    for query in context.captured_queries
+                    if query["sql"].startswith('UPDATE "df_chat_userchat"')
+                ]
+            ),
+            1,
+        )
+
+        online_user_pks = UserChat.objects.filter(is_online=True).values_list(
+            "user_id", flat=True
+        )
+        self.assertEqual(
+            set(await database_sync_to_async(list)(online_user_pks)),
+            {user1.pk, user3.pk},
+        )
+        self.assertFalse(get_presence_backend().is_online(user2.pk))
+        event = await communicator1.receive_json_from()
+        self.assertEqual(event["users"][0]["id"], room_user2.pk)
+        self.assertFalse(event["users"][0]["is_online"])
+
+        await communicator1.disconnect()
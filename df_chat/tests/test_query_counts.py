@@ -0,0 +1,107 @@
+from df_chat.models import Message
+from df_chat.models import MessageNotificationRule
+from df_chat.models import RoomUser
+from df_chat.tests.base import BaseTestUtilsMixin
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+
+class TestQueryCounts(APITestCase, BaseTestUtilsMixin):
+    """
+    Testing the number of queries of the main flows, which doesn't depend on the number of messages,
+    their replies or their reactions.
+    """
+
+    def setUp(self):
+        self.user, token = self.create_user()
+        self.other_user, _ = self.create_user()
+        self.room = self.create_room_and_add_users(self.user, self.other_user)
+        self.room_user = RoomUser.objects.get_room_user(
+            room_pk=self.room.pk, user_pk=self.user.pk
+        )
+        self.other_room_user = RoomUser.objects.get_room_user(
+            room_pk=self.room.pk, user_pk=self.other_user.pk
+        )
+        self.message = self.create_message(self.other_room_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        self.messages_endpoint = reverse(
+            "rooms-messages-list", kwargs={"room_pk": self.room.pk}
+        )
+
+    def create_message(self, room_user, count=1, **kwargs):
+        for i in range(count):
+            message = Message.objects.create(room_user=room_user, body=str(i), **kwargs)
+        return message
+
+    def create_activity(self):
+        """
+        Adds messages, with replies and reactions, to the room.
+        """
+        for _ in range(3):
+            message = self.create_message(self.other_room_user)
+            parent = self.create_message(self.room_user, parent=message)
+            self.create_message(self.other_room_user, parent=parent)
+            self.create_message(self.room_user, parent=self.message)
+            self.create_message(
+                self.room_user, parent=message, is_reaction=True, count=2
+            )
+
+    def assertNumQueriesWithActivity(self, num, func):
+        with self.assertNumQueries(num):
+            func()
+        self.create_activity()
+        with self.assertNumQueries(num):
+            func()
+
+    def test_message_list(self):
+        # The user, the room, the read watermark, the messages, their images, reaction counters and the user reactions
+        self.assertNumQueriesWithActivity(
+            7, lambda: self.client.get(self.messages_endpoint)
+        )
+
+    def test_message_replies(self):
+        replies_endpoint = reverse(
+            "rooms-messages-replies",
+            kwargs={"room_pk": self.room.pk, "pk": self.message.pk},
+        )
+        self.create_message(self.room_user, parent=self.message)
+        # The user, the room, the read watermark, the message, the replies, their images,
+        # reaction counters and the user reactions
+        self.assertNumQueriesWithActivity(8, lambda: self.client.get(replies_endpoint))
+
+    def test_room_list(self):
+        # The user, the rooms, their users, their last messages, and the images and reactions of the last messages
+        self.assertNumQueriesWithActivity(
+            7, lambda: self.client.get(reverse("rooms-list"))
+        )
+
+    def test_message_create(self):
+        self.assertNumQueriesWithActivity(
+            12, lambda: self.client.post(self.messages_endpoint, {"body": "Hi"})
+        )
+
+    def test_message_seen(self):
+        seen_endpoint = reverse("rooms-messages-seen", kwargs={"room_pk": self.room.pk})
+        with self.assertNumQueries(6):
+            self.client.post(
+                seen_endpoint, {"message_ids": [str(self.message.pk)]}, format="json"
+            )
+        self.create_activity()
+        message_ids = [str(pk) for pk in Message.objects.values_list("pk", flat=True)]
+        with self.assertNumQueries(6):
+            self.client.post(seen_endpoint, {"message_ids": message_ids}, format="json")
+
+    def test_message_read(self):
+        read_endpoint = reverse("rooms-messages-read", kwargs={"room_pk": self.room.pk})
+        self.assertNumQueriesWithActivity(
+            6,
+            lambda: self.client.post(
+                read_endpoint, {"message_id": str(self.message.pk)}
+            ),
+        )
+
+    def test_notification_users(self):
+        # The room user of the message is known already
+        self.assertNumQueriesWithActivity(
+            1, lambda: list(MessageNotificationRule().get_users(self.message))
+        )
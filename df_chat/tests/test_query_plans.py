@@ -0,0 +1,89 @@
+from df_chat.drf.viewsets import MessageViewSet
+from df_chat.drf.viewsets import RoomViewSet
+from df_chat.models import Message
+from df_chat.models import MessageNotificationRule
+from df_chat.models import RoomUser
+from df_chat.tests.base import BaseTestUtilsMixin
+from django.db import connection
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from typing import Set
+
+import re
+
+
+# The tables (or their aliases) read entirely, in the plans of SQLite and PostgreSQL
+FULL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX)"),
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+}
+
+
+class TestQueryPlans(TestCase, BaseTestUtilsMixin):
+    """
+    Testing that the hot queries are backed by indexes, with the plans of the database.
+    """
+
+    def setUp(self):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            self.skipTest(f"Query plans of {connection.vendor} are not supported")
+        if connection.vendor == "postgresql":
+            # The tables of the tests are tiny, PostgreSQL would read them entirely even with an index
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        self.user, _ = self.create_user()
+        self.room = self.create_room_and_add_users(self.user)
+        self.room_user = RoomUser.objects.get_room_user(
+            room_pk=self.room.pk, user_pk=self.user.pk
+        )
+        self.message = Message.objects.create(room_user=self.room_user, body="Hi")
+        self.request = Request(APIRequestFactory().get("/"))
+        self.request.user = self.user
+
+    def get_full_scans(self, queryset) -> Set[str]:
+        plan = queryset.explain()
+        return set(FULL_SCAN_PATTERNS[connection.vendor].findall(plan))
+
+    def test_message_list(self):
+        view = MessageViewSet(
+            request=self.request,
+            kwargs={"room_pk": self.room.pk},
+            action="list",
+            format_kwarg=None,
+        )
+        queryset = view.get_queryset().order_by("-created", "-pk")[:50]
+        self.assertEqual(self.get_full_scans(queryset), set())
+        # The messages are read in the order of the index, without sorting them
+        self.assertIn("df_chat_message_list", queryset.explain())
+        if connection.vendor == "sqlite":
+            self.assertNotIn("TEMP B-TREE FOR ORDER BY", queryset.explain())
+
+    def test_room_list(self):
+        view = RoomViewSet(
+            request=self.request, kwargs={}, action="list", format_kwarg=None
+        )
+        queryset = view.get_queryset()[:50]
+        # The public rooms are listed too, so the rooms are read entirely, but not their messages.
+        self.assertLessEqual(self.get_full_scans(queryset), {"df_chat_room"})
+        # The new messages are counted after the read watermark
+        self.assertIn("df_chat_message_unread", queryset.explain())
+
+    def test_notification_users(self):
+        queryset = MessageNotificationRule().get_users(self.message)
+        self.assertEqual(self.get_full_scans(queryset), set())
+
+    def test_room_user_lookup(self):
+        queryset = RoomUser.objects.filter(
+            room=self.room, user=self.user, is_active=True
+        )
+        self.assertEqual(self.get_full_scans(queryset), set())
+        self.assertIn("df_chat_roomuser_member", queryset.explain())
+
+    def test_message_search(self):
+        queryset = Message.objects.filter(room=self.room).search("hi")
+        # The full-text index is read instead of the messages
+        self.assertLessEqual(
+            self.get_full_scans(queryset.order_by("-rank", "-pk")[:20]),
+            {"df_chat_message_fts"},
+        )
@@ -0,0 +1,90 @@
+from df_chat.models import Message
+from df_chat.models import RoomUser
+from df_chat.tests.base import BaseTestUtilsMixin
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+
+class TestRoomEndpoint(APITestCase, BaseTestUtilsMixin):
+    """
+    Testing the RESTful API rooms endpoint
+    """
+
+    def create_room_with_messages(self, user, *bodies):
+        room = self.create_room_and_add_users(user)
+        room_user = RoomUser.objects.get_room_user(room_pk=room.pk, user_pk=user.pk)
+        messages = [
+            Message.objects.create(room_user=room_user, body=body) for body in bodies
+        ]
+        if messages:
+            Message.objects.create(
+                room_user=room_user, parent=messages[0], is_reaction=True, body="+"
+            )
+        return room, messages
+
+    def test_room_list_last_message(self):
+        """
+        Testing that the rooms are listed by their last activity, with their last message.
+        """
+        user, token = self.create_user()
+        room, messages = self.create_room_with_messages(user, "Hi", "Hello")
+        other_room, _ = self.create_room_with_messages(user, "Bye")
+        empty_room, _ = self.create_room_with_messages(user)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        rooms_endpoint = reverse("rooms-list")
+        rooms = self.client.get(rooms_endpoint).json()
+        self.assertEqual(
+            [r["id"] for r in rooms],
+            [str(empty_room.pk), str(other_room.pk), str(room.pk)],
+        )
+        self.assertEqual(rooms[2]["last_message"]["body"], "Hello")
+
+        messages[1].delete()
+        Message.objects.create(room_user=messages[0].room_user, body="Again")
+        rooms = self.client.get(rooms_endpoint).json()
+        self.assertEqual(rooms[0]["id"], str(room.pk))
+        self.assertEqual(rooms[0]["last_message"]["body"], "Again")
+
+        Message.objects.filter(room=room).order_by("-created").first().delete()
+        rooms = self.client.get(rooms_endpoint).json()
+        # The activity of the room moves back to its last message
+        self.assertEqual(
+            [r["id"] for r in rooms],
+            [str(empty_room.pk), str(other_room.pk), str(room.pk)],
+        )
+        self.assertEqual(rooms[2]["last_message"]["body"], "Hi")
+        # or to its creation, once it has no message
+        Message.objects.filter(room=other_room).delete()
+        other_room.refresh_from_db()
+        self.assertEqual(other_room.last_activity_at, other_room.created)
+
+        # The last message is a reply, deleted along with the message it replies to
+        message = Message.objects.create(room_user=messages[0].room_user, body="Ask")
+        Message.objects.create(
+            room_user=messages[0].room_user, parent=message, body="Answer"
+        )
+        message.delete()
+        rooms = self.client.get(rooms_endpoint).json()
+        self.assertEqual(rooms[-1]["id"], str(room.pk))
+        self.assertEqual(rooms[-1]["last_message"]["body"], "Hi")
+
+    def test_room_list_query_count(self):
+        """
+        Testing that the number of queries of the room list doesn't depend on the number of rooms.
+        """
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+        rooms_endpoint = reverse("rooms-list")
+
+        query_counts = []
+        for room_count in (1, 5):
+            for _ in range(room_count):
+                self.create_room_with_messages(user, "Hi", "Hello")
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(rooms_endpoint)
+            self.assertEqual(response.status_code, 200)
+            query_counts.append(len(context))
+        self.assertEqual(query_counts[0], query_counts[1])
@@ -0,0 +1,155 @@
+"""
+Resumable uploads of the images of the messages, received in chunks.
+
+An upload is initiated with the name and the size of the image, then its chunks are sent in order with a
+`Content-Range` header. Every chunk is streamed to the storage as a part of the upload, so a failed request only
+loses its own chunk, and the client resumes from the `offset` of the upload. Once all the chunks are received,
+they are joined in a temporary file on disk, and attached to a message like an image uploaded at once.
+The uploads which received no chunk for `IMAGE_UPLOAD_TTL` seconds are deleted by `expire_uploads`.
+"""
+from datetime import timedelta
+from df_chat.models import MessageImage
+from df_chat.models import MessageImageUpload
+from df_chat.settings import api_settings
+from django.core.files.base import File
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.utils import timezone
+from functools import partial
+from rest_framework import exceptions
+from typing import BinaryIO
+from typing import List
+from typing import Tuple
+
+import re
+
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+class OffsetConflict(exceptions.APIException):
+    status_code = 409
+    default_detail = "The chunk doesn't start at the offset of the upload."
+    default_code = "offset_conflict"
+
+
+class ChunkStream:
+    """
+    Reads a chunk from the request, counting its bytes and stopping at its declared length.
+    """
+
+    def __init__(self, stream: BinaryIO, length: int):
+        self.stream = stream
+        self.remaining = length
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining + 1:
+            # One more byte is read to detect the chunks longer than declared
+            size = self.remaining + 1
+        data = self.stream.read(size) if self.stream is not None else b""
+        self.remaining -= len(data)
+        self.count += len(data)
+        return data
+
+
+def get_storage():
+    return MessageImage._meta.get_field("image").storage
+
+
+def parse_content_range(header: str, size: int) -> Tuple[int, int]:
+    """
+    Returns the start and the end (excluded) of a chunk from its `Content-Range: bytes <first>-<last>/<size>` header.
+    """
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise exceptions.ValidationError(
+            "The Content-Range header must be `bytes <first>-<last>/<size>`"
+        )
+    first, last, total = match.groups()
+    start, end = int(first), int(last) + 1
+    if start >= end or end > size or total not in ("*", str(size)):
+        raise exceptions.ValidationError(
+            "The Content-Range header doesn't match the size of the upload"
+        )
+    return start, end
+
+
+def save_chunk(
+    upload: MessageImageUpload, stream: BinaryIO, start: int, end: int
+) -> None:
+    """
+    Streams a chunk to the storage, and moves the offset of the upload after it.
+    A chunk which doesn't start at the offset, e.g. sent twice, is rejected.
+    """
+    if start != upload.offset:
+        raise OffsetConflict(
+            f"The chunk starts at {start}, the upload continues at {upload.offset}."
+        )
+    storage = get_storage()
+    chunk = ChunkStream(stream, end - start)
+    part = storage.save(f"uploads/images/{upload.id}/{start}", File(chunk))
+    if chunk.count != end - start:
+        storage.delete(part)
+        raise exceptions.ValidationError(
+            "The length of the chunk doesn't match its Content-Range header"
+        )
+
+    parts = [*upload.parts, part]
+    # A concurrent request may have sent the same chunk in the meantime
+    if not MessageImageUpload.objects.filter(pk=upload.pk, offset=start).update(
+        offset=end, parts=parts, modified=timezone.now()
+    ):
+        storage.delete(part)
+        raise OffsetConflict()
+    upload.offset, upload.parts = end, parts
+
+
+def open_upload(upload: MessageImageUpload) -> TemporaryUploadedFile:
+    """
+    Joins the chunks of a complete upload in a temporary file on disk, as Django does for the large uploads.
+    """
+    if upload.offset != upload.size:
+        raise exceptions.ValidationError(
+            f"The upload is incomplete, it continues at {upload.offset}."
+        )
+    storage = get_storage()
+    file = TemporaryUploadedFile(upload.name, None, upload.size, None)
+    for part in upload.parts:
+        with storage.open(part, "rb") as chunk:
+            for data in chunk.chunks():
+                file.write(data)
+    file.seek(0)
+    return file
+
+
+def delete_parts(parts: List[str]) -> None:
+    storage = get_storage()
+    for part in parts:
+        storage.delete(part)
+
+
+def delete_upload(upload: MessageImageUpload) -> None:
+    upload.delete()
+    # The chunks are kept until the upload is deleted for good
+    transaction.on_commit(partial(delete_parts, upload.parts))
+
+
+def expire_uploads() -> int:
+    """
+    Deletes the uploads which received no chunk for `IMAGE_UPLOAD_TTL` seconds, with their chunks.
+    Returns the number of uploads deleted.
+    """
+    expires_at = timezone.now() - timedelta(seconds=api_settings.IMAGE_UPLOAD_TTL)
+    with transaction.atomic():
+        # A chunk saved concurrently either renews the upload first, or finds it deleted and discards itself
+        uploads = list(
+            MessageImageUpload.objects.select_for_update()
+            .filter(modified__lt=expires_at)
+            .values_list("pk", "parts")
+        )
+        MessageImageUpload.objects.filter(pk__in=[pk for pk, _ in uploads]).delete()
+        transaction.on_commit(
+            partial(delete_parts, [part for _, parts in uploads for part in parts])
+        )
+    return len(uploads)
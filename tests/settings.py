@@ -120,3 +120,9 @@ REST_FRAMEWORK = {
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
 }
+
+DF_CHAT = {
+    # Persist the presence right away, so that the tests don't depend on timing
+    "PRESENCE_WRITE_INTERVAL": 0,
+    "RECEIPT_WRITE_INTERVAL": 0,
+}